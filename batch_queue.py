@@ -0,0 +1,198 @@
+import queue
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, List, Dict
+
+from process_data import MkvProcessor, MergeTask, TaskQueue
+
+logger = logging.getLogger(__name__)
+
+# Как часто планировщик проверяет, не добавлены ли в очередь новые сериалы
+QUEUE_POLL_INTERVAL = 0.2
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_ERROR = 'error'
+JOB_STOPPED = 'stopped'
+
+
+class BatchJob:
+    """Один сериал в пакетной очереди."""
+
+    def __init__(self, series_path: str, output_path: str,
+                 audio_data: List[Dict], subtitle_data: List[Dict]):
+        self.series_path = series_path
+        self.output_path = output_path
+        self.audio_data = audio_data
+        self.subtitle_data = subtitle_data
+        self.video_files: List[str] = []
+        self.results: Dict[str, Optional[bool]] = {}
+        self.status = JOB_QUEUED
+
+    def __repr__(self):
+        return f"BatchJob({self.series_path!r} -> {self.output_path!r}, {self.status})"
+
+
+class BatchQueue:
+    """Пакетная очередь сериалов с общим планировщиком эпизодов.
+
+    Эпизоды всех сериалов попадают в один пул задач MkvProcessor, поэтому ограничение
+    параллельности и прогресс считаются по всему пакету. Новые сериалы можно добавлять,
+    пока обрабатываются предыдущие. Сериалы готовятся (обход папки, сопоставление
+    дорожек, mkvmerge -J) в отдельном потоке, чтобы планировщик тем временем запускал
+    и собирал задачи уже подготовленных сериалов.
+    """
+
+    def __init__(self, processor: Optional[MkvProcessor] = None):
+        self.processor = processor or MkvProcessor()
+        self.jobs: List[BatchJob] = []
+        self._incoming: 'queue.Queue[Optional[BatchJob]]' = queue.Queue()
+        # Задачи подготовленных сериалов, ещё не переданные планировщику
+        self._ready: 'queue.Queue[List[MergeTask]]' = queue.Queue()
+        # Сериалы, добавленные, но ещё не подготовленные
+        self._unprepared = 0
+        self._lock = threading.Lock()
+        # Очередь закрывается, когда run() обработал все задачи; после этого add() их не принимает
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        with self._lock:
+            return self._closed
+
+    def add(self, series_path: str, output_path: str,
+            audio_data: List[Dict], subtitle_data: List[Dict]) -> Optional[BatchJob]:
+        """Добавление сериала; во время работы run() его эпизоды сразу попадают в пул.
+
+        Возвращает None, если очередь уже закрыта и нужна новая.
+        """
+        job = BatchJob(series_path, output_path, audio_data, subtitle_data)
+        with self._lock:
+            if self._closed:
+                return None
+            self.jobs.append(job)
+            self._unprepared += 1
+            self._incoming.put(job)
+        return job
+
+    def stop(self):
+        self.processor.stop()
+
+    def _prepare_loop(self):
+        """Поток подготовки: задачи каждого добавленного сериала передаются планировщику."""
+        while True:
+            job = self._incoming.get()
+            if job is None:
+                return
+            try:
+                if not self.processor.stop_requested:
+                    tasks = self._prepare(job)
+                    if tasks:
+                        self._ready.put(tasks)
+            except Exception as e:
+                job.status = JOB_ERROR
+                self.processor._emit_error(f"Critical error: {str(e)}")
+                logger.error(f"Unable to prepare {job.series_path}", exc_info=True)
+            finally:
+                with self._lock:
+                    self._unprepared -= 1
+
+    def _prepare(self, job: BatchJob) -> Optional[List[MergeTask]]:
+        """Эпизоды сериала, сопоставленные с дорожками и с зарезервированным местом."""
+        processor = self.processor
+        if not processor._validate_paths(job.series_path, job.output_path):
+            job.status = JOB_ERROR
+            return None
+        video_files = processor._prepare_series(job.series_path, job.output_path,
+                                                job.audio_data, job.subtitle_data)
+        if not video_files:
+            job.status = JOB_ERROR if video_files is None else JOB_DONE
+            return None
+        tasks = processor._reserve_space(
+            processor._make_tasks(video_files, job.series_path, job.output_path,
+                                  job.audio_data, job.subtitle_data, job),
+            job.output_path)
+        if not tasks:
+            job.status = JOB_ERROR
+            return None
+        job.video_files = [task.video_file for task in tasks]
+        job.status = JOB_RUNNING
+        processor._add_to_total(tasks)
+        processor._emit_status(f"Queued {len(tasks)} files from: {job.series_path}")
+        return tasks
+
+    def _take_ready(self, pending: TaskQueue, block: bool):
+        """Перенос подготовленных задач в общую очередь; block — подождать их, если пул пуст."""
+        try:
+            tasks = self._ready.get(timeout=QUEUE_POLL_INTERVAL) if block else self._ready.get_nowait()
+        except queue.Empty:
+            return
+        while True:
+            for task in tasks:
+                pending.push(task)
+            try:
+                tasks = self._ready.get_nowait()
+            except queue.Empty:
+                return
+
+    @staticmethod
+    def _update_job_status(job: BatchJob):
+        if len(job.results) < len(job.video_files):
+            return
+        job.status = JOB_FAILED if any(result is False for result in job.results.values()) else JOB_DONE
+
+    def run(self):
+        """Обработка очереди, пока в ней есть сериалы (включая добавленные во время работы)."""
+        processor = self.processor
+        processor.errors = []
+        try:
+            mkvmerge_path = processor.find_mkvmerge()
+            if not mkvmerge_path:
+                return
+            processor._begin_run()
+
+            preparer = threading.Thread(target=self._prepare_loop, name='batch-prepare', daemon=True)
+            preparer.start()
+            pending = TaskQueue()
+            running: Dict[Future, MergeTask] = {}
+            try:
+                with ThreadPoolExecutor(max_workers=processor.max_jobs) as executor:
+                    while True:
+                        if processor.stop_requested:
+                            # Ещё не начатые задачи не запускаются, запущенные прерывает stop()
+                            processor._cancel_pending(pending)
+                        else:
+                            self._take_ready(pending, block=not running and not len(pending))
+                            processor._submit_ready(executor, pending, running, mkvmerge_path)
+                        if not running:
+                            # Решение о завершении принимается под блокировкой, чтобы не потерять
+                            # сериал, добавленный или подготовленный в этот момент
+                            with self._lock:
+                                if processor.stop_requested or (
+                                        not self._unprepared and self._ready.empty() and not len(pending)):
+                                    self._closed = True
+                                    break
+                            continue
+                        done, _ = wait(running, timeout=QUEUE_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                        for task, result in processor._collect_done(done, running):
+                            task.job.results[task.video_file] = result
+                            self._update_job_status(task.job)
+            finally:
+                # Подготовка текущего сериала дожидается окончания: после выхода из run()
+                # процессор не должен меняться из другого потока
+                self._incoming.put(None)
+                preparer.join()
+                # Подготовленные, но не начатые задачи снимаются вместе с резервом места
+                self._take_ready(pending, block=False)
+                processor._cancel_pending(pending)
+
+            for job in self.jobs:
+                if job.status in (JOB_QUEUED, JOB_RUNNING):
+                    job.status = JOB_STOPPED
+            processor._finish_run()
+        finally:
+            with self._lock:
+                self._closed = True
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""Заглушка mkvmerge для бенчмарков: не требует MKVToolNix и работает офлайн.
+
+Поведение задаётся переменными окружения:
+    FAKE_MKVMERGE_RUNTIME      минимальное время работы в секундах (по умолчанию 0)
+    FAKE_MKVMERGE_THROUGHPUT   скорость в МБ/с; время работы = размер входов / скорость
+    FAKE_MKVMERGE_EXIT_CODE    код завершения для всех вызовов (0 — успех, 1 — предупреждения, 2 — ошибка)
+    FAKE_MKVMERGE_FAIL_EVERY   каждый N-й эпизод (по имени результата) завершается с кодом 2
+    FAKE_MKVMERGE_PROGRESS     число строк #GUI#progress за время работы (по умолчанию 10)
+    FAKE_MKVMERGE_WRITE        0 — не создавать выходной файл
+    FAKE_MKVMERGE_IGNORE_TERM  1 — игнорировать SIGTERM (проверка принудительного завершения)
+
+`-J <файл>` выводит сведения о дорожках по расширению и суффиксу языка в имени:
+видео — дорожки h264 и японского AAC, "Ep01.rus.mka" — русская дорожка и т.д.
+Результат заглушки хранит свои дорожки в заголовке, поэтому -J для него точен.
+С первым аргументом --propedit работает как mkvpropedit.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import signal
+
+VERSION = "mkvmerge v80.0 ('Fake Benchmark') 64-bit"
+OPTIONS_WITH_VALUE = {'-o', '--output', '--language', '--track-name'}
+
+
+def _parse(args):
+    output, inputs = None, []
+    args = iter(args)
+    for arg in args:
+        if arg in ('-o', '--output'):
+            output = next(args, None)
+        elif arg in OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith('-'):
+            inputs.append(arg)
+    return output, inputs
+
+
+def _expand_options_files(argv):
+    """Подстановка аргументов из JSON-файлов опций (@options.json), как в mkvmerge."""
+    args = []
+    for arg in argv:
+        if arg.startswith('@'):
+            with open(arg[1:], 'r', encoding='utf-8') as f:
+                args.extend(json.load(f))
+        else:
+            args.append(arg)
+    return args
+
+
+def _input_size(inputs) -> int:
+    total = 0
+    for path in inputs:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass
+    return total
+
+
+def _exit_code(output: str) -> int:
+    code = int(os.environ.get('FAKE_MKVMERGE_EXIT_CODE', '0'))
+    fail_every = int(os.environ.get('FAKE_MKVMERGE_FAIL_EVERY', '0'))
+    if fail_every > 0 and output:
+        name = os.path.basename(output).encode('utf-8', 'replace')
+        if zlib.crc32(name) % fail_every == 0:
+            return 2
+    return code
+
+
+# Расширение -> (тип дорожки mkvmerge, кодек)
+CODECS = {
+    '.mka': ('audio', 'AAC'), '.aac': ('audio', 'AAC'), '.mp3': ('audio', 'MP3'),
+    '.ac3': ('audio', 'AC-3'), '.dts': ('audio', 'DTS'), '.flac': ('audio', 'FLAC'),
+    '.ogg': ('audio', 'Vorbis'), '.wav': ('audio', 'PCM'),
+    '.srt': ('subtitles', 'SubRip/SRT'), '.ass': ('subtitles', 'SubStationAlpha'),
+    '.ssa': ('subtitles', 'SubStationAlpha'), '.vtt': ('subtitles', 'WebVTT'),
+}
+
+
+# Заголовок результата заглушки: сведения о дорожках для последующего -J и mkvpropedit
+HEADER_MAGIC = b'FAKEMKV1 '
+
+
+def _read_header(path: str):
+    with open(path, 'rb') as f:
+        line = f.readline(1024 * 1024)
+    if line.startswith(HEADER_MAGIC):
+        return json.loads(line[len(HEADER_MAGIC):].decode('utf-8'))
+    return None
+
+
+def _write_file(path: str, tracks, size: int):
+    header = HEADER_MAGIC + json.dumps(tracks, ensure_ascii=False).encode('utf-8') + b'\n'
+    # Разреженный файл: на диске занимает только заголовок
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(max(size, len(header)))
+
+
+def _file_tracks(path: str):
+    """Дорожки файла: из заголовка результата заглушки или по расширению и суффиксу языка."""
+    tracks = _read_header(path)
+    if tracks is not None:
+        return tracks
+    stem, ext = os.path.splitext(os.path.basename(path))
+    suffix = os.path.splitext(stem)[1][1:].lower()
+    language = suffix if 2 <= len(suffix) <= 3 and suffix.isalpha() else 'und'
+    if ext.lower() == '.mkv':
+        guessed = [('video', 'AVC/H.264/MPEG-4p10', 'und'), ('audio', 'AAC', 'jpn')]
+    else:
+        guessed = [CODECS.get(ext.lower(), ('audio', 'AAC')) + (language,)]
+    return [{'type': track_type, 'codec': codec,
+             'properties': {'language': track_language, 'default_track': number < 2}}
+            for number, (track_type, codec, track_language) in enumerate(guessed)]
+
+
+def _identify(path: str) -> int:
+    if not os.path.isfile(path):
+        print(json.dumps({'container': {'recognized': False}, 'errors': [f"File '{path}' not found"]}))
+        return 2
+    tracks = [dict(track, id=number) for number, track in enumerate(_file_tracks(path))]
+    print(json.dumps({
+        'container': {'recognized': True, 'supported': True, 'type': 'Matroska'},
+        'file_name': path,
+        'tracks': tracks,
+    }))
+    return 0
+
+
+def _merged_tracks(args):
+    """Дорожки результата: дорожки входов по порядку с --language/--track-name, заданными перед файлом."""
+    merged, pending = [], {}
+    args = iter(args)
+    for arg in args:
+        if arg in ('-o', '--output'):
+            next(args, None)
+        elif arg in ('--language', '--track-name'):
+            track_id, _, value = (next(args, None) or '').partition(':')
+            key = 'language' if arg == '--language' else 'track_name'
+            pending.setdefault(int(track_id or 0), {})[key] = value
+        elif not arg.startswith('-'):
+            for number, track in enumerate(_file_tracks(arg)):
+                properties = dict(track.get('properties', {}), **pending.get(number, {}))
+                merged.append(dict(track, properties=properties))
+            pending = {}
+    return merged
+
+
+def propedit(argv) -> int:
+    """Заглушка mkvpropedit: --edit track:N, --set key=value, --delete key."""
+    path, rest = argv[0], argv[1:]
+    tracks = _read_header(path) if os.path.isfile(path) else None
+    if tracks is None:
+        print(f"Error: The file '{path}' is not a Matroska file or it could not be found.")
+        return 2
+    keys = {'name': 'track_name', 'language': 'language'}
+    current = None
+    args = iter(rest)
+    for arg in args:
+        value = next(args, '')
+        if arg == '--edit':
+            number = int(value.split(':', 1)[1])
+            if not 1 <= number <= len(tracks):
+                print(f"Error: No track corresponding to the edit specification '{value}' was found.")
+                return 2
+            current = tracks[number - 1].setdefault('properties', {})
+        elif arg == '--set' and current is not None:
+            key, _, new_value = value.partition('=')
+            current[keys.get(key, key)] = new_value
+        elif arg == '--delete' and current is not None:
+            current.pop(keys.get(value, value), None)
+    _write_file(path, tracks, os.path.getsize(path))
+    print("The changes are written to the file.")
+    return 0
+
+
+def main(argv) -> int:
+    if argv[:1] == ['--propedit']:
+        return propedit(argv[1:])
+    argv = _expand_options_files(argv)
+    if '--version' in argv:
+        print(VERSION)
+        return 0
+    for flag in ('-J', '--identify'):
+        if flag in argv and argv.index(flag) + 1 < len(argv):
+            return _identify(argv[argv.index(flag) + 1])
+
+    output, inputs = _parse(argv)
+    size = _input_size(inputs)
+    runtime = float(os.environ.get('FAKE_MKVMERGE_RUNTIME', '0'))
+    throughput = float(os.environ.get('FAKE_MKVMERGE_THROUGHPUT', '0'))
+    if throughput > 0:
+        runtime = max(runtime, size / (throughput * 1024 * 1024))
+
+    if os.environ.get('FAKE_MKVMERGE_IGNORE_TERM') == '1':
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    gui_mode = '--gui-mode' in argv
+    steps = max(1, int(os.environ.get('FAKE_MKVMERGE_PROGRESS', '10')))
+    print(f"{VERSION} started.", flush=True)
+    for step in range(1, steps + 1):
+        if runtime:
+            time.sleep(runtime / steps)
+        if gui_mode:
+            print(f"#GUI#progress {step * 100 // steps}%", flush=True)
+        else:
+            print(f"Progress: {step * 100 // steps}%", flush=True)
+
+    code = _exit_code(output)
+    if code >= 2:
+        print(f"Error: simulated failure for '{output}'.", flush=True)
+        return code
+    if output and os.environ.get('FAKE_MKVMERGE_WRITE', '1') != '0':
+        # Разреженный файл размером с сумму входов: на диске почти не занимает места
+        _write_file(output, _merged_tracks(argv), size)
+    print("Multiplexing took 0 seconds.", flush=True)
+    return code
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
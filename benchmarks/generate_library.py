@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Генератор синтетической библиотеки сериала для бенчмарков.
+
+Создаёт папку с видео и папки с озвучками и субтитрами с реалистичными именами
+(релиз-группа, номер эпизода, качество, суффиксы дорожек). Файлы разреженные,
+поэтому даже 100 тысяч эпизодов почти не занимают места на диске. Видео начинаются
+с настоящего заголовка Matroska (видео AVC и аудио AAC), чтобы проходить проверку
+заголовка и опознаваться без запуска mkvmerge.
+
+Пример:
+    python benchmarks/generate_library.py /tmp/bench --episodes 10000 --audio 2 --subs 2
+"""
+import os
+import sys
+import random
+import argparse
+from typing import List, Dict
+
+RELEASE_GROUPS = ['SubsPlease', 'Erai-raws', 'HorribleSubs', 'Judas', 'ASW']
+SHOW_NAMES = ['Shingeki no Kyojin', 'One Piece', 'Detective Conan', 'Gintama', 'Naruto Shippuden']
+AUDIO_SOURCES = [('AniDub', 'rus', '.mka'), ('AniLibria', 'rus', '.mka'), ('Original', 'jpn', '.aac'),
+                 ('Netflix', 'eng', '.ac3')]
+SUBTITLE_SOURCES = [('Crunchyroll', 'eng', '.ass'), ('Fansub', 'rus', '.ass'), ('Official', 'eng', '.srt')]
+
+
+# Имена дорожек: same — как у видео с суффиксом языка, episode — "Show.S01E0042.rus"
+TRACK_NAMING = ('same', 'episode')
+
+
+def episode_names(episodes: int, seed: int = 0) -> List[str]:
+    """Имена эпизодов без расширения, например "[SubsPlease] Gintama - 0042 [1080p]"."""
+    rng = random.Random(seed)
+    group = rng.choice(RELEASE_GROUPS)
+    show = rng.choice(SHOW_NAMES)
+    width = max(2, len(str(episodes)))
+    quality = rng.choice(['720p', '1080p'])
+    return [f"[{group}] {show} - {number:0{width}d} [{quality}]" for number in range(1, episodes + 1)]
+
+
+def _track_stem(name: str, number: int, width: int, naming: str) -> str:
+    if naming == 'episode':
+        show = name.split('] ', 1)[-1].split(' - ', 1)[0].replace(' ', '.')
+        return f"{show}.S01E{number:0{width}d}"
+    return name
+
+
+def _touch(path: str, size: int):
+    with open(path, 'wb') as f:
+        if size:
+            f.truncate(size)
+
+
+def _ebml(element_id: int, payload: bytes) -> bytes:
+    """Элемент EBML с восьмибайтовым размером."""
+    return element_id.to_bytes((element_id.bit_length() + 7) // 8, 'big') \
+        + (0x01 << 56 | len(payload)).to_bytes(8, 'big') + payload
+
+
+def _matroska_header(file_size: int) -> bytes:
+    """EBML-заголовок и начало сегмента размером до конца файла file_size."""
+    header = _ebml(0x1A45DFA3, _ebml(0x4282, b'matroska') + _ebml(0x4287, b'\x04') + _ebml(0x4285, b'\x02'))
+    info = _ebml(0x1549A966, _ebml(0x2AD7B1, (1000000).to_bytes(3, 'big')) + _ebml(0x4D80, b'generate_library'))
+    tracks = _ebml(0x1654AE6B,
+                   _ebml(0xAE, _ebml(0xD7, b'\x01') + _ebml(0x83, b'\x01') + _ebml(0x86, b'V_MPEG4/ISO/AVC')
+                         + _ebml(0x22B59C, b'und'))
+                   + _ebml(0xAE, _ebml(0xD7, b'\x02') + _ebml(0x83, b'\x02') + _ebml(0x86, b'A_AAC')
+                           + _ebml(0x22B59C, b'jpn')))
+    segment_start = len(header) + 4 + 8
+    segment_size = max(file_size - segment_start, len(info) + len(tracks))
+    return header + (0x18538067).to_bytes(4, 'big') + (0x01 << 56 | segment_size).to_bytes(8, 'big') + info + tracks
+
+
+def _write_video(path: str, size: int):
+    header = _matroska_header(size)
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.truncate(max(size, len(header)))
+
+
+def generate_library(root: str, episodes: int, audio_sources: int = 1, subtitle_sources: int = 1,
+                     file_size: int = 1024 * 1024, decoys: int = 0, seed: int = 0,
+                     track_naming: str = 'same', size_jitter: float = 0.0,
+                     special_factor: float = 1.0) -> Dict:
+    """Создание дерева библиотеки; возвращает пути и параметры дорожек для MkvProcessor.
+
+    decoys — число лишних файлов в каждой папке дорожек (без пары среди видео).
+    size_jitter — разброс размеров видео (0.5 — от 50% до 150% file_size),
+    special_factor — во сколько раз последний эпизод больше остальных (спецвыпуск).
+    """
+    width = max(2, len(str(episodes)))
+    rng = random.Random(seed)
+    names = episode_names(episodes, seed)
+    series_path = os.path.join(root, 'series')
+    output_path = os.path.join(root, 'output')
+    os.makedirs(series_path, exist_ok=True)
+    os.makedirs(output_path, exist_ok=True)
+    size_rng = random.Random(seed + 1)
+    for number, name in enumerate(names, 1):
+        size = int(file_size * (1 + size_rng.uniform(-size_jitter, size_jitter)))
+        if number == episodes:
+            size = int(size * special_factor)
+        _write_video(os.path.join(series_path, f"{name}.mkv"), size)
+
+    audio_data, subtitle_data = [], []
+    for sources, target, track_size in ((AUDIO_SOURCES[:audio_sources], audio_data, file_size // 8),
+                                        (SUBTITLE_SOURCES[:subtitle_sources], subtitle_data, 0)):
+        for title, language, extension in sources:
+            track_dir = os.path.join(root, title)
+            os.makedirs(track_dir, exist_ok=True)
+            for number, name in enumerate(names, 1):
+                stem = _track_stem(name, number, width, track_naming)
+                _touch(os.path.join(track_dir, f"{stem}.{language}{extension}"), track_size)
+            for number in range(decoys):
+                _touch(os.path.join(track_dir, f"Extra {rng.randrange(10 ** 6):06d} {number}{extension}"), 0)
+            target.append({'path': track_dir, 'language': language, 'track_name': title})
+
+    return {
+        'series_path': series_path,
+        'output_path': output_path,
+        'audio_data': audio_data,
+        'subtitle_data': subtitle_data,
+        'episodes': episodes,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Generate a synthetic series library')
+    parser.add_argument('root', help='directory to create the library in')
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--audio', type=int, default=1, help=f'audio sources (max {len(AUDIO_SOURCES)})')
+    parser.add_argument('--subs', type=int, default=1, help=f'subtitle sources (max {len(SUBTITLE_SOURCES)})')
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help='apparent video file size in bytes')
+    parser.add_argument('--decoys', type=int, default=0, help='unmatched files per track folder')
+    parser.add_argument('--size-jitter', type=float, default=0.0,
+                        help='spread of video sizes, e.g. 0.5 for 50%%..150%% of --file-size')
+    parser.add_argument('--special-factor', type=float, default=1.0,
+                        help='make the last episode this many times larger')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--track-naming', choices=TRACK_NAMING, default='same',
+                        help='name tracks like the videos or as Show.S01Exx')
+    args = parser.parse_args(argv)
+
+    library = generate_library(args.root, args.episodes, args.audio, args.subs,
+                               args.file_size, args.decoys, args.seed, args.track_naming,
+                               args.size_jitter, args.special_factor)
+    print(f"Generated {library['episodes']} episodes in {args.root}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Бенчмарк сопоставления дорожек и планировщика MkvProcessor на синтетической библиотеке.
+
+Работает офлайн на Linux без MKVToolNix: вместо mkvmerge запускается fake_mkvmerge.py.
+Каждый размер библиотеки измеряется в отдельном процессе, чтобы пиковый RSS не
+накапливался между прогонами.
+
+Пример:
+    python benchmarks/run_benchmark.py --episodes 10 1000 100000 --jobs 4 --runtime 0.05
+    python benchmarks/run_benchmark.py --episodes 24 --jobs 4 --throughput 20 --size-jitter 0.5 \
+        --special-factor 8 --order natural
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from generate_library import generate_library, TRACK_NAMING  # noqa: E402
+from planner import ORDER_POLICIES, ORDER_LARGEST  # noqa: E402
+
+DEFAULT_EPISODES = [10, 1000, 10000]
+# Больше эпизодов через настоящий запуск заглушки не прогоняется: сопоставление
+# измеряется на всей библиотеке, выполнение — на её начале
+DEFAULT_EXECUTE_LIMIT = 2000
+
+
+def _install_fake_mkvmerge(root: str) -> str:
+    """Папка с исполняемыми `mkvmerge` и `mkvpropedit`, запускающими заглушку текущим интерпретатором."""
+    bin_dir = os.path.join(root, 'bin')
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, extra in (('mkvmerge', ''), ('mkvpropedit', ' --propedit')):
+        wrapper = os.path.join(bin_dir, name)
+        with open(wrapper, 'w') as f:
+            f.write(f"#!/bin/sh\nexec '{sys.executable}' '{os.path.join(BENCH_DIR, 'fake_mkvmerge.py')}'{extra} \"$@\"\n")
+        os.chmod(wrapper, 0o755)
+    return bin_dir
+
+
+def _peak_rss_bytes() -> int:
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _processor(args, root: str):
+    from process_data import MkvProcessor
+    from storage import DeviceMap, DeviceLimiter
+    from planner import SPACE_POLICY_IGNORE
+
+    # Вся библиотека считается одним устройством заданного типа
+    device_map = DeviceMap({root: 'bench'}, {'bench': args.device_kind})
+    return MkvProcessor(max_jobs=args.jobs, device_limiter=DeviceLimiter(device_map),
+                        space_policy=SPACE_POLICY_IGNORE, match_mode=args.match, order=args.order)
+
+
+def run_single(args) -> Dict:
+    """Один прогон для args.single эпизодов; результат — словарь метрик."""
+    root = tempfile.mkdtemp(prefix='mkvmerge-bench-')
+    try:
+        started = time.perf_counter()
+        library = generate_library(root, args.single, args.audio, args.subs,
+                                   args.file_size, args.decoys, track_naming=args.track_naming,
+                                   size_jitter=args.size_jitter, special_factor=args.special_factor)
+        generate_s = time.perf_counter() - started
+
+        os.environ['PATH'] = _install_fake_mkvmerge(root) + os.pathsep + os.environ.get('PATH', '')
+        os.environ['PY_MKVMERGE_AUTO_CACHE_DIR'] = os.path.join(root, 'cache')
+        os.environ['FAKE_MKVMERGE_RUNTIME'] = str(args.runtime)
+        os.environ['FAKE_MKVMERGE_THROUGHPUT'] = str(args.throughput)
+        os.environ['FAKE_MKVMERGE_FAIL_EVERY'] = str(args.fail_every)
+        os.environ['FAKE_MKVMERGE_IGNORE_TERM'] = '1' if args.ignore_term else '0'
+
+        import process_data
+        import mkv_header
+        from events import EVENT_JOB_STARTED
+        # Сообщения об ошибках ожидаемы при --fail-every и только искажают замер
+        logging.getLogger().setLevel(logging.CRITICAL)
+
+        series_path, output_path = library['series_path'], library['output_path']
+        audio_data, subtitle_data = library['audio_data'], library['subtitle_data']
+        video_files = sorted(os.path.join(series_path, name) for name in os.listdir(series_path))
+
+        # Сопоставление: индексация папок дорожек и сборка команд для всех эпизодов
+        processor = _processor(args, root)
+        started = time.perf_counter()
+        for video_file in video_files:
+            processor._build_mkvmerge_command(
+                video_file, process_data.output_file_for(video_file, output_path),
+                audio_data, subtitle_data)
+        matching_s = time.perf_counter() - started
+
+        # Проверка заголовков Matroska всех видео (то же, что делает process_files перед запуском)
+        started = time.perf_counter()
+        invalid = sum(1 for video_file in video_files if mkv_header.check_matroska(video_file))
+        header_check_s = time.perf_counter() - started
+
+        # Выполнение через планировщик с заглушкой mkvmerge; с --stream папка читается
+        # потоково и выполняется целиком
+        executed = video_files if args.stream else video_files[:args.execute_limit]
+        processor = _processor(args, root)
+        first_job = []
+        processor.events.subscribe(
+            lambda event: first_job.append(time.perf_counter())
+            if event.kind == EVENT_JOB_STARTED and not first_job else None)
+        # Остановка посреди выполнения: задержка от stop() до возврата из process_files
+        stop_timer = threading.Timer(args.cancel_after, processor.stop) if args.cancel_after else None
+        started = time.perf_counter()
+        if stop_timer:
+            stop_timer.start()
+        processor.process_files(series_path, output_path, audio_data, subtitle_data,
+                                video_files=None if args.stream else executed)
+        wall_s = time.perf_counter() - started
+        if stop_timer:
+            stop_timer.cancel()
+        partial_left = sum(1 for name in os.listdir(output_path) if name.endswith('.part'))
+
+        # Время, которое слоты пула простаивали или тратили на запуск процессов и учёт
+        # После остановки простой слотов не измеряется: задачи прерваны
+        busy_s = len(executed) * args.runtime if not args.throughput and not processor.stop_requested else None
+        completed = sum(1 for ok in processor.results.values() if ok is not None)
+        overhead_s = (wall_s * min(args.jobs, len(executed)) - busy_s) / len(executed) if busy_s is not None else None
+        # Нижняя граница времени пакета при заданной скорости: всё поровну между слотами,
+        # но не быстрее самого большого эпизода; отношение к ней показывает потери на хвосте
+        makespan_ratio = None
+        if args.throughput and not processor.stop_requested:
+            bytes_per_s = args.throughput * 1024 * 1024
+            largest = max(os.path.getsize(path) for path in executed) + args.audio * (args.file_size // 8)
+            ideal_s = max(processor.planned_read_bytes / bytes_per_s / min(args.jobs, len(executed)),
+                          largest / bytes_per_s)
+            makespan_ratio = round(wall_s / ideal_s, 2)
+        failed = sum(1 for ok in processor.results.values() if ok is False)
+        spawn_p50 = (processor.metrics_summary or {}).get('spawn_seconds', {}).get('p50')
+        return {
+            'episodes': args.single,
+            'executed': len(executed),
+            'order': args.order,
+            'jobs': args.jobs,
+            'generate_s': round(generate_s, 3),
+            'matching_s': round(matching_s, 4),
+            'matching_us_per_episode': round(matching_s / len(video_files) * 1e6, 1),
+            'header_check_ms': round(header_check_s * 1000, 1),
+            'invalid': invalid,
+            'stream': args.stream,
+            'first_job_ms': round((first_job[0] - started) * 1000, 1) if first_job else None,
+            'wall_s': round(wall_s, 3),
+            'makespan_vs_ideal': makespan_ratio,
+            'overhead_ms_per_episode': round(overhead_s * 1000, 2) if overhead_s is not None else None,
+            'episodes_per_s': round(completed / wall_s, 1) if wall_s else None,
+            'mb_per_s': round(processor.planned_read_bytes / wall_s / 1024 / 1024, 1) if wall_s else None,
+            'spawn_ms_p50': round(spawn_p50 * 1000, 2) if spawn_p50 is not None else None,
+            'failed': failed,
+            'cancel_ms': round(processor.cancel_seconds * 1000, 1) if processor.cancel_seconds is not None else None,
+            'undone': len(processor.undone) if processor.stop_requested else None,
+            'partial_left': partial_left if processor.stop_requested else None,
+            'peak_rss_mb': round(_peak_rss_bytes() / 1024 / 1024, 1),
+        }
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+        else:
+            print(f"Library kept in: {root}", file=sys.stderr)
+
+
+def _child_args(args, episodes: int) -> List[str]:
+    child = [sys.executable, os.path.abspath(__file__), '--single', str(episodes),
+             '--jobs', str(args.jobs), '--runtime', str(args.runtime),
+             '--throughput', str(args.throughput), '--fail-every', str(args.fail_every),
+             '--audio', str(args.audio), '--subs', str(args.subs),
+             '--file-size', str(args.file_size), '--decoys', str(args.decoys),
+             '--execute-limit', str(args.execute_limit), '--device-kind', args.device_kind,
+             '--match', args.match, '--track-naming', args.track_naming,
+             '--cancel-after', str(args.cancel_after), '--order', args.order,
+             '--size-jitter', str(args.size_jitter), '--special-factor', str(args.special_factor)]
+    if args.stream:
+        child.append('--stream')
+    if args.keep:
+        child.append('--keep')
+    if args.ignore_term:
+        child.append('--ignore-term')
+    return child
+
+
+COLUMNS = [
+    ('episodes', 'episodes'),
+    ('executed', 'run'),
+    ('order', 'order'),
+    ('matching_s', 'match s'),
+    ('matching_us_per_episode', 'match us/ep'),
+    ('header_check_ms', 'check ms'),
+    ('first_job_ms', 'first job ms'),
+    ('wall_s', 'wall s'),
+    ('makespan_vs_ideal', 'vs ideal'),
+    ('overhead_ms_per_episode', 'overhead ms/ep'),
+    ('spawn_ms_p50', 'spawn ms p50'),
+    ('episodes_per_s', 'ep/s'),
+    ('mb_per_s', 'MB/s'),
+    ('failed', 'failed'),
+    ('cancel_ms', 'cancel ms'),
+    ('undone', 'undone'),
+    ('partial_left', '.part left'),
+    ('peak_rss_mb', 'peak RSS MB'),
+]
+
+
+def print_table(results: List[Dict]):
+    rows = [[title for _, title in COLUMNS]]
+    rows += [['-' if result.get(key) is None else str(result[key]) for key, _ in COLUMNS] for result in results]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(COLUMNS))]
+    for row in rows:
+        print('  '.join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark track matching and job scheduling')
+    parser.add_argument('--episodes', type=int, nargs='+', default=DEFAULT_EPISODES,
+                        help='library sizes to benchmark')
+    parser.add_argument('--jobs', type=int, default=4, help='parallel mkvmerge jobs')
+    parser.add_argument('--runtime', type=float, default=0.0, help='stub mkvmerge runtime per episode, s')
+    parser.add_argument('--throughput', type=float, default=0.0,
+                        help='stub mkvmerge throughput, MB/s (overrides --runtime when slower)')
+    parser.add_argument('--fail-every', type=int, default=0, help='make every N-th episode fail')
+    parser.add_argument('--audio', type=int, default=2, help='audio sources')
+    parser.add_argument('--subs', type=int, default=1, help='subtitle sources')
+    parser.add_argument('--file-size', type=int, default=1024 * 1024, help='apparent video size, bytes')
+    parser.add_argument('--decoys', type=int, default=0, help='unmatched files per track folder')
+    parser.add_argument('--execute-limit', type=int, default=DEFAULT_EXECUTE_LIMIT,
+                        help='run the stub for at most this many episodes per size')
+    parser.add_argument('--device-kind', default='ssd', choices=['ssd', 'hdd', 'unknown'],
+                        help='device kind assumed for the library')
+    parser.add_argument('--match', default='name', choices=['name', 'episode', 'auto'],
+                        help='track matching mode of the processor')
+    parser.add_argument('--track-naming', default='same', choices=TRACK_NAMING,
+                        help='name tracks like the videos or as Show.S01Exx')
+    parser.add_argument('--order', default=ORDER_LARGEST, choices=ORDER_POLICIES,
+                        help='job ordering policy of the processor')
+    parser.add_argument('--size-jitter', type=float, default=0.0,
+                        help='spread of episode sizes, e.g. 0.5 for 50%%..150%% of --file-size')
+    parser.add_argument('--special-factor', type=float, default=1.0,
+                        help='make the last episode this many times larger')
+    parser.add_argument('--cancel-after', type=float, default=0.0,
+                        help='stop the run after this many seconds and measure cancel latency')
+    parser.add_argument('--ignore-term', action='store_true',
+                        help='make the stub ignore SIGTERM so cancellation has to kill it')
+    parser.add_argument('--stream', action='store_true',
+                        help='let process_files discover the series folder itself (streaming); '
+                             'runs every episode, --execute-limit does not apply')
+    parser.add_argument('--keep', action='store_true', help='keep generated libraries')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        json.dump(run_single(args), sys.stdout)
+        sys.stdout.write('\n')
+        return 0
+
+    results = []
+    for episodes in args.episodes:
+        completed = subprocess.run(_child_args(args, episodes), stdout=subprocess.PIPE, text=True)
+        if completed.returncode != 0:
+            print(f"Benchmark for {episodes} episodes failed", file=sys.stderr)
+            return completed.returncode
+        results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print_table(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
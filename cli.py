@@ -0,0 +1,380 @@
+"""Консольный (headless) запуск обработки без PyQt6.
+
+Примеры:
+    python -m cli run --series ./Show --output ./Out --audio ./Rus ru "AniDub" --sub ./Subs ru
+    python -m cli run --job job.json --json
+    python -m cli resume --output ./Out
+    python -m cli plan --series ./Show --output ./Out --audio ./Rus ru --save plan.json
+    python -m cli run --plan plan.json
+    python -m cli run --series ./Show --output ./Out --tracks-root ./Show/Extras
+    python -m cli watch --series ./Show --output ./Out --audio ./Rus ru --settle 60
+"""
+import os
+import sys
+import json
+import signal
+import logging
+import argparse
+from typing import Optional, List, Dict
+
+from process_data import MkvProcessor, OPTIONS_FILE_MODES, OPTIONS_FILE_AUTO
+from storage import DeviceMap, DeviceLimiter
+from planner import (MergePlan, SPACE_POLICY_FAIL, SPACE_POLICY_TRIM, SPACE_POLICY_IGNORE,
+                     ORDER_POLICIES, ORDER_LARGEST)
+from metrics import MetricsRecorder
+from events import CoalescingSubscriber
+from episode_match import MATCH_MODES, MATCH_NAME, compile_patterns
+from discovery import discover_track_sources
+
+# Коды завершения
+EXIT_OK = 0
+EXIT_FAILED = 1        # часть файлов не обработана
+EXIT_USAGE = 2         # неверные аргументы или файл задания
+EXIT_SETUP = 3         # нет папок, mkvmerge или видеофайлов
+EXIT_INTERRUPTED = 130
+
+
+def _track_list(values: Optional[List[List[str]]], option: str) -> List[Dict]:
+    tracks = []
+    for value in values or []:
+        if not 2 <= len(value) <= 3:
+            raise ValueError(f"{option} expects PATH LANGUAGE [TRACK_NAME], got: {value}")
+        tracks.append({
+            'path': value[0],
+            'language': value[1],
+            'track_name': value[2] if len(value) == 3 else '',
+        })
+    return tracks
+
+
+def load_job_file(path: str) -> Dict:
+    """Чтение файла задания в формате JSON или YAML (YAML требует PyYAML)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yml', '.yaml'):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("PyYAML is required for YAML job files")
+            job = yaml.safe_load(f)
+        else:
+            job = json.load(f)
+    if not isinstance(job, dict):
+        raise ValueError(f"Job file must contain an object: {path}")
+    return job
+
+
+def build_job(args: argparse.Namespace) -> Dict:
+    """Задание из файла, дополненное/переопределённое аргументами командной строки."""
+    job = load_job_file(args.job) if args.job else {}
+    if getattr(args, 'plan', None):
+        # Пути и дорожки берутся из плана, сопоставление уже выполнено
+        plan = MergePlan.load(args.plan)
+        job['plan'] = plan
+        job['series_path'] = plan.series_path
+        job['output_path'] = plan.output_path
+        job['audio_data'] = plan.audio_data
+        job['subtitle_data'] = plan.subtitle_data
+    if args.series:
+        job['series_path'] = args.series
+    if args.output:
+        job['output_path'] = args.output
+    if args.audio:
+        job['audio_data'] = _track_list(args.audio, '--audio')
+    if args.sub:
+        job['subtitle_data'] = _track_list(args.sub, '--sub')
+    if args.jobs:
+        job['max_jobs'] = args.jobs
+    if getattr(args, 'incremental', False):
+        job['incremental'] = True
+    if args.space_policy:
+        job['space_policy'] = args.space_policy
+    if args.order:
+        job['order'] = args.order
+    if args.match:
+        job['match'] = args.match
+    if args.episode_pattern:
+        job['episode_patterns'] = args.episode_pattern
+    if args.identify:
+        job['identify'] = True
+    if args.propedit:
+        job['propedit'] = True
+    if job.get('match', MATCH_NAME) not in MATCH_MODES:
+        raise ValueError(f"Unknown match mode: {job['match']}")
+    patterns = compile_patterns(job.get('episode_patterns'))
+    for root in args.tracks_root or []:
+        _add_discovered_tracks(job, root, patterns)
+    for path, kind in args.device or []:
+        job.setdefault('device_overrides', {})[path] = path
+        job.setdefault('device_kinds', {})[path] = kind
+
+    for key in ('series_path', 'output_path'):
+        if not job.get(key):
+            raise ValueError(f"Missing required setting: {key}")
+    job.setdefault('audio_data', [])
+    job.setdefault('subtitle_data', [])
+    return job
+
+
+def _add_discovered_tracks(job: Dict, root: str, patterns):
+    """Источники дорожек из вложенных папок root; индексы папок строятся при том же обходе."""
+    if not os.path.isdir(root):
+        raise ValueError(f"Directory not found: {root}")
+    discovery = discover_track_sources(root, patterns if job.get('match', MATCH_NAME) != MATCH_NAME else None)
+    for key, tracks in (('audio_data', discovery.audio_data), ('subtitle_data', discovery.subtitle_data)):
+        for track in tracks:
+            # Без языка в имени файлов язык берётся из самих файлов (--identify)
+            # или дорожка помечается как неопределённая
+            if not job.get('identify'):
+                track['language'] = track['language'] or 'und'
+        job[key] = list(job.get(key) or []) + tracks
+    job['track_indexes'] = list(job.get('track_indexes') or []) + discovery.indexes
+
+
+def build_device_limiter(job: Dict) -> DeviceLimiter:
+    """Ограничения по устройствам из задания: device_overrides, device_kinds, device_limits."""
+    device_map = DeviceMap(job.get('device_overrides'), job.get('device_kinds'))
+    limits = {name: tuple(value) for name, value in (job.get('device_limits') or {}).items()}
+    return DeviceLimiter(device_map, limits)
+
+
+def summarize(processor: MkvProcessor) -> Dict:
+    failed = [path for path, ok in processor.results.items() if ok is False]
+    processed = [path for path, ok in processor.results.items() if ok]
+    if processor.stop_requested:
+        status, code = 'interrupted', EXIT_INTERRUPTED
+    elif not processor.results and processor.errors:
+        status, code = 'error', EXIT_SETUP
+    elif failed or processor.undone:
+        # Несделанные без остановки — эпизоды, которым не хватило места на диске
+        status, code = 'failed', EXIT_FAILED
+    else:
+        status, code = 'ok', EXIT_OK
+    return {
+        'status': status,
+        'exit_code': code,
+        'processed': len(processed) - len(processor.skipped),
+        'skipped': len(processor.skipped),
+        'failed': failed,
+        'undone': processor.undone,
+        'rejected': processor.rejected,
+        'errors': processor.errors,
+        'planned_read_bytes': processor.planned_read_bytes,
+        'planned_write_bytes': processor.planned_write_bytes,
+        'metrics': processor.metrics_summary,
+        'cancel_seconds': processor.cancel_seconds,
+    }
+
+
+def _add_job_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--job', help='JSON/YAML job file')
+    parser.add_argument('--series', help='folder with video files')
+    parser.add_argument('--output', help='output folder')
+    parser.add_argument('--audio', nargs='+', action='append', metavar='ARG',
+                        help='audio track source: PATH LANGUAGE [TRACK_NAME]')
+    parser.add_argument('--sub', nargs='+', action='append', metavar='ARG',
+                        help='subtitle track source: PATH LANGUAGE [TRACK_NAME]')
+    parser.add_argument('--tracks-root', action='append', metavar='PATH',
+                        help='add every nested folder with audio or subtitles under PATH as a track source')
+    parser.add_argument('--jobs', type=int, help='number of parallel mkvmerge jobs')
+    parser.add_argument('--match', choices=MATCH_MODES,
+                        help='match tracks by file name (default), by episode key (S01E05, "- 05") or auto')
+    parser.add_argument('--episode-pattern', action='append', metavar='REGEX',
+                        help='extra regex with an (?P<episode>...) and optional (?P<season>...) group')
+    parser.add_argument('--identify', action='store_true',
+                        help='read track languages and codecs with mkvmerge -J (cached on disk); '
+                             'an empty LANGUAGE is taken from the file')
+    parser.add_argument('--propedit', action='store_true',
+                        help='when only track languages or names changed, fix existing outputs '
+                             'in place with mkvpropedit instead of remuxing')
+    parser.add_argument('--device', nargs=2, action='append', metavar=('PATH', 'KIND'),
+                        help='treat PATH as a separate device of KIND (ssd, hdd or unknown)')
+    _add_run_options(parser)
+
+
+def _add_run_options(parser: argparse.ArgumentParser):
+    """Опции, общие для всех команд, включая resume."""
+    parser.add_argument('--metrics-jsonl', metavar='PATH',
+                        help='append per-episode metrics to a JSON-lines file')
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                        help='write run metrics for the node exporter textfile collector')
+    parser.add_argument('--events-jsonl', metavar='PATH',
+                        help='append the event stream (progress coalesced) to a JSON-lines file')
+    parser.add_argument('--options-file', choices=OPTIONS_FILE_MODES,
+                        help='pass mkvmerge arguments in an @options.json file: auto (long commands, '
+                             'default), always or never; failed jobs keep theirs next to the output')
+    parser.add_argument('--output-logs', metavar='DIR',
+                        help='write the full mkvmerge output of every episode to DIR '
+                             '(only the last 16 KB are kept in memory)')
+    parser.add_argument('--order', choices=ORDER_POLICIES,
+                        help='job start order: largest first (default, shortest total time), '
+                             'smallest first (fast first results) or natural episode order')
+    parser.add_argument('--no-header-check', action='store_true',
+                        help='do not reject truncated or non-Matroska video files before merging')
+    parser.add_argument('--space-policy',
+                        choices=[SPACE_POLICY_FAIL, SPACE_POLICY_TRIM, SPACE_POLICY_IGNORE],
+                        help='when the output disk is too small: fail (default), '
+                             'trim the batch to what fits, or ignore')
+
+
+def open_event_log(processor: MkvProcessor, path: str):
+    """Подписка на поток событий с записью в JSON-lines; возвращает функцию закрытия."""
+    handle = open(path, 'a', encoding='utf-8')
+
+    def deliver(events):
+        for event in events:
+            handle.write(json.dumps(event.to_dict(), ensure_ascii=False) + '\n')
+        handle.flush()
+
+    subscriber = CoalescingSubscriber(deliver)
+    unsubscribe = processor.events.subscribe(subscriber)
+
+    def close():
+        unsubscribe()
+        subscriber.close()
+        handle.close()
+    return close
+
+
+def run_plan(args: argparse.Namespace, job: Dict, processor: MkvProcessor) -> int:
+    """Dry run: сопоставление дорожек и вывод плана без запуска mkvmerge."""
+    plan = processor.plan(job['series_path'], job['output_path'], job['audio_data'], job['subtitle_data'])
+    if plan is None:
+        return EXIT_SETUP
+    if args.save:
+        plan.save(args.save)
+    if args.json:
+        json.dump(plan.to_dict(), sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    else:
+        print(plan.format_preview())
+    return EXIT_OK
+
+
+def run_watch(args: argparse.Namespace, job: Dict, processor: MkvProcessor) -> int:
+    # Импорт здесь, чтобы обычный запуск не загружал ctypes/select
+    from watcher import FolderWatcher, PollingBackend, DEFAULT_SETTLE_SECONDS, DEFAULT_POLL_INTERVAL
+
+    watcher = FolderWatcher(
+        job['series_path'], job['output_path'], job['audio_data'], job['subtitle_data'],
+        processor=processor,
+        settle_seconds=args.settle if args.settle is not None else DEFAULT_SETTLE_SECONDS,
+        poll_interval=args.poll_interval if args.poll_interval is not None else DEFAULT_POLL_INTERVAL,
+        backend=PollingBackend() if args.polling else None,
+    )
+
+    def handle_interrupt(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        watcher.stop()
+    signal.signal(signal.SIGINT, handle_interrupt)
+    signal.signal(signal.SIGTERM, handle_interrupt)
+
+    try:
+        watcher.run()
+    except OSError as e:
+        logging.getLogger(__name__).error(str(e))
+        return EXIT_SETUP
+    return EXIT_OK
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='cli', description='Headless MKV merge runner')
+    parser.add_argument('--json', action='store_true', help='print a JSON summary to stdout')
+    parser.add_argument('--quiet', action='store_true', help='log warnings and errors only')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='merge a series folder')
+    _add_job_arguments(run)
+    run.add_argument('--incremental', action='store_true', help='skip up-to-date outputs')
+    run.add_argument('--plan', metavar='PATH', help='execute a plan saved by the plan command')
+
+    plan = subparsers.add_parser('plan', help='match tracks and show the merge plan without running mkvmerge')
+    _add_job_arguments(plan)
+    plan.add_argument('--save', metavar='PATH', help='export the plan as JSON')
+
+    watch = subparsers.add_parser('watch', help='watch folders and merge episodes as they arrive')
+    _add_job_arguments(watch)
+    watch.add_argument('--settle', type=float, default=None,
+                       help='seconds episode files must stay unchanged before merging')
+    watch.add_argument('--poll-interval', type=float, default=None,
+                       help='seconds between readiness checks / directory polls')
+    watch.add_argument('--polling', action='store_true', help='force polling instead of inotify')
+
+    resume = subparsers.add_parser('resume', help='resume an interrupted run from its journal')
+    resume.add_argument('--output', required=True, help='output folder with the job journal')
+    resume.add_argument('--jobs', type=int, help='number of parallel mkvmerge jobs')
+    _add_run_options(resume)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = create_parser()
+    args = parser.parse_args(argv)
+    if args.quiet:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    try:
+        if args.command in ('run', 'watch', 'plan'):
+            job = build_job(args)
+        else:
+            job = {'max_jobs': args.jobs, 'space_policy': args.space_policy, 'order': args.order}
+        if args.options_file:
+            job['options_file'] = args.options_file
+    except (OSError, ValueError) as e:
+        parser.error(str(e))  # завершает процесс с EXIT_USAGE
+
+    # В режиме наблюдения уже собранные эпизоды всегда пропускаются
+    incremental = args.command == 'watch' or bool(job.get('incremental'))
+    processor = MkvProcessor(max_jobs=job.get('max_jobs'), incremental=incremental,
+                             device_limiter=build_device_limiter(job),
+                             space_policy=job.get('space_policy') or SPACE_POLICY_FAIL,
+                             metrics=MetricsRecorder(args.metrics_jsonl, args.metrics_prom),
+                             match_mode=job.get('match') or MATCH_NAME,
+                             episode_patterns=job.get('episode_patterns'),
+                             identify=bool(job.get('identify')),
+                             options_file=job.get('options_file') or OPTIONS_FILE_AUTO,
+                             output_log_dir=args.output_logs,
+                             propedit=bool(job.get('propedit')),
+                             check_inputs=not args.no_header_check,
+                             order=job.get('order') or ORDER_LARGEST)
+    for index in job.get('track_indexes') or []:
+        processor.use_track_index(index)
+    try:
+        close_event_log = open_event_log(processor, args.events_jsonl) if args.events_jsonl else None
+    except OSError as e:
+        parser.error(str(e))
+    try:
+        return run_command(args, job, processor)
+    finally:
+        if close_event_log:
+            close_event_log()
+
+
+def run_command(args: argparse.Namespace, job: Dict, processor: MkvProcessor) -> int:
+    if args.command == 'watch':
+        return run_watch(args, job, processor)
+    if args.command == 'plan':
+        return run_plan(args, job, processor)
+
+    # Первый Ctrl+C останавливает очередь и работающие mkvmerge, второй прерывает процесс
+    def handle_interrupt(signum, frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        processor.stop()
+    signal.signal(signal.SIGINT, handle_interrupt)
+
+    if job.get('plan'):
+        processor.process_plan(job['plan'])
+    elif args.command == 'run':
+        processor.process_files(job['series_path'], job['output_path'],
+                                job['audio_data'], job['subtitle_data'])
+    else:
+        processor.resume(args.output)
+
+    summary = summarize(processor)
+    if args.json:
+        json.dump(summary, sys.stdout, ensure_ascii=False)
+        sys.stdout.write('\n')
+    return summary['exit_code']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
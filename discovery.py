@@ -0,0 +1,129 @@
+"""Поиск источников дорожек во вложенных папках релиза за один обход дерева.
+
+Релизы часто раскладывают дорожки по папкам вида Sounds/<Студия>/*.mka и
+Subs/<Группа>/*.ass. Обход корня находит каждую папку с аудио или субтитрами,
+предлагает по ней источник дорожек (название — имя папки, язык — общий суффикс
+файлов) и тут же строит индекс для сопоставления, так что папки не сканируются
+второй раз при запуске обработки.
+"""
+import os
+import logging
+from typing import Optional, List, Dict, Pattern
+
+from process_data import TrackIndex, AUDIO_EXTENSIONS, SUBTITLE_EXTENSIONS
+from episode_match import EpisodeKeyIndex
+
+logger = logging.getLogger(__name__)
+
+SOURCE_AUDIO = 'audio'
+SOURCE_SUBTITLE = 'subtitle'
+SOURCE_EXTENSIONS = ((SOURCE_AUDIO, AUDIO_EXTENSIONS), (SOURCE_SUBTITLE, SUBTITLE_EXTENSIONS))
+
+
+def _media_type(file_name: str) -> Optional[str]:
+    ext = os.path.splitext(file_name)[1].lower()
+    for source_type, extensions in SOURCE_EXTENSIONS:
+        if ext in extensions:
+            return source_type
+    return None
+
+
+def guess_language(paths: List[str]) -> str:
+    """Суффикс языка, общий для всех файлов папки ("Ep01.rus.mka" -> "rus"), или ''."""
+    suffixes = set()
+    for path in paths:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        suffix = os.path.splitext(stem)[1][1:]
+        if not (2 <= len(suffix) <= 3 and suffix.isalpha()):
+            return ''
+        suffixes.add(suffix.lower())
+        if len(suffixes) > 1:
+            return ''
+    return suffixes.pop() if suffixes else ''
+
+
+class TrackDiscovery:
+    """Результат обхода: источники дорожек по типам и готовые индексы их папок."""
+
+    def __init__(self, root: str):
+        self.root = root
+        self.sources: Dict[str, List[Dict]] = {SOURCE_AUDIO: [], SOURCE_SUBTITLE: []}
+        self.indexes: List = []
+        self.directories_scanned = 0
+
+    @property
+    def audio_data(self) -> List[Dict]:
+        return [self.track_data(source) for source in self.sources[SOURCE_AUDIO]]
+
+    @property
+    def subtitle_data(self) -> List[Dict]:
+        return [self.track_data(source) for source in self.sources[SOURCE_SUBTITLE]]
+
+    @staticmethod
+    def track_data(source: Dict) -> Dict:
+        """Параметры дорожки в формате, который принимает MkvProcessor."""
+        return {'path': source['path'], 'language': source['language'], 'track_name': source['track_name']}
+
+    def _add_directory(self, path: str, dir_mtime_ns: Optional[int], files: Dict[str, List[str]],
+                       patterns: Optional[List[Pattern]]):
+        for source_type, extensions in SOURCE_EXTENSIONS:
+            paths = files[source_type]
+            if not paths:
+                continue
+            self.sources[source_type].append({
+                'path': path,
+                'language': guess_language(paths),
+                'track_name': os.path.basename(path),
+                'files': len(paths),
+            })
+            index = TrackIndex(path, extensions, scan=False)
+            index.load(paths, dir_mtime_ns)
+            self.indexes.append(index)
+            if patterns is not None:
+                episode_index = EpisodeKeyIndex(path, extensions, patterns, scan=False)
+                episode_index.load(paths, dir_mtime_ns)
+                self.indexes.append(episode_index)
+
+
+def discover_track_sources(root: str, patterns: Optional[List[Pattern]] = None) -> TrackDiscovery:
+    """Обход дерева root одним проходом os.scandir.
+
+    Символические ссылки на папки не раскрываются, скрытые папки пропускаются.
+    С patterns вместе с индексами по имени строятся индексы по ключу эпизода.
+    """
+    root = os.path.normpath(root)
+    result = TrackDiscovery(root)
+    # mtime папки берётся до чтения её содержимого: изменение во время обхода
+    # приведёт к повторному сканированию при запуске, а не к устаревшему индексу
+    stack = [(root, os.stat(root).st_mtime_ns)]
+    while stack:
+        directory, dir_mtime_ns = stack.pop()
+        result.directories_scanned += 1
+        files: Dict[str, List[str]] = {SOURCE_AUDIO: [], SOURCE_SUBTITLE: []}
+        subdirs = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if not entry.name.startswith('.'):
+                                subdirs.append((entry.path, entry.stat(follow_symlinks=False).st_mtime_ns))
+                        elif entry.is_file():
+                            source_type = _media_type(entry.name)
+                            if source_type:
+                                files[source_type].append(entry.path)
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning(f"Unable to scan {directory}: {e}")
+            continue
+        result._add_directory(directory, dir_mtime_ns, files, patterns)
+        # Обратный порядок в стеке даёт обход подпапок по алфавиту
+        stack.extend(sorted(subdirs, reverse=True))
+
+    for source_type, sources in result.sources.items():
+        sources.sort(key=lambda source: source['path'])
+        for source in sources:
+            logger.info(f"Found {source_type} source: {source['path']} ({source['files']} files, "
+                        f"language: {source['language'] or '?'})")
+    return result
@@ -0,0 +1,185 @@
+"""Сопоставление видео и дорожек по ключу эпизода вместо совпадения имён файлов.
+
+Из имени файла извлекается ключ (сезон, номер эпизода): S01E05, 1x05, "Episode 5",
+"Show - 05 [1080p]", "[05]" и т.п. Папка дорожек индексируется по ключу один раз,
+после чего каждое видео находит свои дорожки за O(1). Если ключу соответствует
+несколько файлов, дорожка не выбирается, а кандидаты возвращаются для отчёта.
+"""
+import os
+import re
+import threading
+import logging
+from typing import Optional, List, Dict, Tuple, Pattern
+
+logger = logging.getLogger(__name__)
+
+MATCH_NAME = 'name'        # имя дорожки начинается с имени видео (прежнее поведение)
+MATCH_EPISODE = 'episode'  # только по ключу эпизода
+MATCH_AUTO = 'auto'        # сначала по имени, затем по ключу эпизода
+MATCH_MODES = (MATCH_NAME, MATCH_EPISODE, MATCH_AUTO)
+
+# Шаблоны в порядке приоритета; группа episode обязательна, season — нет
+DEFAULT_EPISODE_PATTERNS = [
+    r'(?i)(?<![a-z0-9])s(?P<season>\d{1,2})[ ._-]?e(?P<episode>\d{1,4})(?!\d)',
+    r'(?i)(?<![a-z0-9])(?P<season>\d{1,2})x(?P<episode>\d{2,3})(?!\d)',
+    r'(?i)(?<![a-z0-9])(?:episode|ep|e)[ ._-]?(?P<episode>\d{1,4})(?!\d)',
+    r'\s-\s(?P<episode>\d{1,4})(?:v\d)?(?!\d)',
+    # Число в скобках, кроме года: [05], (05)
+    r'[\[(](?!(?:19|20)\d{2}[\])])(?P<episode>\d{1,4})(?:v\d)?[\])]',
+]
+# Для последней попытки (отдельно стоящее число) из имени убираются теги, качество, кодеки и годы
+NOISE_RE = re.compile(r'(?i)\[[^\]]*\]|\([^)]*\)|\b\d{3,4}p\b|\b[xh]\.?26[45]\b|\b\d{1,2}bit\b|\b(?:19|20)\d{2}\b')
+STANDALONE_NUMBER_RE = re.compile(r'(?<![\w])(?P<episode>\d{1,4})(?![\w])')
+
+EpisodeKey = Tuple[Optional[int], int]
+
+
+def compile_patterns(patterns: Optional[List[str]] = None) -> List[Pattern]:
+    """Пользовательские шаблоны (проверяются первыми) и шаблоны по умолчанию."""
+    compiled = []
+    for pattern in list(patterns or []) + DEFAULT_EPISODE_PATTERNS:
+        try:
+            regex = re.compile(pattern)
+        except re.error as e:
+            raise ValueError(f"Invalid episode pattern {pattern!r}: {e}")
+        if 'episode' not in regex.groupindex:
+            raise ValueError(f"Episode pattern must have an 'episode' group: {pattern!r}")
+        compiled.append(regex)
+    return compiled
+
+
+def episode_key(stem: str, patterns: List[Pattern]) -> Optional[EpisodeKey]:
+    """(сезон или None, номер эпизода) из имени файла без расширения или None."""
+    for regex in patterns:
+        match = regex.search(stem)
+        if match:
+            season = match.groupdict().get('season')
+            return (int(season) if season else None), int(match.group('episode'))
+    numbers = STANDALONE_NUMBER_RE.findall(NOISE_RE.sub(' ', stem))
+    if numbers:
+        return None, int(numbers[-1])
+    return None
+
+
+def format_key(key: EpisodeKey) -> str:
+    season, episode = key
+    return f"S{season:02d}E{episode:02d}" if season is not None else f"E{episode:02d}"
+
+
+def duplicate_keys(video_files: List[str], patterns: List[Pattern]) -> Dict[EpisodeKey, List[str]]:
+    """Ключи, которые получились сразу у нескольких видео."""
+    by_key: Dict[EpisodeKey, List[str]] = {}
+    for video_file in video_files:
+        key = episode_key(os.path.splitext(os.path.basename(video_file))[0], patterns)
+        if key is not None:
+            by_key.setdefault(key, []).append(video_file)
+    return {key: files for key, files in by_key.items() if len(files) > 1}
+
+
+class EpisodeKeyIndex:
+    """Индекс файлов дорожек одной папки по ключу эпизода, построенный за одно сканирование."""
+
+    def __init__(self, track_dir: str, extensions: List[str], patterns: List[Pattern], scan: bool = True):
+        self.track_dir = track_dir
+        self.extensions = list(extensions)
+        self.patterns = patterns
+        self._normalized_exts = [(ext, os.path.normcase(ext)) for ext in self.extensions]
+        # Для каждого расширения: (сезон, эпизод) -> пути и эпизод -> [(сезон, путь)]
+        self._by_key: Dict[str, Dict[EpisodeKey, List[str]]] = {ext: {} for ext in self.extensions}
+        self._by_episode: Dict[str, Dict[int, List[Tuple[Optional[int], str]]]] = {ext: {} for ext in self.extensions}
+        self._lock = threading.Lock()
+        self.dir_mtime_ns: Optional[int] = None
+        if scan:
+            self._scan()
+
+    def _match(self, file_name: str) -> Optional[Tuple[str, str]]:
+        """(расширение, имя без расширения) для подходящего файла или None."""
+        name = os.path.normcase(file_name)
+        for ext, norm_ext in self._normalized_exts:
+            if name.endswith(norm_ext):
+                return ext, file_name[:-len(norm_ext)]
+        return None
+
+    def _scan(self):
+        self.dir_mtime_ns = os.stat(self.track_dir).st_mtime_ns
+        with os.scandir(self.track_dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                self.add(entry.path)
+
+    def add(self, path: str) -> bool:
+        matched = self._match(os.path.basename(path))
+        if matched is None:
+            return False
+        ext, stem = matched
+        key = episode_key(stem, self.patterns)
+        if key is None:
+            return False
+        with self._lock:
+            paths = self._by_key[ext].setdefault(key, [])
+            if path in paths:
+                return False
+            paths.append(path)
+            self._by_episode[ext].setdefault(key[1], []).append((key[0], path))
+        return True
+
+    def discard(self, path: str):
+        matched = self._match(os.path.basename(path))
+        if matched is None:
+            return
+        ext, stem = matched
+        key = episode_key(stem, self.patterns)
+        if key is None:
+            return
+        with self._lock:
+            paths = self._by_key[ext].get(key, [])
+            if path in paths:
+                paths.remove(path)
+            tracks = self._by_episode[ext].get(key[1], [])
+            if (key[0], path) in tracks:
+                tracks.remove((key[0], path))
+
+    def load(self, paths: List[str], dir_mtime_ns: Optional[int] = None):
+        """Заполнение индекса списком файлов папки, полученным при обходе дерева."""
+        if dir_mtime_ns is not None:
+            self.dir_mtime_ns = dir_mtime_ns
+        for path in paths:
+            self.add(path)
+
+    def is_current(self) -> bool:
+        """Папка не менялась с момента сканирования (файлы не добавлялись и не удалялись)."""
+        if self.dir_mtime_ns is None:
+            return False
+        try:
+            return os.stat(self.track_dir).st_mtime_ns == self.dir_mtime_ns
+        except OSError:
+            return False
+
+    def lookup(self, base_name: str) -> List[str]:
+        """Кандидаты для видео с первым по приоритету расширением, у которого они есть.
+
+        Видео без сезона сопоставляется с дорожкой любого сезона, видео с сезоном —
+        с дорожкой того же сезона или без сезона.
+        """
+        key = episode_key(base_name, self.patterns)
+        if key is None:
+            return []
+        season, episode = key
+        with self._lock:
+            for ext in self.extensions:
+                candidates = self._by_key[ext].get(key) if season is not None else None
+                if not candidates:
+                    candidates = [path for track_season, path in self._by_episode[ext].get(episode, [])
+                                  if season is None or track_season is None]
+                if candidates:
+                    return sorted(candidates)
+        return []
+
+    def find(self, base_name: str) -> Optional[str]:
+        """Единственная подходящая дорожка или None (не найдена или неоднозначна)."""
+        candidates = self.lookup(base_name)
+        return candidates[0] if len(candidates) == 1 else None
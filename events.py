@@ -0,0 +1,167 @@
+"""Поток типизированных событий обработки и доставка их подписчикам.
+
+MkvProcessor публикует события в EventBus. GUI и консольные потребители подписываются
+на один и тот же поток; CoalescingSubscriber объединяет прогресс и отдаёт события
+пачками не чаще заданной частоты, сколько бы задач ни работало параллельно.
+"""
+import time
+import threading
+import logging
+from typing import Optional, List, Dict, Callable
+
+logger = logging.getLogger(__name__)
+
+EVENT_STATUS = 'status'                # общее сообщение
+EVENT_ERROR = 'error'                  # ошибка, не связанная с конкретным эпизодом
+EVENT_PROGRESS = 'progress'            # общий прогресс, value — проценты; None, пока число эпизодов
+                                       # неизвестно (data: completed и found)
+EVENT_FILE_PROGRESS = 'file_progress'  # прогресс эпизода, value — проценты
+EVENT_JOB_STARTED = 'job_started'
+EVENT_TRACK_MISSING = 'track_missing'
+EVENT_JOB_SKIPPED = 'job_skipped'
+EVENT_JOB_FINISHED = 'job_finished'
+EVENT_JOB_FAILED = 'job_failed'
+EVENT_JOB_CANCELLED = 'job_cancelled'  # mkvmerge прерван остановкой, результат удалён
+EVENT_RUN_FINISHED = 'run_finished'
+
+ERROR_EVENTS = (EVENT_ERROR, EVENT_JOB_FAILED)
+PROGRESS_EVENTS = (EVENT_PROGRESS, EVENT_FILE_PROGRESS)
+
+# Пачек событий в секунду для GUI по умолчанию
+DEFAULT_MAX_RATE = 10.0
+
+
+class Event:
+    """Одно событие обработки; episode — имя эпизода без расширения."""
+
+    __slots__ = ('kind', 'message', 'episode', 'value', 'data', 'timestamp')
+
+    def __init__(self, kind: str, message: str = '', episode: Optional[str] = None,
+                 value: Optional[int] = None, data: Optional[Dict] = None):
+        self.kind = kind
+        self.message = message
+        self.episode = episode
+        self.value = value
+        self.data = data or {}
+        self.timestamp = time.time()
+
+    def to_dict(self) -> Dict:
+        result = {'kind': self.kind, 'timestamp': self.timestamp}
+        if self.message:
+            result['message'] = self.message
+        if self.episode is not None:
+            result['episode'] = self.episode
+        if self.value is not None:
+            result['value'] = self.value
+        if self.data:
+            result['data'] = self.data
+        return result
+
+    def __repr__(self):
+        return f"Event({self.kind!r}, {self.message!r}, episode={self.episode!r}, value={self.value!r})"
+
+
+class EventBus:
+    """Синхронная рассылка событий подписчикам в потоке, где событие возникло."""
+
+    def __init__(self):
+        self._subscribers: List[Callable[[Event], None]] = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback: Callable[[Event], None]) -> Callable[[], None]:
+        """Подписка на все события; возвращает функцию для отписки."""
+        with self._lock:
+            self._subscribers = self._subscribers + [callback]
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers = [item for item in self._subscribers if item is not callback]
+        return unsubscribe
+
+    def publish(self, event: Event):
+        for callback in self._subscribers:
+            try:
+                callback(event)
+            except Exception as e:
+                # Ошибка подписчика не должна прерывать обработку
+                logger.warning(f"Event subscriber failed on {event.kind}: {e}")
+
+
+class CoalescingSubscriber:
+    """Подписчик, доставляющий события пачками не чаще max_rate раз в секунду.
+
+    Из событий прогресса в пачку попадает только последнее значение (общее и по
+    каждому эпизоду), прогресс завершившихся эпизодов отбрасывается. Остальные
+    события доставляются все и в исходном порядке.
+    """
+
+    def __init__(self, deliver: Callable[[List[Event]], None], max_rate: float = DEFAULT_MAX_RATE):
+        self.deliver = deliver
+        self.interval = 1.0 / max_rate if max_rate > 0 else 0.0
+        self._pending: List[Event] = []
+        self._progress: Optional[Event] = None
+        self._file_progress: Dict[str, Event] = {}
+        self._last_flush = 0.0
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        # Доставка пачек последовательна, чтобы пачки не обгоняли друг друга
+        self._flush_lock = threading.Lock()
+
+    def __call__(self, event: Event):
+        with self._lock:
+            if event.kind == EVENT_PROGRESS:
+                self._progress = event
+            elif event.kind == EVENT_FILE_PROGRESS:
+                self._file_progress[event.episode] = event
+            else:
+                if event.episode is not None:
+                    self._file_progress.pop(event.episode, None)
+                self._pending.append(event)
+            now = time.monotonic()
+            delay = self._last_flush + self.interval - now
+            if delay > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self._last_flush = now
+        self.flush()
+
+    def flush(self):
+        """Немедленная доставка накопленных событий."""
+        with self._flush_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                events = self._pending + list(self._file_progress.values())
+                if self._progress is not None:
+                    events.append(self._progress)
+                self._pending = []
+                self._file_progress = {}
+                self._progress = None
+                self._last_flush = time.monotonic()
+            if events:
+                self.deliver(events)
+
+    close = flush
+
+
+def qt_signal_sink(worker) -> Callable[[List[Event]], None]:
+    """Доставка пачек событий в старые сигналы worker: status_updated, progress_updated и
+    file_progress_updated (если он есть)."""
+    def deliver(events: List[Event]):
+        for event in events:
+            if event.kind == EVENT_PROGRESS:
+                # Старый сигнал принимает только проценты
+                if event.value is not None:
+                    worker.progress_updated.emit(event.value)
+            elif event.kind == EVENT_FILE_PROGRESS:
+                if hasattr(worker, 'file_progress_updated'):
+                    worker.file_progress_updated.emit(event.episode, event.value)
+            elif event.kind in ERROR_EVENTS:
+                worker.status_updated.emit(f"Error: {event.message}")
+            elif event.message:
+                worker.status_updated.emit(event.message)
+    return deliver
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import threading
+import logging
+from typing import Optional, List, Dict
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_NAME = '.mkvmerge_auto_journal.json'
+JOURNAL_VERSION = 2
+# Прежний формат: один JSON-документ, переписываемый при каждом изменении (читается при resume)
+JOURNAL_VERSION_SNAPSHOT = 1
+# Дописанных записей не больше, чем эпизодов в снимке (но не меньше этого числа), потом снимок переписывается
+JOURNAL_COMPACT_MIN_RECORDS = 256
+# Как часто дописанные записи сбрасываются на диск через fsync
+JOURNAL_SYNC_SECONDS = 1.0
+# Суффикс временного файла, в который mkvmerge пишет результат до атомарного переименования
+PARTIAL_SUFFIX = '.part'
+
+STATE_PENDING = 'pending'
+STATE_RUNNING = 'running'
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+def partial_output_path(output_file: str) -> str:
+    return output_file + PARTIAL_SUFFIX
+
+
+class JobJournal:
+    """Журнал пакетной обработки в выходной папке.
+
+    Хранит параметры запуска и состояние каждого эпизода (pending/running/done/failed),
+    чтобы после сбоя можно было продолжить с незавершённых эпизодов. Файл — строки JSON:
+    первая — снимок параметров и состояний, следующие — дописываемые изменения состояний.
+    Изменение стоит одной дописанной строки, а не перезаписи всего журнала; снимок
+    переписывается атомарно, когда записей накопилось больше, чем эпизодов. fsync
+    выполняется не чаще раза в JOURNAL_SYNC_SECONDS: при сбое процесса записи не теряются,
+    при отключении питания теряются лишь последние и эти эпизоды собираются заново.
+    """
+
+    def __init__(self, output_path: str):
+        self.output_path = output_path
+        self.path = os.path.join(output_path, JOURNAL_NAME)
+        self._lock = threading.Lock()
+        self.params: Dict = {}
+        self.episodes: Dict[str, Dict] = {}
+        self._records = 0
+        self._synced_at = 0.0
+
+    @classmethod
+    def load(cls, output_path: str) -> Optional['JobJournal']:
+        """Загрузка журнала из выходной папки; None, если журнала нет или он повреждён."""
+        journal = cls(output_path)
+        try:
+            with open(journal.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable journal {journal.path}: {e}")
+            return None
+        lines = text.splitlines()
+        try:
+            data = json.loads(lines[0]) if lines else None
+        except ValueError:
+            data = None
+        if data is None:
+            # Журнал прежнего формата записан одним многострочным документом
+            try:
+                data = json.loads(text)
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable journal {journal.path}: {e}")
+                return None
+            if not isinstance(data, dict) or data.get('version') != JOURNAL_VERSION_SNAPSHOT:
+                return None
+            lines = []
+        elif not isinstance(data, dict) or data.get('version') != JOURNAL_VERSION:
+            return None
+        journal.params = data.get('params', {})
+        journal.episodes = data.get('episodes', {})
+        for number, line in enumerate(lines[1:], 2):
+            try:
+                record = json.loads(line)
+                video_file = record.pop('file')
+            except (ValueError, KeyError, AttributeError):
+                # Последняя строка может быть недописана при сбое
+                logger.warning(f"Ignoring damaged journal record {journal.path}:{number}")
+                continue
+            journal.episodes[video_file] = record
+        journal._records = max(0, len(lines) - 1)
+        return journal
+
+    def start(self, params: Dict, video_files: List[str]):
+        """Новый запуск: все эпизоды в состоянии pending."""
+        with self._lock:
+            self.params = params
+            self.episodes = {video_file: {'state': STATE_PENDING} for video_file in video_files}
+        self.save()
+
+    def reset(self, video_files: List[str]):
+        """Перевод указанных эпизодов в pending перед повторным запуском."""
+        self._append({video_file: {'state': STATE_PENDING} for video_file in video_files})
+
+    def save(self):
+        """Запись снимка журнала (с текущими параметрами) вместо накопленных записей."""
+        with self._lock:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        data = {'version': JOURNAL_VERSION, 'params': self.params, 'episodes': self.episodes}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Unable to write journal {self.path}: {e}")
+            return
+        self._records = 0
+        self._synced_at = time.monotonic()
+
+    def _append(self, entries: Dict[str, Dict]):
+        """Дописывание изменений состояний; при большом числе записей — новый снимок."""
+        if not entries:
+            return
+        with self._lock:
+            self.episodes.update(entries)
+            self._records += len(entries)
+            if self._records > max(JOURNAL_COMPACT_MIN_RECORDS, len(self.episodes)):
+                self._write_snapshot()
+                return
+            lines = ''.join(json.dumps(dict(entry, file=video_file), ensure_ascii=False) + '\n'
+                            for video_file, entry in entries.items())
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(lines)
+                    f.flush()
+                    now = time.monotonic()
+                    if now - self._synced_at >= JOURNAL_SYNC_SECONDS:
+                        os.fsync(f.fileno())
+                        self._synced_at = now
+            except OSError as e:
+                logger.warning(f"Unable to write journal {self.path}: {e}")
+
+    def set_state(self, video_file: str, state: str, error: Optional[str] = None):
+        entry = {'state': state}
+        if error:
+            entry['error'] = error
+        self._append({video_file: entry})
+
+    def state(self, video_file: str) -> Optional[str]:
+        with self._lock:
+            entry = self.episodes.get(video_file)
+        return entry.get('state') if entry else None
+
+    def unfinished(self) -> List[str]:
+        """Эпизоды, которые не были успешно обработаны (включая прерванные в состоянии running)."""
+        with self._lock:
+            return [video_file for video_file, entry in self.episodes.items()
+                    if entry.get('state') != STATE_DONE]
+
+    def is_finished(self) -> bool:
+        return not self.unfinished()
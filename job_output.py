@@ -0,0 +1,70 @@
+"""Вывод mkvmerge одной задачи с ограниченным расходом памяти.
+
+В памяти остаются только последние max_bytes вывода (для сообщения об ошибке),
+полный вывод при необходимости пишется построчно в файл журнала задачи.
+"""
+import os
+import logging
+from collections import deque
+from typing import Optional, List
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних байт вывода хранить для диагностики
+DEFAULT_TAIL_BYTES = 16 * 1024
+# Длиннее строки читаются частями, чтобы одна строка без перевода не заняла всю память
+MAX_LINE_CHARS = 4096
+LOG_SUFFIX = '.log'
+
+
+class OutputTail:
+    """Кольцевой буфер последних строк вывода общим размером не больше max_bytes."""
+
+    def __init__(self, max_bytes: int = DEFAULT_TAIL_BYTES, spill_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        # Путь к файлу полного вывода, если его удалось открыть
+        self.spill_path: Optional[str] = None
+        self._lines = deque()
+        self._size = 0
+        self.total_bytes = 0
+        self.dropped_lines = 0
+        self._spill = None
+        if spill_path:
+            try:
+                self._spill = open(spill_path, 'w', encoding='utf-8')
+                self.spill_path = spill_path
+            except OSError as e:
+                logger.warning(f"Unable to write mkvmerge log {spill_path}: {e}")
+
+    def append(self, line: str):
+        size = len(line.encode('utf-8', 'replace')) + 1
+        self.total_bytes += size
+        if self._spill:
+            self._spill.write(line + '\n')
+        if size > self.max_bytes:
+            # Строка больше всего буфера: остаётся только её конец
+            line = line[-self.max_bytes:]
+            size = len(line.encode('utf-8', 'replace')) + 1
+        self._lines.append((line, size))
+        self._size += size
+        while self._size > self.max_bytes and len(self._lines) > 1:
+            _, dropped = self._lines.popleft()
+            self._size -= dropped
+            self.dropped_lines += 1
+
+    def lines(self) -> List[str]:
+        lines = [line for line, _ in self._lines]
+        if self.dropped_lines:
+            lines.insert(0, f"... {self.dropped_lines} earlier lines omitted"
+                            + (f", full log: {self.spill_path}" if self.spill_path else ""))
+        return lines
+
+    def close(self):
+        if self._spill:
+            self._spill.close()
+            self._spill = None
+
+
+def job_log_path(log_dir: str, output_file: str) -> str:
+    """Файл полного вывода задачи: <log_dir>/<имя результата>.log."""
+    return os.path.join(log_dir, os.path.basename(output_file) + LOG_SUFFIX)
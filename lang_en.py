@@ -22,5 +22,23 @@ TRANSLATIONS = {
     "critical_error": "Critical error: {error}",
     "select_directory": "Select directory",
     "drag_and_drop_placeholder": "Drag and drop folders here",
+    "parallel_jobs": "Parallel jobs:",
+    "file_progress": "Processing: {name} ({percent}%)",
+    "scanning_progress": "Processed {completed} of {found} found so far, still scanning...",
+    "skip_up_to_date": "Skip up-to-date files",
+    "resume_processing": "Resume Interrupted",
+    "stop_processing": "Stop",
+    "stopping": "Stopping...",
+    "already_running": "Processing is already running; wait for it to finish or stop it first",
+    "add_to_queue": "Add to Queue",
+    "added_to_queue": "Added to queue: {path}",
+    "preview_plan": "Preview Plan",
+    "plan_preview_title": "Merge plan",
+    "plan_start_question": "Start processing with this plan?",
+    "match_mode": "Match tracks:",
+    "match_name": "By file name",
+    "match_episode": "By episode number",
+    "match_auto": "Name, then episode",
+    "identify_tracks": "Read languages from files",
     "drop_here": "Drop here",
 }
\ No newline at end of file
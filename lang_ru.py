@@ -22,5 +22,23 @@ TRANSLATIONS = {
     "critical_error": "Критическая ошибка: {error}",
     "select_directory": "Выберите папку",
     "drag_and_drop_placeholder": "Перетащите папки сюда",
+    "parallel_jobs": "Одновременных задач:",
+    "file_progress": "Обработка: {name} ({percent}%)",
+    "scanning_progress": "Обработано {completed} из {found} найденных, поиск продолжается...",
+    "skip_up_to_date": "Пропускать уже собранные файлы",
+    "resume_processing": "Продолжить прерванную",
+    "stop_processing": "Остановить",
+    "stopping": "Остановка...",
+    "already_running": "Обработка уже идёт: дождитесь её окончания или остановите",
+    "add_to_queue": "Добавить в очередь",
+    "added_to_queue": "Добавлено в очередь: {path}",
+    "preview_plan": "Предпросмотр плана",
+    "plan_preview_title": "План сборки",
+    "plan_start_question": "Начать обработку по этому плану?",
+    "match_mode": "Сопоставление:",
+    "match_name": "По имени файла",
+    "match_episode": "По номеру эпизода",
+    "match_auto": "По имени, затем по номеру",
+    "identify_tracks": "Языки из файлов",
     "drop_here": "Отпустите здесь",
 }
\ No newline at end of file
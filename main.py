@@ -2,10 +2,19 @@ import sys
 import os
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QLineEdit, QPushButton, QScrollArea, QFileDialog,
-                             QProgressBar, QMessageBox, QSizePolicy, QFrame, QComboBox)
+                             QProgressBar, QMessageBox, QSizePolicy, QFrame, QComboBox,
+                             QSpinBox, QCheckBox)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QObject, QMimeData
 from PyQt6.QtGui import QDragEnterEvent, QDropEvent, QIcon  
-from process_data import MkvProcessor  # Импорт вашей функции обработки
+from process_data import MkvProcessor, default_max_jobs, STOP_GRACE_SECONDS  # Импорт вашей функции обработки
+from batch_queue import BatchQueue
+from discovery import discover_track_sources, SOURCE_AUDIO, SOURCE_SUBTITLE
+from episode_match import MATCH_NAME, MATCH_EPISODE, MATCH_AUTO
+from events import (Event, CoalescingSubscriber, EVENT_ERROR, EVENT_PROGRESS, EVENT_FILE_PROGRESS,
+                    ERROR_EVENTS)
+
+# Не больше стольких обновлений интерфейса в секунду, сколько бы задач ни работало
+GUI_UPDATES_PER_SECOND = 10
 
 class MediaSectionFrame(QFrame):
     filesDropped = pyqtSignal(list, str)  # list of paths, media type
@@ -31,36 +40,85 @@ class MediaSectionFrame(QFrame):
 
 
 class Worker(QObject):
-    progress_updated = pyqtSignal(int)
-    status_updated = pyqtSignal(str)
+    events_ready = pyqtSignal(list)  # пачка событий events.Event
     finished = pyqtSignal()
     error_occurred = pyqtSignal(str)
 
-    def __init__(self, series_path, output_path, audio_data, subtitle_data):
+    def __init__(self, series_path, output_path, audio_data, subtitle_data, max_jobs=None,
+                 incremental=False, resume=False, batch=False, plan=None, match_mode=MATCH_NAME,
+                 identify=False):
         super().__init__()
         self.series_path = series_path
         self.output_path = output_path
         self.audio_data = audio_data
         self.subtitle_data = subtitle_data
-        self.processor = MkvProcessor(self)
+        self.resume = resume
+        # Готовый план сборки: выполняется без повторного сопоставления дорожек
+        self.plan = plan
+        # Вместе с пропуском готовых файлов исправление языка и названий дорожек
+        # выполняется на месте через mkvpropedit, без пересборки
+        self.processor = MkvProcessor(max_jobs=max_jobs, incremental=incremental, match_mode=match_mode,
+                                      identify=identify, propedit=incremental)
+        # События объединяются в рабочем потоке, в очередь Qt попадает не больше
+        # GUI_UPDATES_PER_SECOND сигналов в секунду
+        self._events = CoalescingSubscriber(self.events_ready.emit, GUI_UPDATES_PER_SECOND)
+        self.processor.events.subscribe(self._events)
+        # В пакетном режиме сериалы добавляются в очередь, в том числе во время работы
+        self.batch_queue = BatchQueue(self.processor) if batch else None
 
     def run(self):
         try:
-            self.processor.process_files(
-                self.series_path,
-                self.output_path,
-                self.audio_data,
-                self.subtitle_data
-            )
+            if self.batch_queue:
+                self.batch_queue.run()
+            elif self.plan is not None:
+                self.processor.process_plan(self.plan)
+            elif self.resume:
+                self.processor.resume(self.output_path)
+            else:
+                self.processor.process_files(
+                    self.series_path,
+                    self.output_path,
+                    self.audio_data,
+                    self.subtitle_data
+                )
         except Exception as e:
-            self.status_updated.emit(f"Critical error: {str(e)}")
+            self.processor.events.publish(Event(EVENT_ERROR, f"Critical error: {str(e)}"))
         finally:
+            self._events.close()
             self.finished.emit()
 
     def stop(self):
         self.processor.stop()
 
 
+class PlanWorker(QObject):
+    """Построение плана сборки в отдельном потоке: сопоставление и mkvmerge -J всех эпизодов
+    на большой библиотеке заняли бы окно надолго."""
+    plan_ready = pyqtSignal(object)  # MergePlan
+    plan_failed = pyqtSignal(list)   # сообщения об ошибках
+    finished = pyqtSignal()
+
+    def __init__(self, processor, series_path, output_path, audio_data, subtitle_data):
+        super().__init__()
+        self.processor = processor
+        self.series_path = series_path
+        self.output_path = output_path
+        self.audio_data = audio_data
+        self.subtitle_data = subtitle_data
+
+    def run(self):
+        try:
+            plan = self.processor.plan(self.series_path, self.output_path, self.audio_data, self.subtitle_data)
+            if plan is None:
+                self.plan_failed.emit(list(self.processor.errors))
+            else:
+                self.plan_ready.emit(plan)
+        except Exception as e:
+            self.plan_failed.emit([f"Critical error: {str(e)}"])
+        finally:
+            self.finished.emit()
+
+
 class MediaTrackWidget(QWidget):
     removed = pyqtSignal(QWidget)
 
@@ -128,7 +186,11 @@ class MainWindow(QMainWindow):
         self.setup_ui()
         self.audio_widgets = []
         self.subtitle_widgets = []
+        # Индексы папок дорожек, построенные при обходе перетащенных папок
+        self.discovered_indexes = []
         self.worker_thread = None
+        self.plan_worker = None
+        self.plan_thread = None
 
     def load_translations(self, lang):
         if lang == "English":
@@ -170,6 +232,7 @@ class MainWindow(QMainWindow):
         self.series_edit.setPlaceholderText(self.translations["series_folder"])
         self.series_browse = QPushButton(self.translations["browse_button"])
         self.series_browse.clicked.connect(self.browse_series)
+        self.series_edit.textChanged.connect(self.series_changed)
         series_layout.addWidget(self.series_edit)
         series_layout.addWidget(self.series_browse)
         layout.addLayout(series_layout)
@@ -236,10 +299,57 @@ class MainWindow(QMainWindow):
         self.status_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
         layout.addWidget(self.status_label)
 
+        # Количество одновременных задач mkvmerge
+        jobs_layout = QHBoxLayout()
+        self.incremental_checkbox = QCheckBox(self.translations["skip_up_to_date"])
+        jobs_layout.addWidget(self.incremental_checkbox)
+        # Языки и кодеки дорожек читаются из файлов (mkvmerge -J, с кэшем на диске);
+        # выключено по умолчанию, как --identify в консольном режиме
+        self.identify_checkbox = QCheckBox(self.translations["identify_tracks"])
+        self.identify_checkbox.setChecked(False)
+        jobs_layout.addWidget(self.identify_checkbox)
+        jobs_layout.addStretch()
+        # Способ сопоставления дорожек: по имени файла или по номеру эпизода (S01E05, "- 05")
+        self.match_label = QLabel(self.translations["match_mode"])
+        jobs_layout.addWidget(self.match_label)
+        self.match_combobox = QComboBox()
+        for mode in (MATCH_NAME, MATCH_EPISODE, MATCH_AUTO):
+            self.match_combobox.addItem(self.translations[f"match_{mode}"], mode)
+        jobs_layout.addWidget(self.match_combobox)
+        self.jobs_label = QLabel(self.translations["parallel_jobs"])
+        jobs_layout.addWidget(self.jobs_label)
+        self.jobs_spinbox = QSpinBox()
+        self.jobs_spinbox.setRange(1, 64)
+        self.jobs_spinbox.setValue(default_max_jobs())
+        jobs_layout.addWidget(self.jobs_spinbox)
+        layout.addLayout(jobs_layout)
+
         self.confirm_btn = QPushButton(self.translations["start_processing"])
         self.confirm_btn.clicked.connect(self.start_processing)
         layout.addWidget(self.confirm_btn)
 
+        self.preview_btn = QPushButton(self.translations["preview_plan"])
+        self.preview_btn.clicked.connect(self.preview_plan)
+        layout.addWidget(self.preview_btn)
+
+        self.queue_btn = QPushButton(self.translations["add_to_queue"])
+        self.queue_btn.clicked.connect(self.add_to_queue)
+        layout.addWidget(self.queue_btn)
+
+        self.resume_btn = QPushButton(self.translations["resume_processing"])
+        self.resume_btn.clicked.connect(self.resume_processing)
+        layout.addWidget(self.resume_btn)
+
+        # Остановка прерывает работающие mkvmerge сразу; несделанные эпизоды остаются для resume
+        self.stop_btn = QPushButton(self.translations["stop_processing"])
+        self.stop_btn.clicked.connect(self.stop_processing)
+        self.stop_btn.setEnabled(False)
+        layout.addWidget(self.stop_btn)
+
+    def series_changed(self):
+        # Индексы, построенные для прежней папки сериала, к новой не относятся
+        self.discovered_indexes = []
+
     def browse_series(self):
         path = QFileDialog.getExistingDirectory(self, self.translations["select_directory"])
         if path:
@@ -250,11 +360,15 @@ class MainWindow(QMainWindow):
         if path:
             self.output_edit.setText(path)
 
-    def add_media_widget(self, media_type, path=None):
+    def add_media_widget(self, media_type, path=None, language=None, track_name=None):
         widget = MediaTrackWidget(self.translations)
         widget.removed.connect(self.remove_media_widget)
         if path is not None:
             widget.path_edit.setText(path)
+        if language:
+            widget.lang_edit.setText(language)
+        if track_name:
+            widget.track_edit.setText(track_name)
 
         if media_type == "audio":
             self.audio_widgets.append(widget)
@@ -270,8 +384,21 @@ class MainWindow(QMainWindow):
         scroll_layout.insertWidget(scroll_layout.count() - 1, widget)
 
     def handle_dropped_files(self, paths, media_type):
+        source_type = SOURCE_AUDIO if media_type == "audio" else SOURCE_SUBTITLE
         for path in paths:
-            self.add_media_widget(media_type, path)
+            # Папка релиза обходится один раз: каждая вложенная папка с дорожками
+            # становится отдельным источником, а её индекс переиспользуется при запуске
+            try:
+                discovery = discover_track_sources(path)
+            except OSError:
+                discovery = None
+            sources = discovery.sources[source_type] if discovery else []
+            if not sources:
+                self.add_media_widget(media_type, path)
+                continue
+            self.discovered_indexes.extend(discovery.indexes)
+            for source in sources:
+                self.add_media_widget(media_type, source['path'], source['language'], source['track_name'])
 
     def remove_media_widget(self, widget):
         if widget in self.audio_widgets:
@@ -291,7 +418,8 @@ class MainWindow(QMainWindow):
             data = widget.get_data()
             if not os.path.isdir(data['path']):
                 errors.append(f"Invalid path in {widget}")
-            if not data['language']:
+            # Пустой язык берётся из файла, если включено чтение сведений о дорожках
+            if not data['language'] and not self.identify_checkbox.isChecked():
                 errors.append(self.translations["missing_language"].format(widget=widget))
 
         return errors
@@ -305,23 +433,194 @@ class MainWindow(QMainWindow):
         audio_data = [w.get_data() for w in self.audio_widgets]
         subtitle_data = [w.get_data() for w in self.subtitle_widgets]
 
-        self.progress.show()
+        self.run_worker(Worker(
+            self.series_edit.text(),
+            self.output_edit.text(),
+            audio_data,
+            subtitle_data,
+            self.jobs_spinbox.value(),
+            self.incremental_checkbox.isChecked(),
+            match_mode=self.match_combobox.currentData(),
+            identify=self.identify_checkbox.isChecked()
+        ))
+
+    def preview_plan(self):
+        errors = self.validate_inputs()
+        if errors:
+            QMessageBox.critical(self, "Error", "\n".join(errors))
+            return
+
+        # Сопоставление дорожек выполняется один раз; по плану затем идёт обработка
+        processor = MkvProcessor(max_jobs=self.jobs_spinbox.value(),
+                                 incremental=self.incremental_checkbox.isChecked(),
+                                 match_mode=self.match_combobox.currentData(),
+                                 identify=self.identify_checkbox.isChecked())
+        for index in self.discovered_indexes:
+            processor.use_track_index(index)
+        self.plan_worker = PlanWorker(
+            processor,
+            self.series_edit.text(),
+            self.output_edit.text(),
+            [w.get_data() for w in self.audio_widgets],
+            [w.get_data() for w in self.subtitle_widgets]
+        )
+        self.plan_thread = QThread()
+        self.plan_worker.moveToThread(self.plan_thread)
+        self.plan_worker.plan_ready.connect(self.show_plan)
+        self.plan_worker.plan_failed.connect(self.plan_failed)
+        self.plan_worker.finished.connect(self.plan_thread.quit)
+        self.plan_worker.finished.connect(self.plan_finished)
+        self.plan_thread.started.connect(self.plan_worker.run)
+        self.preview_btn.setEnabled(False)
         self.status_label.setText(self.translations["preparing_processing"])
+        self.plan_thread.start()
+
+    def plan_failed(self, errors):
+        self.status_label.setText("")
+        QMessageBox.critical(self, "Error", "\n".join(errors))
+
+    def plan_finished(self):
+        self.preview_btn.setEnabled(True)
+
+    def show_plan(self, plan):
+        self.status_label.setText("")
+        box = QMessageBox(self)
+        box.setWindowTitle(self.translations["plan_preview_title"])
+        box.setText(plan.format_summary())
+        box.setInformativeText(self.translations["plan_start_question"])
+        box.setDetailedText(plan.format_preview())
+        box.setStandardButtons(QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.Cancel)
+        if box.exec() != QMessageBox.StandardButton.Yes:
+            return
 
-        self.worker = Worker(
+        self.run_worker(Worker(
+            plan.series_path,
+            plan.output_path,
+            plan.audio_data,
+            plan.subtitle_data,
+            self.jobs_spinbox.value(),
+            self.incremental_checkbox.isChecked(),
+            plan=plan
+        ))
+
+    def add_to_queue(self):
+        errors = self.validate_inputs()
+        if errors:
+            QMessageBox.critical(self, "Error", "\n".join(errors))
+            return
+
+        job = (
             self.series_edit.text(),
             self.output_edit.text(),
-            audio_data,
-            subtitle_data
+            [w.get_data() for w in self.audio_widgets],
+            [w.get_data() for w in self.subtitle_widgets]
+        )
+
+        # Если очередь уже работает, сериал добавляется в неё, иначе запускается новая
+        if self.worker_running():
+            batch_queue = self.worker.batch_queue
+            if batch_queue and batch_queue.add(*job):
+                self.status_label.setText(self.translations["added_to_queue"].format(path=job[0]))
+                return
+            # Идёт обычная обработка или очередь уже закрывается: второй поток не запускается
+            QMessageBox.critical(self, "Error", self.translations["already_running"])
+            return
+
+        worker = Worker(
+            None,
+            None,
+            [],
+            [],
+            self.jobs_spinbox.value(),
+            self.incremental_checkbox.isChecked(),
+            batch=True,
+            match_mode=self.match_combobox.currentData(),
+            identify=self.identify_checkbox.isChecked()
         )
+        worker.batch_queue.add(*job)
+        self.run_worker(worker)
+
+    def resume_processing(self):
+        # Параметры прерванного запуска берутся из журнала в выходной папке
+        output_path = self.output_edit.text()
+        if not os.path.isdir(output_path):
+            QMessageBox.critical(self, "Error", self.translations["invalid_output_folder"])
+            return
+
+        self.run_worker(Worker(
+            None,
+            output_path,
+            [],
+            [],
+            self.jobs_spinbox.value(),
+            self.incremental_checkbox.isChecked(),
+            resume=True
+        ))
+
+    def run_worker(self, worker):
+        # Два рабочих потока писали бы в одни и те же журналы и выходные папки
+        if self.worker_running():
+            QMessageBox.critical(self, "Error", self.translations["already_running"])
+            return
+        self.progress.show()
+        self.status_label.setText(self.translations["preparing_processing"])
 
+        self.worker = worker
+        # Устаревшие индексы (папка изменилась после обхода) процессор отбросит сам
+        for index in self.discovered_indexes:
+            worker.processor.use_track_index(index)
         self.worker_thread = QThread()
         self.worker.moveToThread(self.worker_thread)
-        self.worker.progress_updated.connect(self.progress.setValue)
-        self.worker.status_updated.connect(self.status_label.setText)
+        self.worker.events_ready.connect(self.apply_events)
         self.worker.finished.connect(self.worker_thread.quit)
+        self.worker.finished.connect(self.worker_finished)
         self.worker_thread.started.connect(self.worker.run)
         self.worker_thread.start()
+        self.stop_btn.setEnabled(True)
+
+    def worker_running(self) -> bool:
+        return self.worker_thread is not None and self.worker_thread.isRunning()
+
+    def stop_processing(self):
+        if self.worker_running():
+            self.worker.stop()
+            self.stop_btn.setEnabled(False)
+            self.status_label.setText(self.translations["stopping"])
+
+    def worker_finished(self):
+        self.stop_btn.setEnabled(False)
+
+    def closeEvent(self, event):
+        # Закрытие окна во время работы останавливает обработку, чтобы не оставлять mkvmerge
+        # и недописанные .part-файлы; ожидание ограничено временем принудительного завершения
+        if self.worker_running():
+            self.worker.stop()
+            self.worker_thread.wait(int((STOP_GRACE_SECONDS + 5) * 1000))
+        # Построение плана не прерывается, поток дожидается его окончания
+        if self.plan_thread is not None and self.plan_thread.isRunning():
+            self.plan_thread.wait()
+        super().closeEvent(event)
+
+    def apply_events(self, events):
+        # В пачке важно только последнее значение прогресса и последнее сообщение
+        status_text = None
+        for event in events:
+            if event.kind == EVENT_PROGRESS:
+                if event.value is None:
+                    # Папка ещё читается: индикатор без процентов и счётчик готовых эпизодов
+                    self.progress.setRange(0, 0)
+                    status_text = self.translations["scanning_progress"].format(**event.data)
+                else:
+                    self.progress.setRange(0, 100)
+                    self.progress.setValue(event.value)
+            elif event.kind == EVENT_FILE_PROGRESS:
+                status_text = self.translations["file_progress"].format(name=event.episode, percent=event.value)
+            elif event.kind in ERROR_EVENTS:
+                status_text = f"Error: {event.message}"
+            elif event.message:
+                status_text = event.message
+        if status_text is not None:
+            self.status_label.setText(status_text)
 
     def change_language(self, lang_text):
         self.load_translations(lang_text)   
@@ -336,6 +635,16 @@ class MainWindow(QMainWindow):
         self.series_browse.setText(self.translations["browse_button"])
         self.output_browse.setText(self.translations["browse_button"])
         self.confirm_btn.setText(self.translations["start_processing"])
+        self.preview_btn.setText(self.translations["preview_plan"])
+        self.queue_btn.setText(self.translations["add_to_queue"])
+        self.resume_btn.setText(self.translations["resume_processing"])
+        self.stop_btn.setText(self.translations["stop_processing"])
+        self.jobs_label.setText(self.translations["parallel_jobs"])
+        self.incremental_checkbox.setText(self.translations["skip_up_to_date"])
+        self.identify_checkbox.setText(self.translations["identify_tracks"])
+        self.match_label.setText(self.translations["match_mode"])
+        for index in range(self.match_combobox.count()):
+            self.match_combobox.setItemText(index, self.translations[f"match_{self.match_combobox.itemData(index)}"])
         
         # Update sections
         self.audio_section.layout().itemAt(0).layout().itemAt(0).widget().setText(self.translations["audio_tracks"])
@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from typing import Optional, List, Dict
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.mkvmerge_auto_manifest.json'
+MANIFEST_VERSION = 2
+# Прежний формат: один JSON-документ, переписываемый после каждого эпизода
+MANIFEST_VERSION_SNAPSHOT = 1
+# Дописанных записей не больше, чем результатов в снимке (но не меньше этого числа)
+MANIFEST_COMPACT_MIN_RECORDS = 256
+# Как часто дописанные записи сбрасываются на диск через fsync
+MANIFEST_SYNC_SECONDS = 1.0
+# Сколько байт читать с начала и с конца файла для быстрого частичного хэша
+PARTIAL_HASH_CHUNK = 64 * 1024
+
+
+def partial_hash(path: str) -> str:
+    """Быстрый хэш: размер файла плюс первые и последние PARTIAL_HASH_CHUNK байт."""
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as f:
+        digest.update(f.read(PARTIAL_HASH_CHUNK))
+        if size > PARTIAL_HASH_CHUNK * 2:
+            f.seek(-PARTIAL_HASH_CHUNK, os.SEEK_END)
+            digest.update(f.read(PARTIAL_HASH_CHUNK))
+    return digest.hexdigest()
+
+
+def describe_file(path: str, with_hash: bool = False) -> Dict:
+    """Отпечаток входного файла: путь, размер, mtime и (опционально) частичный хэш."""
+    stat = os.stat(path)
+    info = {
+        'path': os.path.abspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+    if with_hash:
+        info['hash'] = partial_hash(path)
+    return info
+
+
+class MergeManifest:
+    """Манифест выходной папки: какие входные файлы и какая команда дали каждый результат.
+
+    Используется для инкрементальных перезапусков: результат пропускается, если его
+    входные файлы и команда не изменились, а сам файл на месте. Формат — как у журнала
+    заданий: снимок в первой строке и дописываемые записи (null — запись удалена), снимок
+    переписывается, когда записей больше, чем результатов.
+    """
+
+    def __init__(self, output_path: str, with_hash: bool = False):
+        self.path = os.path.join(output_path, MANIFEST_NAME)
+        self.with_hash = with_hash
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        self._records = 0
+        self._synced_at = 0.0
+        # Дописывать можно только после снимка нового формата в первой строке
+        self._has_snapshot = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return
+        lines = text.splitlines()
+        try:
+            data = json.loads(lines[0]) if lines else None
+        except ValueError:
+            data = None
+        if data is None:
+            # Манифест прежнего формата записан одним многострочным документом
+            try:
+                data = json.loads(text)
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+                return
+            if isinstance(data, dict) and data.get('version') == MANIFEST_VERSION_SNAPSHOT:
+                self._entries = data.get('outputs', {})
+            return
+        if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+            return
+        self._entries = data.get('outputs', {})
+        self._has_snapshot = True
+        for number, line in enumerate(lines[1:], 2):
+            try:
+                record = json.loads(line)
+                key, entry = record['output'], record['entry']
+            except (ValueError, KeyError, TypeError):
+                # Последняя строка может быть недописана при сбое
+                logger.warning(f"Ignoring damaged manifest record {self.path}:{number}")
+                continue
+            if entry is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = entry
+        self._records = max(0, len(lines) - 1)
+
+    def save(self):
+        """Запись снимка манифеста вместо накопленных записей."""
+        # Запись под блокировкой: задачи из разных потоков не должны делить временный файл
+        with self._lock:
+            self._write_snapshot()
+
+    def _write_snapshot(self):
+        data = {'version': MANIFEST_VERSION, 'outputs': self._entries}
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Unable to write manifest {self.path}: {e}")
+            return
+        self._records = 0
+        self._synced_at = time.monotonic()
+        self._has_snapshot = True
+
+    def _append(self, key: str, entry: Optional[Dict]):
+        """Дописывание одной записи (None — удаление); при большом числе записей — новый снимок."""
+        with self._lock:
+            if entry is None:
+                self._entries.pop(key, None)
+            else:
+                self._entries[key] = entry
+            self._records += 1
+            if (not self._has_snapshot
+                    or self._records > max(MANIFEST_COMPACT_MIN_RECORDS, len(self._entries))):
+                self._write_snapshot()
+                return
+            line = json.dumps({'output': key, 'entry': entry}, ensure_ascii=False) + '\n'
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                    f.flush()
+                    now = time.monotonic()
+                    if now - self._synced_at >= MANIFEST_SYNC_SECONDS:
+                        os.fsync(f.fileno())
+                        self._synced_at = now
+            except OSError as e:
+                logger.warning(f"Unable to write manifest {self.path}: {e}")
+
+    @staticmethod
+    def _key(output_file: str) -> str:
+        return os.path.basename(output_file)
+
+    def _fingerprint(self, inputs: List[str]) -> List[Dict]:
+        return [describe_file(path, self.with_hash) for path in inputs]
+
+    def is_up_to_date(self, output_file: str, inputs: List[str], command: List[str]) -> bool:
+        """True, если результат существует и собран из тех же файлов той же командой."""
+        with self._lock:
+            entry = self._entries.get(self._key(output_file))
+        if not entry or entry.get('command') != command:
+            return False
+        return self.inputs_unchanged(output_file, inputs)
+
+    def inputs_unchanged(self, output_file: str, inputs: List[str]) -> bool:
+        """True, если результат на месте и собран из тех же файлов (команда могла измениться)."""
+        with self._lock:
+            entry = self._entries.get(self._key(output_file))
+        if not entry:
+            return False
+        try:
+            stat = os.stat(output_file)
+            if stat.st_size != entry.get('output_size') or stat.st_mtime_ns != entry.get('output_mtime_ns'):
+                return False
+            recorded = entry.get('inputs', [])
+            if [item['path'] for item in recorded] != [os.path.abspath(path) for path in inputs]:
+                return False
+            for item, path in zip(recorded, inputs):
+                stat = os.stat(path)
+                if stat.st_size != item.get('size') or stat.st_mtime_ns != item.get('mtime_ns'):
+                    return False
+                # Частичный хэш считается только если размер и mtime совпали
+                if self.with_hash and 'hash' in item and partial_hash(path) != item['hash']:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def record(self, output_file: str, inputs: List[str], command: List[str]):
+        """Запись успешно собранного результата; на диск дописывается одна строка."""
+        try:
+            stat = os.stat(output_file)
+            entry = {
+                'inputs': self._fingerprint(inputs),
+                'command': command,
+                'output_size': stat.st_size,
+                'output_mtime_ns': stat.st_mtime_ns,
+            }
+        except OSError as e:
+            logger.warning(f"Unable to record {output_file} in manifest: {e}")
+            return
+        self._append(self._key(output_file), entry)
+
+    def forget(self, output_file: str):
+        """Удаление записи о результате (сборка не удалась) с записью на диск."""
+        key = self._key(output_file)
+        with self._lock:
+            known = key in self._entries
+        # Запись на диск нужна, только если запись была: иначе после перезапуска
+        # устаревший результат мог бы считаться актуальным
+        if known:
+            self._append(key, None)
@@ -0,0 +1,173 @@
+"""Метрики по эпизодам: время сопоставления, запуска и работы mkvmerge, объём и скорость.
+
+Записи по мере завершения эпизодов дописываются в JSON-lines файл, а в конце запуска
+сохраняется файл для textfile collector node exporter и сводка с перцентилями.
+"""
+import os
+import json
+import time
+import threading
+import logging
+from typing import Optional, List, Dict
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'mkvmerge_auto'
+PERCENTILES = (50, 90, 99)
+
+STATUS_OK = 'ok'
+STATUS_FAILED = 'failed'
+STATUS_SKIPPED = 'skipped'
+STATUS_ERROR = 'error'
+STATUS_CANCELLED = 'cancelled'  # mkvmerge завершён остановкой обработки
+
+# Поля записи, для которых считаются перцентили
+TIMING_FIELDS = ('match_seconds', 'spawn_seconds', 'wall_seconds', 'mb_per_second')
+
+
+def percentile(values: List[float], percent: float) -> Optional[float]:
+    """Перцентиль методом ближайшего ранга; None для пустого списка."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+def _escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class MetricsRecorder:
+    """Сбор метрик эпизодов одного запуска; безопасен для нескольких потоков."""
+
+    def __init__(self, jsonl_path: Optional[str] = None, prometheus_path: Optional[str] = None):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._started_monotonic = time.monotonic()
+
+    def reset(self):
+        with self._lock:
+            self.records = []
+            self._started = time.time()
+            self._started_monotonic = time.monotonic()
+
+    def record(self, video_file: str, status: str, exit_code: Optional[int] = None,
+               match_seconds: float = 0.0, spawn_seconds: Optional[float] = None,
+               wall_seconds: Optional[float] = None, bytes_read: int = 0, bytes_written: int = 0) -> Dict:
+        mb_per_second = None
+        if wall_seconds:
+            mb_per_second = (bytes_read + bytes_written) / wall_seconds / 1024 / 1024
+        entry = {
+            'timestamp': time.time(),
+            'episode': os.path.splitext(os.path.basename(video_file))[0],
+            'video_file': video_file,
+            'status': status,
+            'exit_code': exit_code,
+            'match_seconds': round(match_seconds, 6),
+            'spawn_seconds': round(spawn_seconds, 6) if spawn_seconds is not None else None,
+            'wall_seconds': round(wall_seconds, 6) if wall_seconds is not None else None,
+            'bytes_read': bytes_read,
+            'bytes_written': bytes_written,
+            'mb_per_second': round(mb_per_second, 3) if mb_per_second is not None else None,
+        }
+        with self._lock:
+            self.records.append(entry)
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                except OSError as e:
+                    logger.warning(f"Unable to write metrics to {self.jsonl_path}: {e}")
+        return entry
+
+    def summary(self) -> Dict:
+        """Итоги запуска: число эпизодов по статусам, объём, перцентили времени и скорости."""
+        with self._lock:
+            records = list(self.records)
+            duration = time.monotonic() - self._started_monotonic
+        statuses: Dict[str, int] = {}
+        for entry in records:
+            statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+        result = {
+            'episodes': len(records),
+            'statuses': statuses,
+            'duration_seconds': round(duration, 3),
+            'bytes_read': sum(entry['bytes_read'] for entry in records),
+            'bytes_written': sum(entry['bytes_written'] for entry in records),
+        }
+        for field in TIMING_FIELDS:
+            values = [entry[field] for entry in records if entry[field] is not None]
+            stats = {f"p{percent}": percentile(values, percent) for percent in PERCENTILES}
+            stats['max'] = max(values) if values else None
+            result[field] = stats
+        return result
+
+    def format_summary(self, summary: Optional[Dict] = None) -> str:
+        summary = summary or self.summary()
+        parts = [f"{summary['episodes']} episodes in {summary['duration_seconds']:.1f}s"]
+        for field, title in (('match_seconds', 'match'), ('spawn_seconds', 'spawn'), ('wall_seconds', 'mkvmerge')):
+            stats = summary[field]
+            if stats['p50'] is not None:
+                parts.append(f"{title} p50/p90/p99 {stats['p50']:.3f}/{stats['p90']:.3f}/{stats['p99']:.3f}s")
+        speed = summary['mb_per_second']
+        if speed['p50'] is not None:
+            parts.append(f"speed p50 {speed['p50']:.1f} MB/s")
+        return "Metrics: " + ", ".join(parts)
+
+    def _prometheus_text(self, summary: Dict) -> str:
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: List):
+            full_name = f"{METRIC_PREFIX}_{name}"
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(str(label))}"' for key, label in labels.items())
+                lines.append(f"{full_name}{suffix}{{{label_text}}} {value}" if label_text
+                             else f"{full_name}{suffix} {value}")
+
+        metric('episodes', 'gauge', 'Episodes in the last run by status.',
+               [('', {'status': status}, count) for status, count in sorted(summary['statuses'].items())])
+        metric('run_duration_seconds', 'gauge', 'Duration of the last run.',
+               [('', {}, summary['duration_seconds'])])
+        metric('run_start_timestamp_seconds', 'gauge', 'Start time of the last run.',
+               [('', {}, round(self._started, 3))])
+        metric('bytes_read', 'gauge', 'Bytes read by mkvmerge in the last run.',
+               [('', {}, summary['bytes_read'])])
+        metric('bytes_written', 'gauge', 'Bytes written by mkvmerge in the last run.',
+               [('', {}, summary['bytes_written'])])
+
+        with self._lock:
+            records = list(self.records)
+        for field, help_text in (('match_seconds', 'Track matching time per episode.'),
+                                 ('spawn_seconds', 'mkvmerge process spawn latency per episode.'),
+                                 ('wall_seconds', 'mkvmerge wall time per episode.'),
+                                 ('mb_per_second', 'mkvmerge throughput per episode, MB/s.')):
+            values = [entry[field] for entry in records if entry[field] is not None]
+            samples = [('', {'quantile': str(percent / 100)}, summary[field][f"p{percent}"])
+                       for percent in PERCENTILES if values]
+            samples.append(('_sum', {}, round(sum(values), 6)))
+            samples.append(('_count', {}, len(values)))
+            metric(f"episode_{field}", 'summary', help_text, samples)
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, summary: Optional[Dict] = None):
+        """Запись файла для textfile collector; замена атомарная, чтобы экспортер не прочитал половину."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self._prometheus_text(summary or self.summary()))
+        os.replace(tmp_path, path)
+
+    def finish(self) -> Dict:
+        """Сводка запуска; при заданном пути сохраняет метрики для Prometheus."""
+        summary = self.summary()
+        if self.prometheus_path:
+            try:
+                self.write_prometheus(self.prometheus_path, summary)
+            except OSError as e:
+                logger.warning(f"Unable to write Prometheus metrics to {self.prometheus_path}: {e}")
+        return summary
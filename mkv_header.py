@@ -0,0 +1,287 @@
+"""Чтение заголовка Matroska (EBML) без запуска mkvmerge.
+
+Разбираются только EBML-заголовок, SeekHead, Segment Info и Tracks. Читается начало
+файла (обычно несколько десятков КБ) и, если Tracks записан дальше, небольшой
+фрагмент по адресу из SeekHead, поэтому проверка тысячи файлов занимает доли секунды.
+"""
+import os
+import struct
+import logging
+from typing import Optional, List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько байт читать с начала файла; Tracks почти всегда помещается в них
+HEAD_READ_BYTES = 64 * 1024
+# Больше этого элементы заголовка не читаются (защита от повреждённых размеров)
+MAX_ELEMENT_BYTES = 1024 * 1024
+MATROSKA_EXTENSIONS = ('.mkv', '.mka', '.mks', '.webm')
+DOC_TYPES = ('matroska', 'webm')
+
+ID_EBML = 0x1A45DFA3
+ID_DOC_TYPE = 0x4282
+ID_SEGMENT = 0x18538067
+ID_SEEK_HEAD = 0x114D9B74
+ID_SEEK = 0x4DBB
+ID_SEEK_ID = 0x53AB
+ID_SEEK_POSITION = 0x53AC
+ID_INFO = 0x1549A966
+ID_TIMESTAMP_SCALE = 0x2AD7B1
+ID_DURATION = 0x4489
+ID_TITLE = 0x7BA9
+ID_TRACKS = 0x1654AE6B
+ID_TRACK_ENTRY = 0xAE
+ID_TRACK_NUMBER = 0xD7
+ID_TRACK_TYPE = 0x83
+ID_CODEC_ID = 0x86
+ID_LANGUAGE = 0x22B59C
+ID_LANGUAGE_BCP47 = 0x22B59D
+ID_NAME = 0x536E
+ID_FLAG_DEFAULT = 0x88
+ID_FLAG_FORCED = 0x55AA
+ID_CLUSTER = 0x1F43B675
+
+TRACK_TYPES = {1: 'video', 2: 'audio', 17: 'subtitle'}
+# Названия кодеков, как их выводит mkvmerge -J, чтобы сведения из обоих источников сравнивались
+CODEC_NAMES = {
+    'V_MPEG4/ISO/AVC': 'AVC/H.264/MPEG-4p10', 'V_MPEGH/ISO/HEVC': 'HEVC/H.265/MPEG-H',
+    'V_AV1': 'AV1', 'V_VP8': 'VP8', 'V_VP9': 'VP9', 'V_MPEG2': 'MPEG-1/2',
+    'A_AAC': 'AAC', 'A_AC3': 'AC-3', 'A_EAC3': 'E-AC-3', 'A_DTS': 'DTS', 'A_FLAC': 'FLAC',
+    'A_OPUS': 'Opus', 'A_VORBIS': 'Vorbis', 'A_MPEG/L3': 'MP3', 'A_MPEG/L2': 'MP2',
+    'A_TRUEHD': 'TrueHD', 'A_PCM/INT/LIT': 'PCM', 'A_PCM/INT/BIG': 'PCM', 'A_PCM/FLOAT/IEEE': 'PCM',
+    'S_TEXT/UTF8': 'SubRip/SRT', 'S_TEXT/ASS': 'SubStationAlpha', 'S_TEXT/SSA': 'SubStationAlpha',
+    'S_TEXT/WEBVTT': 'WebVTT', 'S_HDMV/PGS': 'HDMV PGS', 'S_VOBSUB': 'VobSub',
+}
+UNKNOWN_SIZE = -1
+
+
+class MatroskaError(ValueError):
+    """Файл не Matroska, повреждён или обрезан."""
+
+
+def _read_vint(data: bytes, pos: int, keep_marker: bool) -> Tuple[int, int]:
+    """EBML-число переменной длины: (значение, позиция после него)."""
+    if pos >= len(data):
+        raise MatroskaError("unexpected end of header")
+    first = data[pos]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        mask >>= 1
+        length += 1
+    if length > 8 or pos + length > len(data):
+        raise MatroskaError("invalid EBML number")
+    value = first if keep_marker else first & (mask - 1)
+    all_ones = value == mask - 1
+    for byte in data[pos + 1:pos + length]:
+        value = (value << 8) | byte
+        all_ones = all_ones and byte == 0xFF
+    if not keep_marker and all_ones:
+        return UNKNOWN_SIZE, pos + length
+    return value, pos + length
+
+
+def _read_element(data: bytes, pos: int) -> Tuple[int, int, int]:
+    """(ID, размер данных, начало данных) элемента с позиции pos."""
+    element_id, pos = _read_vint(data, pos, keep_marker=True)
+    size, pos = _read_vint(data, pos, keep_marker=False)
+    return element_id, size, pos
+
+
+def _children(data: bytes, start: int, end: int):
+    """Дочерние элементы в data[start:end]; обрезанный последний элемент пропускается."""
+    pos = start
+    while pos < end:
+        element_id, size, data_start = _read_element(data, pos)
+        if size == UNKNOWN_SIZE or data_start + size > end:
+            return
+        yield element_id, data[data_start:data_start + size]
+        pos = data_start + size
+
+
+def _uint(payload: bytes) -> int:
+    return int.from_bytes(payload, 'big') if payload else 0
+
+
+def _float(payload: bytes) -> Optional[float]:
+    if len(payload) == 4:
+        return struct.unpack('>f', payload)[0]
+    if len(payload) == 8:
+        return struct.unpack('>d', payload)[0]
+    return None
+
+
+def _text(payload: bytes) -> str:
+    return payload.rstrip(b'\0').decode('utf-8', 'replace')
+
+
+def _parse_tracks(payload: bytes) -> List[Dict]:
+    tracks = []
+    for element_id, entry in _children(payload, 0, len(payload)):
+        if element_id != ID_TRACK_ENTRY:
+            continue
+        # Значения по умолчанию из спецификации Matroska
+        fields = {'number': 0, 'type': '', 'codec_id': '', 'language': 'eng', 'language_ietf': '',
+                  'name': '', 'default': True, 'forced': False}
+        for child_id, value in _children(entry, 0, len(entry)):
+            if child_id == ID_TRACK_NUMBER:
+                fields['number'] = _uint(value)
+            elif child_id == ID_TRACK_TYPE:
+                fields['type'] = TRACK_TYPES.get(_uint(value), str(_uint(value)))
+            elif child_id == ID_CODEC_ID:
+                fields['codec_id'] = _text(value)
+            elif child_id == ID_LANGUAGE:
+                fields['language'] = _text(value)
+            elif child_id == ID_LANGUAGE_BCP47:
+                fields['language_ietf'] = _text(value)
+            elif child_id == ID_NAME:
+                fields['name'] = _text(value)
+            elif child_id == ID_FLAG_DEFAULT:
+                fields['default'] = bool(_uint(value))
+            elif child_id == ID_FLAG_FORCED:
+                fields['forced'] = bool(_uint(value))
+        tracks.append(fields)
+    return tracks
+
+
+def _parse_info(payload: bytes) -> Dict:
+    info = {'timestamp_scale': 1000000, 'duration': None, 'title': ''}
+    for element_id, value in _children(payload, 0, len(payload)):
+        if element_id == ID_TIMESTAMP_SCALE:
+            info['timestamp_scale'] = _uint(value)
+        elif element_id == ID_DURATION:
+            info['duration'] = _float(value)
+        elif element_id == ID_TITLE:
+            info['title'] = _text(value)
+    return info
+
+
+def _parse_seek_head(payload: bytes) -> Dict[int, int]:
+    positions = {}
+    for element_id, seek in _children(payload, 0, len(payload)):
+        if element_id != ID_SEEK:
+            continue
+        target, position = None, None
+        for child_id, value in _children(seek, 0, len(seek)):
+            if child_id == ID_SEEK_ID:
+                target = _uint(value)
+            elif child_id == ID_SEEK_POSITION:
+                position = _uint(value)
+        if target is not None and position is not None:
+            positions.setdefault(target, position)
+    return positions
+
+
+def read_header(path: str) -> Dict:
+    """Сведения из заголовка Matroska-файла; MatroskaError, если файл не Matroska или обрезан.
+
+    Результат: doc_type, file_size, segment_size (-1 — неизвестен), duration в секундах,
+    title и tracks (number, type, codec_id, language, language_ietf, name, default, forced).
+    """
+    with open(path, 'rb') as f:
+        file_size = os.fstat(f.fileno()).st_size
+        data = f.read(HEAD_READ_BYTES)
+
+        try:
+            element_id, size, pos = _read_element(data, 0)
+        except MatroskaError:
+            element_id = None
+        if element_id != ID_EBML or size == UNKNOWN_SIZE or pos + size > len(data):
+            raise MatroskaError("not a Matroska file" if data else "empty file")
+        doc_type = ''
+        for child_id, value in _children(data, pos, pos + size):
+            if child_id == ID_DOC_TYPE:
+                doc_type = _text(value)
+        if doc_type not in DOC_TYPES:
+            raise MatroskaError(f"unsupported document type: {doc_type or 'none'}")
+
+        element_id, segment_size, segment_start = _read_element(data, pos + size)
+        if element_id != ID_SEGMENT:
+            raise MatroskaError("no Segment element")
+        if segment_size != UNKNOWN_SIZE and segment_start + segment_size > file_size:
+            raise MatroskaError(f"truncated: {file_size} of {segment_start + segment_size} bytes")
+
+        result = {'doc_type': doc_type, 'file_size': file_size, 'segment_size': segment_size,
+                  'duration': None, 'title': '', 'tracks': None}
+        seek_positions: Dict[int, int] = {}
+        info = None
+        # Элементы верхнего уровня до первого кластера в прочитанном начале файла
+        pos = segment_start
+        while pos < len(data):
+            try:
+                element_id, size, data_start = _read_element(data, pos)
+            except MatroskaError:
+                break
+            if element_id == ID_CLUSTER or size == UNKNOWN_SIZE or data_start + size > len(data):
+                break
+            payload = data[data_start:data_start + size]
+            if element_id == ID_SEEK_HEAD:
+                seek_positions.update(_parse_seek_head(payload))
+            elif element_id == ID_INFO:
+                info = _parse_info(payload)
+            elif element_id == ID_TRACKS:
+                result['tracks'] = _parse_tracks(payload)
+            pos = data_start + size
+
+        # Элементы за пределами прочитанного начала — по адресам из SeekHead
+        for target in (ID_INFO, ID_TRACKS):
+            if (target == ID_INFO and info is not None) or (target == ID_TRACKS and result['tracks'] is not None):
+                continue
+            if target not in seek_positions:
+                continue
+            offset = segment_start + seek_positions[target]
+            if offset >= file_size:
+                raise MatroskaError("truncated: header points past the end of file")
+            f.seek(offset)
+            chunk = f.read(64)
+            element_id, size, data_start = _read_element(chunk, 0)
+            if element_id != target or size == UNKNOWN_SIZE or size > MAX_ELEMENT_BYTES:
+                continue
+            payload = chunk[data_start:] + f.read(max(0, size - (len(chunk) - data_start)))
+            if len(payload) < size:
+                raise MatroskaError("truncated header element")
+            if target == ID_INFO:
+                info = _parse_info(payload[:size])
+            else:
+                result['tracks'] = _parse_tracks(payload[:size])
+
+    if result['tracks'] is None:
+        raise MatroskaError("no Tracks element")
+    if info:
+        result['title'] = info['title']
+        if info['duration'] is not None:
+            result['duration'] = info['duration'] * info['timestamp_scale'] / 1e9
+    return result
+
+
+def check_matroska(path: str) -> Optional[str]:
+    """Причина, по которой файл не годится как Matroska-вход, или None."""
+    try:
+        read_header(path)
+    except MatroskaError as e:
+        return str(e)
+    except OSError as e:
+        return e.strerror or str(e)
+    return None
+
+
+def identify_info(path: str) -> Optional[Dict]:
+    """Сведения о дорожках в формате track_info (как из mkvmerge -J) или None."""
+    try:
+        header = read_header(path)
+    except (MatroskaError, OSError):
+        return None
+    tracks = []
+    # Номера дорожек mkvmerge идут по порядку записей, начиная с нуля
+    for number, track in enumerate(header['tracks']):
+        tracks.append({
+            'id': number,
+            'type': track['type'],
+            'codec': CODEC_NAMES.get(track['codec_id'], track['codec_id']),
+            'language': track['language'],
+            'language_ietf': track['language_ietf'],
+            'name': track['name'],
+            'default': track['default'],
+            'forced': track['forced'],
+        })
+    return {'container': 'Matroska' if header['doc_type'] == 'matroska' else 'WebM', 'tracks': tracks}
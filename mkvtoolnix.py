@@ -0,0 +1,102 @@
+import os
+import re
+import json
+import platform
+import subprocess
+import logging
+from typing import Optional, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+APP_CACHE_NAME = 'py-mkvmerge-auto'
+BINARY_CACHE_FILE = 'binaries.json'
+
+
+def get_cache_dir() -> str:
+    """Папка для служебных кэшей приложения (можно переопределить переменной окружения)."""
+    override = os.environ.get('PY_MKVMERGE_AUTO_CACHE_DIR')
+    if override:
+        return override
+    if platform.system() == 'Windows':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif platform.system() == 'Darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, APP_CACHE_NAME)
+
+
+def parse_version(text: str) -> Optional[Tuple[int, ...]]:
+    """Разбор строки вида "mkvmerge v80.0 ('Roundabout') 64-bit" в кортеж (80, 0)."""
+    match = re.search(r'v(\d+(?:\.\d+)*)', text or '')
+    if not match:
+        return None
+    return tuple(int(part) for part in match.group(1).split('.'))
+
+
+def probe_version(path: str) -> Optional[str]:
+    """Запуск `<path> --version` и возврат первой строки вывода."""
+    try:
+        result = subprocess.run(
+            [path, '--version'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0:
+        return None
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if lines else ''
+
+
+def _binary_cache_path() -> str:
+    return os.path.join(get_cache_dir(), BINARY_CACHE_FILE)
+
+
+def _read_binary_cache() -> Dict:
+    try:
+        with open(_binary_cache_path(), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def load_cached_binary(name: str) -> Optional[Dict]:
+    """Запись кэша для бинарника, если файл по-прежнему существует и не изменился."""
+    entry = _read_binary_cache().get(name)
+    if not isinstance(entry, dict) or not entry.get('path'):
+        return None
+    try:
+        stat = os.stat(entry['path'])
+    except OSError:
+        logger.debug(f"Cached {name} disappeared: {entry['path']}")
+        return None
+    if stat.st_mtime_ns != entry.get('mtime_ns') or stat.st_size != entry.get('size'):
+        logger.debug(f"Cached {name} changed on disk: {entry['path']}")
+        return None
+    return entry
+
+
+def save_cached_binary(name: str, path: str, version: Optional[str]):
+    """Сохранение найденного бинарника вместе с версией, mtime и размером."""
+    try:
+        stat = os.stat(path)
+        data = _read_binary_cache()
+        data[name] = {
+            'path': path,
+            'version': version,
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+        }
+        cache_path = _binary_cache_path()
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug(f"Unable to write binary cache: {e}")
@@ -0,0 +1,220 @@
+"""План сборки: сопоставленные дорожки, команды mkvmerge, оценка объёма и свободного места."""
+import os
+import re
+import json
+import time
+import shutil
+import logging
+from typing import List, Tuple, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Запас свободного места сверх оценки: 1% плюс 64 МБ
+SPACE_MARGIN_RATIO = 0.01
+SPACE_MARGIN_BYTES = 64 * 1024 * 1024
+
+# Что делать, если место на выходном диске заканчивается
+SPACE_POLICY_FAIL = 'fail'      # не начинать обработку
+SPACE_POLICY_TRIM = 'trim'      # обработать столько эпизодов, сколько поместится
+SPACE_POLICY_IGNORE = 'ignore'  # только предупредить
+
+# Порядок запуска задач
+ORDER_LARGEST = 'largest'    # сначала большие (LPT): пакет не ждёт в конце одну долгую задачу
+ORDER_SMALLEST = 'smallest'  # сначала маленькие: первые результаты появляются быстрее
+ORDER_NATURAL = 'natural'    # по порядку эпизодов: "Ep 2" раньше "Ep 10"
+ORDER_POLICIES = (ORDER_LARGEST, ORDER_SMALLEST, ORDER_NATURAL)
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(value) < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} TB"
+
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def estimate_task(task):
+    """Заполнение task.read_bytes / write_bytes / existing_bytes по входным файлам задачи.
+
+    mkvmerge делает ремукс без перекодирования, поэтому размер результата
+    оценивается как сумма размеров входных файлов.
+    """
+    read_bytes = sum(file_size(path) for path in task.inputs)
+    task.read_bytes = read_bytes
+    task.write_bytes = read_bytes
+    task.existing_bytes = file_size(task.output_file)
+
+
+def natural_key(path: str) -> Tuple:
+    """Ключ естественной сортировки имени файла: числа сравниваются как числа."""
+    parts = _DIGITS_RE.split(os.path.basename(path).lower())
+    return tuple(int(part) if index % 2 else part for index, part in enumerate(parts))
+
+
+def order_tasks(tasks: List, policy: str) -> List:
+    """Задачи в порядке запуска; размер — оценка объёма чтения из estimate_task.
+
+    Задачи одного размера идут в естественном порядке имён.
+    """
+    if policy == ORDER_LARGEST:
+        return sorted(tasks, key=lambda task: (-task.read_bytes, natural_key(task.video_file)))
+    if policy == ORDER_SMALLEST:
+        return sorted(tasks, key=lambda task: (task.read_bytes, natural_key(task.video_file)))
+    return sorted(tasks, key=lambda task: natural_key(task.video_file))
+
+
+def order_files(paths: List[str], policy: str, sizes: Dict[str, int]) -> List[str]:
+    """Видео в порядке запуска до построения задач (потоковая обработка папки).
+
+    sizes — размеры самих видео (один stat на файл), дорожки ещё не найдены.
+    """
+    if policy == ORDER_NATURAL:
+        return sorted(paths, key=natural_key)
+    sign = -1 if policy == ORDER_LARGEST else 1
+    return sorted(paths, key=lambda path: (sign * sizes[path], natural_key(path)))
+
+
+def required_space(tasks: List, max_jobs: int) -> int:
+    """Место, нужное на выходном диске для задач, с учётом параллельных временных файлов.
+
+    Результат пишется во временный файл рядом со старым, поэтому до переименования
+    одновременно существуют старые версии до max_jobs перезаписываемых файлов.
+    """
+    return space_for([(task.write_bytes, task.existing_bytes) for task in tasks], max_jobs)
+
+
+def space_for(sizes: List[Tuple[int, int]], max_jobs: int) -> int:
+    """required_space по парам (размер результата, размер уже существующего результата)."""
+    growth = sum(write_bytes - existing_bytes for write_bytes, existing_bytes in sizes)
+    overlap = sum(sorted((existing_bytes for _, existing_bytes in sizes), reverse=True)[:max_jobs])
+    need = max(0, growth) + overlap
+    return need + int(need * SPACE_MARGIN_RATIO) + SPACE_MARGIN_BYTES
+
+
+def trim_to_fit(tasks: List, free: int, max_jobs: int) -> Tuple[List, List]:
+    """Наибольший префикс задач, который помещается в free; остальные задачи отбрасываются."""
+    low, high = 0, len(tasks)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if required_space(tasks[:middle], max_jobs) <= free:
+            low = middle
+        else:
+            high = middle - 1
+    return tasks[:low], tasks[low:]
+
+
+def free_space(path: str) -> int:
+    return shutil.disk_usage(path).free
+
+
+# Версия формата файла плана
+PLAN_FORMAT_VERSION = 1
+
+
+class MergePlan:
+    """План сборки сериала: для каждого эпизода найденные дорожки, ненайденные дорожки,
+    аргументы mkvmerge и оценка объёма.
+
+    Эпизоды хранятся словарями (MergeTask.to_dict), поэтому план сохраняется в JSON
+    и выполняется без повторного сопоставления дорожек.
+    """
+
+    def __init__(self, series_path: str, output_path: str, audio_data: List[Dict],
+                 subtitle_data: List[Dict], episodes: List[Dict], created: Optional[float] = None):
+        self.series_path = series_path
+        self.output_path = output_path
+        self.audio_data = audio_data
+        self.subtitle_data = subtitle_data
+        self.episodes = episodes
+        self.created = created if created is not None else time.time()
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    @property
+    def read_bytes(self) -> int:
+        return sum(episode.get('read_bytes', 0) for episode in self.episodes)
+
+    @property
+    def write_bytes(self) -> int:
+        return sum(episode.get('write_bytes', 0) for episode in self.episodes)
+
+    @property
+    def incomplete(self) -> List[Dict]:
+        """Эпизоды, для которых не найдена хотя бы одна дорожка."""
+        return [episode for episode in self.episodes if episode.get('missing')]
+
+    @property
+    def with_duplicates(self) -> List[Dict]:
+        """Эпизоды, в которые добавится дорожка, уже имеющаяся в видео или в другом источнике."""
+        return [episode for episode in self.episodes if episode.get('duplicates')]
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': PLAN_FORMAT_VERSION,
+            'created': self.created,
+            'series_path': self.series_path,
+            'output_path': self.output_path,
+            'audio_data': self.audio_data,
+            'subtitle_data': self.subtitle_data,
+            'episodes': self.episodes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'MergePlan':
+        if not isinstance(data, dict) or data.get('version') != PLAN_FORMAT_VERSION:
+            raise ValueError(f"Unsupported merge plan format: {data.get('version') if isinstance(data, dict) else data!r}")
+        for key in ('series_path', 'output_path', 'episodes'):
+            if key not in data:
+                raise ValueError(f"Merge plan is missing: {key}")
+        return cls(data['series_path'], data['output_path'], data.get('audio_data', []),
+                   data.get('subtitle_data', []), data['episodes'], data.get('created'))
+
+    def save(self, path: str):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'MergePlan':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def format_summary(self) -> str:
+        duplicates = len(self.with_duplicates)
+        return (f"{len(self.episodes)} files, {len(self.incomplete)} with missing tracks"
+                + (f", {duplicates} with duplicate tracks" if duplicates else "")
+                + f": {format_size(self.read_bytes)} to read, {format_size(self.write_bytes)} to write")
+
+    def format_preview(self) -> str:
+        """Текстовое описание плана для dry run и предпросмотра в GUI."""
+        lines = [f"{self.series_path} -> {self.output_path}", self.format_summary(), ""]
+        for episode in self.episodes:
+            lines.append(f"{os.path.basename(episode['video_file'])} -> {os.path.basename(episode['output_file'])}")
+            for track in episode.get('tracks', []):
+                lines.append(f"    + {track['type']} [{track.get('language', '')}] {os.path.basename(track['path'])}")
+            for missing in episode.get('missing', []):
+                if missing.get('reason') == 'ambiguous':
+                    lines.append(f"    ? {missing['type']} ambiguous in {missing['track_dir']}: "
+                                 + ", ".join(os.path.basename(path) for path in missing['candidates']))
+                elif missing.get('reason') == 'duplicate_key':
+                    lines.append(f"    - {missing['type']}: episode key shared with another video")
+                else:
+                    lines.append(f"    - {missing['type']} not found in {missing['track_dir']}")
+            for duplicate in episode.get('duplicates', []):
+                source = duplicate['duplicate_of']
+                lines.append(f"    = {duplicate['type']} [{duplicate['language']}, {duplicate['codec']}] "
+                             f"{os.path.basename(duplicate['path'])} duplicates "
+                             + ("a track of the video" if source == 'video' else source))
+        return "\n".join(lines)
@@ -2,9 +2,38 @@ import os
 import subprocess
 import platform
 import sys
-import glob
+import re
+import shutil
 import logging
-from typing import Optional, List, Dict
+import threading
+import time
+import sqlite3
+import json
+import tempfile
+from collections import deque
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, List, Dict, Tuple, Set, FrozenSet, Iterator, Iterable
+
+from mkvtoolnix import load_cached_binary, save_cached_binary, probe_version, parse_version
+from manifest import MergeManifest
+from job_journal import (JobJournal, partial_output_path,
+                         STATE_PENDING, STATE_RUNNING, STATE_DONE, STATE_FAILED)
+from storage import DeviceLimiter
+from planner import (MergePlan, estimate_task, required_space, space_for, trim_to_fit, free_space, format_size,
+                     file_size, order_tasks, order_files, SPACE_POLICY_FAIL, SPACE_POLICY_TRIM, SPACE_POLICY_IGNORE,
+                     ORDER_LARGEST)
+from metrics import MetricsRecorder, STATUS_OK, STATUS_FAILED, STATUS_SKIPPED, STATUS_ERROR, STATUS_CANCELLED
+from episode_match import (EpisodeKeyIndex, compile_patterns, duplicate_keys, format_key,
+                           MATCH_NAME, MATCH_EPISODE)
+from job_output import OutputTail, job_log_path, DEFAULT_TAIL_BYTES, MAX_LINE_CHARS
+from propedit import find_mkvpropedit, property_edits, propedit_command
+from mkv_header import check_matroska
+from track_info import TrackIdentifier, IdentifyCache, first_track, find_duplicate_tracks
+from events import (Event, EventBus, CoalescingSubscriber, qt_signal_sink,
+                    EVENT_STATUS, EVENT_ERROR, EVENT_PROGRESS, EVENT_FILE_PROGRESS, EVENT_JOB_STARTED,
+                    EVENT_TRACK_MISSING, EVENT_JOB_SKIPPED, EVENT_JOB_FINISHED, EVENT_JOB_FAILED,
+                    EVENT_JOB_CANCELLED, EVENT_RUN_FINISHED)
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -13,15 +42,378 @@ logger = logging.getLogger(__name__)
 # Константы
 AUDIO_EXTENSIONS = ['.mka', '.aac', '.mp3', '.ac3', '.dts', '.flac', '.ogg', '.wav']
 SUBTITLE_EXTENSIONS = ['.srt', '.ass', '.ssa', '.vtt']
+MAX_DEFAULT_JOBS = 8
+GUI_PROGRESS_RE = re.compile(r'^#GUI#progress\s+(\d+)%')
+# Опции mkvmerge, за которыми следует значение, а не входной файл
+OPTIONS_WITH_VALUE = {'-o', '--output', '--language', '--track-name'}
+# Передача аргументов mkvmerge через JSON-файл опций (@options.json):
+# auto — только для длинных команд, always — всегда, never — только командная строка
+OPTIONS_FILE_AUTO = 'auto'
+OPTIONS_FILE_ALWAYS = 'always'
+OPTIONS_FILE_NEVER = 'never'
+OPTIONS_FILE_MODES = (OPTIONS_FILE_AUTO, OPTIONS_FILE_ALWAYS, OPTIONS_FILE_NEVER)
+# Длина командной строки, с которой в режиме auto используется файл опций
+# (предел Windows — 32767 символов, с запасом на путь к mkvmerge и кавычки)
+OPTIONS_FILE_MIN_LENGTH = 8000
+# Сколько ждать завершения mkvmerge после terminate при остановке, прежде чем kill
+STOP_GRACE_SECONDS = 5.0
+# Файл опций неудавшейся задачи сохраняется рядом с результатом: <output>.options.json
+FAILED_OPTIONS_SUFFIX = '.options.json'
+# При потоковой обработке в очереди держится не больше max_jobs * STREAM_WINDOW_PER_JOB
+# подготовленных эпизодов; папка сериала дочитывается по мере их выполнения
+STREAM_WINDOW_PER_JOB = 4
+
+
+def default_max_jobs() -> int:
+    """Количество одновременных задач mkvmerge по умолчанию (по числу ядер)."""
+    return max(1, min(os.cpu_count() or 1, MAX_DEFAULT_JOBS))
+
+
+def command_inputs(command: List[str]) -> List[str]:
+    """Входные файлы команды mkvmerge (всё, что не является опцией или её значением)."""
+    inputs = []
+    args = iter(command[1:])
+    for arg in args:
+        if arg in OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith('-'):
+            inputs.append(arg)
+    return inputs
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[List]:
+    """Последовательные части итератора длиной не больше size."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def output_file_for(video_file: str, output_path: str) -> str:
+    """Путь к результату сборки эпизода."""
+    base_name = os.path.splitext(os.path.basename(video_file))[0]
+    return os.path.join(output_path, f"{base_name}_merged.mkv")
+
+
+class TrackIndex:
+    """Индекс файлов дорожек одной папки, построенный за одно сканирование os.scandir.
+
+    Повторяет поведение прежнего поиска по шаблону ``<base_name>*<ext>``: расширения
+    проверяются в порядке приоритета, возвращается первое совпадение.
+    """
+
+    def __init__(self, track_dir: str, extensions: List[str], scan: bool = True):
+        self.track_dir = track_dir
+        self.extensions = list(extensions)
+        self._normalized_exts = [(ext, os.path.normcase(ext)) for ext in self.extensions]
+        # Для каждого расширения: точное имя без расширения -> путь (быстрый путь)
+        # и отсортированный список (имя, путь) для поиска по префиксу
+        self._exact: Dict[str, Dict[str, str]] = {ext: {} for ext in self.extensions}
+        self._sorted: Dict[str, List[Tuple[str, str]]] = {ext: [] for ext in self.extensions}
+        # Индекс может дополняться из другого потока (режим наблюдения за папками)
+        self._lock = threading.Lock()
+        # mtime папки на момент сканирования: пока он не изменился, набор имён тот же
+        self.dir_mtime_ns: Optional[int] = None
+        if scan:
+            self._scan()
+
+    def _match(self, file_name: str) -> Optional[Tuple[str, str]]:
+        """(расширение, имя без расширения) для подходящего файла или None."""
+        # normcase повторяет регистронезависимое сравнение glob на Windows
+        name = os.path.normcase(file_name)
+        for ext, norm_ext in self._normalized_exts:
+            if name.endswith(norm_ext):
+                return ext, name[:-len(norm_ext)]
+        return None
+
+    def _scan(self):
+        self.dir_mtime_ns = os.stat(self.track_dir).st_mtime_ns
+        paths = []
+        with os.scandir(self.track_dir) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                paths.append(entry.path)
+        self.load(paths)
+
+    def load(self, paths: List[str], dir_mtime_ns: Optional[int] = None):
+        """Заполнение индекса списком файлов папки, полученным при обходе дерева."""
+        with self._lock:
+            if dir_mtime_ns is not None:
+                self.dir_mtime_ns = dir_mtime_ns
+            for path in paths:
+                matched = self._match(os.path.basename(path))
+                if matched:
+                    ext, stem = matched
+                    self._exact[ext].setdefault(stem, path)
+                    self._sorted[ext].append((stem, path))
+            for candidates in self._sorted.values():
+                candidates.sort()
+
+    def is_current(self) -> bool:
+        """Папка не менялась с момента сканирования (файлы не добавлялись и не удалялись)."""
+        if self.dir_mtime_ns is None:
+            return False
+        try:
+            return os.stat(self.track_dir).st_mtime_ns == self.dir_mtime_ns
+        except OSError:
+            return False
+
+    def add(self, path: str) -> bool:
+        """Добавление нового файла без повторного сканирования папки."""
+        matched = self._match(os.path.basename(path))
+        if not matched:
+            return False
+        ext, stem = matched
+        with self._lock:
+            candidates = self._sorted[ext]
+            index = bisect_left(candidates, (stem, path))
+            if index < len(candidates) and candidates[index] == (stem, path):
+                return False
+            candidates.insert(index, (stem, path))
+            self._exact[ext].setdefault(stem, path)
+        return True
+
+    def discard(self, path: str):
+        """Удаление файла из индекса (файл удалён или переименован)."""
+        matched = self._match(os.path.basename(path))
+        if not matched:
+            return
+        ext, stem = matched
+        with self._lock:
+            candidates = self._sorted[ext]
+            index = bisect_left(candidates, (stem, path))
+            if index < len(candidates) and candidates[index] == (stem, path):
+                del candidates[index]
+            if self._exact[ext].get(stem) == path:
+                del self._exact[ext][stem]
+
+    def find(self, base_name: str) -> Optional[str]:
+        """Первый файл вида ``<base_name>*<ext>`` с учётом приоритета расширений."""
+        key = os.path.normcase(base_name)
+        with self._lock:
+            for ext in self.extensions:
+                exact = self._exact[ext].get(key)
+                if exact:
+                    return exact
+                candidates = self._sorted[ext]
+                index = bisect_left(candidates, (key,))
+                if index < len(candidates) and candidates[index][0].startswith(key):
+                    return candidates[index][1]
+        return None
+
+
+class MergeTask:
+    """Задача сборки одного эпизода вместе с устройствами, которые она читает и пишет."""
+
+    def __init__(self, video_file: str, output_path: str, audio_data: List[Dict],
+                 subtitle_data: List[Dict], reads: FrozenSet[str] = frozenset(),
+                 writes: FrozenSet[str] = frozenset(), job=None):
+        self.video_file = video_file
+        self.output_path = output_path
+        self.audio_data = audio_data
+        self.subtitle_data = subtitle_data
+        self.reads = reads
+        self.writes = writes
+        self.job = job
+        self.output_file = output_file_for(video_file, output_path)
+        # Результат сопоставления: найденные и ненайденные дорожки, команда mkvmerge
+        # (первый аргумент заменяется путём к mkvmerge при запуске)
+        self.tracks: List[Dict] = []
+        self.missing: List[Dict] = []
+        # Внешние дорожки, повторяющие дорожку видео или другую внешнюю дорожку (по mkvmerge -J)
+        self.duplicates: List[Dict] = []
+        self.command: Optional[List[str]] = None
+        self.match_seconds = 0.0
+        # Оценка объёма ввода-вывода (заполняется planner.estimate_task)
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.existing_bytes = 0
+
+    @property
+    def inputs(self) -> List[str]:
+        return command_inputs(self.command) if self.command else [self.video_file]
+
+    def to_dict(self) -> Dict:
+        """Эпизод плана сборки; устройства не сохраняются, они определяются на месте."""
+        return {
+            'video_file': self.video_file,
+            'output_path': self.output_path,
+            'output_file': self.output_file,
+            'audio_data': self.audio_data,
+            'subtitle_data': self.subtitle_data,
+            'tracks': self.tracks,
+            'missing': self.missing,
+            'duplicates': self.duplicates,
+            'command': self.command,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+            'existing_bytes': self.existing_bytes,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict, reads: FrozenSet[str] = frozenset(),
+                  writes: FrozenSet[str] = frozenset(), job=None) -> 'MergeTask':
+        task = cls(data['video_file'], data['output_path'], data.get('audio_data', []),
+                   data.get('subtitle_data', []), reads, writes, job)
+        task.tracks = data.get('tracks', [])
+        task.missing = data.get('missing', [])
+        task.duplicates = data.get('duplicates', [])
+        task.command = data.get('command')
+        task.read_bytes = data.get('read_bytes', 0)
+        task.write_bytes = data.get('write_bytes', 0)
+        task.existing_bytes = data.get('existing_bytes', 0)
+        return task
+
+
+class TaskQueue:
+    """Очередь задач, разложенных по полосам — наборам устройств, с которыми работает задача.
+
+    Внутри полосы порядок сохраняется. Если устройства полосы заняты, берётся задача
+    из следующей, поэтому задачи на медленном HDD не задерживают задачи на других дисках.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[Tuple[FrozenSet[str], FrozenSet[str]], deque] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def push(self, task: MergeTask):
+        self._lanes.setdefault((task.reads, task.writes), deque()).append(task)
+        self._size += 1
+
+    def pop_ready(self, limiter: DeviceLimiter) -> Optional[MergeTask]:
+        """Первая задача, для которой удалось занять слоты всех её устройств."""
+        for key, lane in self._lanes.items():
+            if limiter.try_acquire(*key):
+                task = lane.popleft()
+                if not lane:
+                    del self._lanes[key]
+                self._size -= 1
+                return task
+        return None
+
+    def clear(self) -> List[MergeTask]:
+        """Удаление всех ожидающих задач; возвращает удалённые."""
+        removed = [task for lane in self._lanes.values() for task in lane]
+        self._lanes.clear()
+        self._size = 0
+        return removed
 
 
 class MkvProcessor:
-    def __init__(self, worker=None):
+    def __init__(self, worker=None, max_jobs: Optional[int] = None,
+                 incremental: bool = False, verify_hash: bool = False,
+                 device_limiter: Optional[DeviceLimiter] = None,
+                 space_policy: str = SPACE_POLICY_FAIL,
+                 metrics: Optional[MetricsRecorder] = None,
+                 match_mode: str = MATCH_NAME, episode_patterns: Optional[List[str]] = None,
+                 identify: bool = False, identify_cache: Optional[IdentifyCache] = None,
+                 options_file: str = OPTIONS_FILE_AUTO, output_log_dir: Optional[str] = None,
+                 output_tail_bytes: int = DEFAULT_TAIL_BYTES, propedit: bool = False,
+                 check_inputs: bool = True, order: str = ORDER_LARGEST):
         self.worker = worker
+        # Все сообщения о ходе обработки публикуются как события; GUI и консоль подписываются на них
+        self.events = EventBus()
+        if worker is not None:
+            # Старые сигналы worker получают события пачками, без переполнения очереди Qt
+            self.events.subscribe(CoalescingSubscriber(qt_signal_sink(worker)))
+        self.max_jobs = max_jobs if max_jobs and max_jobs > 0 else default_max_jobs()
+        # Ограничение одновременных чтений/записей на каждое физическое устройство
+        self.device_limiter = device_limiter or DeviceLimiter()
+        # Инкрементальный режим: пропуск результатов, чьи входные файлы и команда не изменились
+        self.incremental = incremental
+        self.verify_hash = verify_hash
+        # Поведение при нехватке места на выходном диске: fail, trim или ignore
+        self.space_policy = space_policy
+        # Порядок запуска задач: largest (LPT), smallest или natural
+        self.order = order
+        # Метрики по эпизодам (время, объём, скорость) и их экспорт
+        self.metrics = metrics or MetricsRecorder()
+        self.metrics_summary: Optional[Dict] = None
+        # Манифест и журнал ведутся отдельно для каждой выходной папки
+        self._manifests: Dict[str, MergeManifest] = {}
+        self._journals: Dict[str, JobJournal] = {}
+        self.skipped: List[str] = []
+        self.errors: List[str] = []
         self._stop_requested = False
+        self._stop_requested_at: Optional[float] = None
+        # Работающие процессы mkvmerge по выходному файлу и задачи, прерванные остановкой
+        self._processes: Dict[str, subprocess.Popen] = {}
+        self._cancelled_outputs = set()
+        self._processes_lock = threading.Lock()
+        # Эпизоды запуска: поставленные в очередь и оставшиеся несделанными после остановки
+        self._queued: List[str] = []
+        self.undone: List[str] = []
+        # Эпизоды, не попавшие в очередь из-за нехватки места: отброшенные политикой trim
+        # и те, до которых потоковый обход не дошёл
+        self._unscanned: List[str] = []
+        self.cancel_seconds: Optional[float] = None
+        self._progress_lock = threading.Lock()
+        self._completed = 0
+        self._total = 0
+        # False, пока список видео потоковой обработки не прочитан: общего числа эпизодов ещё нет
+        self._total_known = True
+        # Задачи, поставленные в очередь и ещё не завершённые, по выходному файлу
+        self._outstanding: Dict[str, MergeTask] = {}
+        self._file_progress: Dict[str, int] = {}
+        self._progress_sum = 0
+        self._last_progress = -1
+        # Прогресс взвешивается по объёму входных данных эпизода
+        self._weights: Dict[str, int] = {}
+        self._total_weight = 0
+        # Оценки весов эпизодов потоковой обработки по размеру видео, до подготовки их задач
+        self._expected: Dict[str, int] = {}
+        self._run_started = time.monotonic()
+        self.planned_read_bytes = 0
+        self.planned_write_bytes = 0
+        self.results: Dict[str, Optional[bool]] = {}
+        self._track_indexes: Dict[Tuple[str, Tuple[str, ...]], TrackIndex] = {}
+        # Сопоставление дорожек: по имени файла, по ключу эпизода (S01E05, "- 05") или оба
+        self.match_mode = match_mode
+        self.episode_pattern_sources = list(episode_patterns or [])
+        self.episode_patterns = compile_patterns(episode_patterns)
+        self._episode_indexes: Dict[Tuple[str, Tuple[str, ...]], EpisodeKeyIndex] = {}
+        self._index_lock = threading.Lock()
+        # Языки и кодеки дорожек из самих файлов (mkvmerge -J) с кэшем на диске
+        self.identify = identify
+        self.identify_cache = identify_cache
+        self.identifier: Optional[TrackIdentifier] = None
+        # Когда передавать аргументы mkvmerge через @options.json
+        self.options_file = options_file
+        # Из вывода mkvmerge в памяти хранится только конец; полный вывод — в файлах output_log_dir
+        self.output_log_dir = output_log_dir
+        self.output_tail_bytes = output_tail_bytes
+        # Если изменились только язык или название дорожек, готовый файл правится mkvpropedit
+        self.propedit = propedit
+        self.mkvpropedit_path: Optional[str] = None
+        # Обрезанные и не-Matroska видео отбрасываются по заголовку до запуска mkvmerge
+        self.check_inputs = check_inputs
+        self.rejected: List[str] = []
+        self.mkvmerge_version: Optional[str] = None
+        self.mkvmerge_version_info: Optional[Tuple[int, ...]] = None
 
     def find_mkvmerge(self) -> Optional[str]:
-        """Поиск исполняемого файла mkvmerge с приоритетом для bundled версии."""
+        """Поиск исполняемого файла mkvmerge с приоритетом для bundled версии.
+
+        Найденный путь и версия кэшируются на диске; повторный поиск выполняется,
+        только если закэшированный файл изменился или пропал.
+        """
+        cached = load_cached_binary('mkvmerge')
+        if cached:
+            self._set_mkvmerge_version(cached.get('version'))
+            logger.info(f"Using cached mkvmerge at: {cached['path']}")
+            return cached['path']
+
         search_paths = []
 
         # Проверка bundled версии (для PyInstaller)
@@ -52,181 +444,1242 @@ class MkvProcessor:
                     ])
 
         for path in search_paths:
-            try:
-                if os.path.isfile(path):
-                    logger.info(f"Found mkvmerge at: {path}")
-                    return path
-                result = subprocess.run(
-                    [path, '--version'],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
-                )
-                if result.returncode == 0:
-                    return path
-            except (OSError, subprocess.SubprocessError):
-                continue
+            if os.path.isfile(path):
+                resolved = os.path.abspath(path)
+                version = probe_version(resolved)
+            else:
+                version = probe_version(path)
+                if version is None:
+                    continue
+                resolved = shutil.which(path) or path
+            logger.info(f"Found mkvmerge at: {resolved}")
+            self._set_mkvmerge_version(version)
+            save_cached_binary('mkvmerge', resolved, version)
+            return resolved
 
         self._emit_error("mkvmerge not found. Please install MKVToolNix.")
         return None
 
-    def _emit_status(self, message: str):
-        if self.worker:
-            self.worker.status_updated.emit(message)
+    def _set_mkvmerge_version(self, version: Optional[str]):
+        self.mkvmerge_version = version
+        self.mkvmerge_version_info = parse_version(version) if version else None
+        if version:
+            logger.info(f"mkvmerge version: {version}")
+
+    def mkvmerge_supports(self, *minimum: int) -> bool:
+        """Проверка, что найденная версия mkvmerge не ниже указанной, например (57, 0)."""
+        if not self.mkvmerge_version_info:
+            return False
+        return self.mkvmerge_version_info >= tuple(minimum)
+
+    def _emit_status(self, message: str, kind: str = EVENT_STATUS,
+                     episode: Optional[str] = None, **data):
+        self.events.publish(Event(kind, message, episode, data=data))
         logger.info(message)
 
-    def _emit_progress(self, value: int):
-        if self.worker:
-            self.worker.progress_updated.emit(value)
+    def _emit_progress(self, value: Optional[int], **data):
+        self.events.publish(Event(EVENT_PROGRESS, value=value, data=data))
+
+    def _emit_file_progress(self, base_name: str, value: int):
+        self.events.publish(Event(EVENT_FILE_PROGRESS, episode=base_name, value=value))
 
-    def _emit_error(self, message: str):
-        if self.worker:
-            self.worker.status_updated.emit(f"Error: {message}")
+    def _emit_error(self, message: str, kind: str = EVENT_ERROR,
+                    episode: Optional[str] = None, **data):
+        self.errors.append(message)
+        self.events.publish(Event(kind, message, episode, data=data))
         logger.error(message)
 
-    def stop(self):
+    def stop(self, kill_running: bool = True):
+        """Остановка обработки: новые задачи не запускаются, работающие mkvmerge
+        завершаются (terminate, затем kill через STOP_GRACE_SECONDS).
+
+        kill_running=False позволяет запущенным задачам дойти до конца.
+        """
+        if not self._stop_requested:
+            self._stop_requested_at = time.monotonic()
         self._stop_requested = True
+        if kill_running:
+            with self._processes_lock:
+                running = dict(self._processes)
+            if running:
+                # Ожидание завершения не блокирует вызывающий поток (GUI, обработчик сигнала)
+                threading.Thread(target=self._terminate_processes, args=(running,), daemon=True).start()
+
+    def _terminate_processes(self, processes: Dict[str, subprocess.Popen]):
+        with self._processes_lock:
+            self._cancelled_outputs.update(processes)
+        for process in processes.values():
+            try:
+                process.terminate()
+            except OSError:
+                pass
+        deadline = time.monotonic() + STOP_GRACE_SECONDS
+        for output_file, process in processes.items():
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logger.warning(f"mkvmerge did not stop in {STOP_GRACE_SECONDS:.0f}s, killing: {output_file}")
+                try:
+                    process.kill()
+                except OSError:
+                    pass
+
+    @property
+    def stop_requested(self) -> bool:
+        return self._stop_requested
+
+    def _get_track_index(self, track_dir: str, extensions: List[str]) -> TrackIndex:
+        """Индекс папки дорожек; каждая папка сканируется один раз за запуск."""
+        key = (track_dir, tuple(extensions))
+        with self._index_lock:
+            index = self._track_indexes.get(key)
+            if index is None:
+                logger.debug(f"Indexing track directory: {track_dir}")
+                index = TrackIndex(track_dir, extensions)
+                self._track_indexes[key] = index
+            return index
+
+    def _get_episode_index(self, track_dir: str, extensions: List[str]) -> EpisodeKeyIndex:
+        """Индекс папки дорожек по ключу эпизода; строится один раз за запуск."""
+        key = (track_dir, tuple(extensions))
+        with self._index_lock:
+            index = self._episode_indexes.get(key)
+            if index is None:
+                logger.debug(f"Indexing episode keys in: {track_dir}")
+                index = EpisodeKeyIndex(track_dir, extensions, self.episode_patterns)
+                self._episode_indexes[key] = index
+            return index
+
+    def _clear_indexes(self):
+        """Сброс индексов папок, содержимое которых изменилось с момента сканирования."""
+        with self._index_lock:
+            for indexes in (self._track_indexes, self._episode_indexes):
+                for key in [key for key, index in indexes.items() if not index.is_current()]:
+                    del indexes[key]
+
+    def use_track_index(self, index):
+        """Использование готового индекса папки (построенного при обходе дерева или
+        обновляемого наблюдателем); принимает TrackIndex и EpisodeKeyIndex."""
+        key = (os.path.normpath(index.track_dir), tuple(index.extensions))
+        with self._index_lock:
+            if isinstance(index, EpisodeKeyIndex):
+                self._episode_indexes[key] = index
+            else:
+                self._track_indexes[key] = index
 
     def _find_track(self, base_name: str, track_dir: str, extensions: List[str]) -> Optional[str]:
-        """Поиск файла трека с улучшенным экранированием и отладкой."""
+        """Поиск файла трека по индексу папки."""
         try:
             # Нормализация и проверка пути
             track_dir = os.path.normpath(track_dir)
-            if not os.path.exists(track_dir):
+            if not os.path.isdir(track_dir):
                 logger.warning(f"Track directory does not exist: {track_dir}")
                 return None
 
             logger.debug(f"Searching track in: {track_dir}")
             logger.debug(f"Base name: {base_name}")
-            logger.debug(f"Extensions: {extensions}")
 
-            # Экранирование каждой части пути
-            dir_parts = track_dir.split(os.sep)
-            escaped_dir = os.sep.join(glob.escape(part) for part in dir_parts)
+            track_file = self._get_track_index(track_dir, extensions).find(base_name)
+            if track_file:
+                logger.info(f"Matched track: {track_file}")
+            else:
+                logger.debug("No matches found")
+            return track_file
 
-            # Создание базового паттерна
-            base_pattern = f"{glob.escape(base_name)}*"
+        except Exception as e:
+            logger.error(f"Error in _find_track: {str(e)}", exc_info=True)
+            return None
 
-            # Поиск по всем расширениям
-            for ext in extensions:
-                full_pattern = os.path.join(escaped_dir, f"{base_pattern}{glob.escape(ext)}")
-                logger.debug(f"Trying pattern: {full_pattern}")
+    def _match_track(self, base_name: str, track_dir: str, extensions: List[str],
+                     key_conflict: bool = False) -> Tuple[Optional[str], List[str]]:
+        """Дорожка эпизода согласно match_mode: (файл или None, кандидаты при неоднозначности).
 
-                # Поиск с учетом регистра для Windows
-                for file in glob.glob(full_pattern, recursive=False):
-                    logger.debug(f"Found candidate: {file}")
-                    if os.path.isfile(file):
-                        logger.info(f"Matched track: {file}")
-                        return file
+        key_conflict — ключ эпизода совпал у нескольких видео, по ключу сопоставлять нельзя.
+        """
+        if self.match_mode != MATCH_EPISODE:
+            track_file = self._find_track(base_name, track_dir, extensions)
+            if track_file or self.match_mode == MATCH_NAME:
+                return track_file, []
+        track_dir = os.path.normpath(track_dir)
+        if key_conflict or not os.path.isdir(track_dir):
+            return None, []
+        candidates = self._get_episode_index(track_dir, extensions).lookup(base_name)
+        if len(candidates) == 1:
+            logger.info(f"Matched track by episode key: {candidates[0]}")
+            return candidates[0], []
+        return None, candidates
 
-            logger.debug("No matches found")
-            return None
+    def _resolve_tracks(self, video_file: str, audio_data: List[Dict], subtitle_data: List[Dict],
+                        key_conflict: bool = False) -> Tuple[List[Dict], List[Dict]]:
+        """Сопоставление дорожек эпизода: (найденные дорожки, ненайденные источники)."""
+        base_name = os.path.splitext(os.path.basename(video_file))[0]
+        tracks, missing = [], []
+        for track_type, sources, extensions, title in (
+                ('audio', audio_data, AUDIO_EXTENSIONS, "Audio"),
+                ('subtitle', subtitle_data, SUBTITLE_EXTENSIONS, "Subtitle")):
+            for source in sources:
+                track_file, candidates = self._match_track(base_name, source.get('path'), extensions,
+                                                           key_conflict)
+                if track_file:
+                    tracks.append({
+                        'type': track_type,
+                        'path': track_file,
+                        'language': source.get('language', ''),
+                        'track_name': source.get('track_name', ''),
+                    })
+                elif candidates:
+                    # Несколько файлов с тем же ключом эпизода: выбор не делается, кандидаты в отчёт
+                    missing.append({'type': track_type, 'track_dir': source.get('path'),
+                                    'reason': 'ambiguous', 'candidates': candidates})
+                    self._emit_status(f"{title} track is ambiguous for {base_name}: "
+                                      f"{len(candidates)} candidates in {source.get('path')}",
+                                      EVENT_TRACK_MISSING, base_name, track_type=track_type,
+                                      track_dir=source.get('path'), candidates=candidates)
+                else:
+                    reason = 'duplicate_key' if key_conflict else 'not_found'
+                    missing.append({'type': track_type, 'track_dir': source.get('path'), 'reason': reason})
+                    self._emit_status(f"{title} track not found: {source.get('path')}", EVENT_TRACK_MISSING,
+                                      base_name, track_type=track_type, track_dir=source.get('path'),
+                                      reason=reason)
+        return tracks, missing
+
+    @staticmethod
+    def _command_for(video_file: str, output_file: str, tracks: List[Dict]) -> List[str]:
+        """Команда mkvmerge для эпизода по уже найденным дорожкам."""
+        command = ['mkvmerge', '-o', output_file, video_file]
+        for track in tracks:
+            # Номер дорожки в файле известен после mkvmerge -J, иначе берётся первая
+            track_id = track.get('track_id', 0)
+            # Без языка (mkvmerge -J его не нашёл) остаётся язык из самого файла
+            if track.get('language'):
+                command.extend(['--language', f'{track_id}:{track["language"]}'])
+            command.extend([
+                '--track-name', f'{track_id}:{track.get("track_name", "")}',
+                track['path']
+            ])
+        return command
 
-        except Exception as e:
-            logger.error(f"Error in _find_track: {str(e)}", exc_info=True)
-            return None
-    
     def _build_mkvmerge_command(self, video_file: str, output_file: str,
                               audio_data: List[Dict], subtitle_data: List[Dict]) -> List[str]:
         """Сборка команды для mkvmerge."""
-        command = ['mkvmerge', '-o', output_file, video_file]
+        tracks, _ = self._resolve_tracks(video_file, audio_data, subtitle_data)
+        return self._command_for(video_file, output_file, tracks)
 
-        # Добавление аудио дорожек
-        for audio in audio_data:
-            audio_file = self._find_track(
-                os.path.splitext(os.path.basename(video_file))[0],
-                audio.get('path'),
-                AUDIO_EXTENSIONS
-            )
-            if audio_file:
-                command.extend([
-                    '--language', f'0:{audio.get("language", "")}',
-                    '--track-name', f'0:{audio.get("track_name", "")}',
-                    audio_file
-                ])
+    def _resolve_task(self, task: MergeTask, key_conflict: bool = False):
+        """Однократное сопоставление дорожек задачи и оценка её объёма."""
+        started = time.perf_counter()
+        task.tracks, task.missing = self._resolve_tracks(task.video_file, task.audio_data,
+                                                         task.subtitle_data, key_conflict)
+        task.command = self._command_for(task.video_file, task.output_file, task.tracks)
+        task.match_seconds = time.perf_counter() - started
+        estimate_task(task)
+
+    def _get_identifier(self) -> Optional[TrackIdentifier]:
+        if self.identifier is None:
+            mkvmerge_path = self.find_mkvmerge()
+            if not mkvmerge_path:
+                return None
+            if self.identify_cache is None:
+                try:
+                    self.identify_cache = IdentifyCache()
+                except (OSError, sqlite3.Error) as e:
+                    logger.warning(f"Track info cache is unavailable: {e}")
+            self.identifier = TrackIdentifier(mkvmerge_path, self.identify_cache, self.max_jobs)
+        return self.identifier
+
+    def _identify_tasks(self, tasks: List[MergeTask]):
+        """Языки, кодеки и номера дорожек из файлов эпизодов; поиск повторяющихся дорожек.
+
+        Язык источника, заданный вручную, не заменяется; пустой берётся из файла.
+        """
+        identifier = self._get_identifier()
+        if identifier is None:
+            return
+        paths = []
+        for task in tasks:
+            paths.append(task.video_file)
+            paths.extend(track['path'] for track in task.tracks)
+        infos = identifier.identify(paths)
+        logger.info(f"Track info: {identifier.cache_hits} cached, {identifier.identified} identified")
+        for task in tasks:
+            compared = []
+            for track in task.tracks:
+                file_track = first_track(infos.get(track['path']), track['type'])
+                if file_track is None:
+                    continue
+                track['track_id'] = file_track['id']
+                track['codec'] = file_track['codec']
+                if not track.get('language') and file_track['language']:
+                    track['language'] = file_track['language']
+                compared.append(dict(track, language=file_track['language'] or track.get('language', '')))
+            task.duplicates = find_duplicate_tracks(infos.get(task.video_file), compared)
+            task.command = self._command_for(task.video_file, task.output_file, task.tracks)
+
+    def _process_video(self, task: MergeTask, mkvmerge_path: str) -> Optional[bool]:
+        """Обработка одного видеофайла. Возвращает None, если задача пропущена из-за остановки."""
+        if self._stop_requested:
+            return None
+
+        video_file, output_path, output_file = task.video_file, task.output_path, task.output_file
+        base_name = os.path.splitext(os.path.basename(video_file))[0]
+
+        self._emit_status(f"Processing: {base_name}...", EVENT_JOB_STARTED, base_name,
+                          video_file=video_file, output_file=output_file)
+
+        # Дорожки сопоставляются при планировании; здесь только для задач, созданных вручную
+        if task.command is None:
+            self._resolve_task(task)
+        match_seconds = task.match_seconds
+        command = list(task.command)
+        command[0] = mkvmerge_path  # Заменяем первый аргумент на полный путь
+        inputs = command_inputs(command)
+        manifest = self._manifests.get(output_path)
+        journal = self._journals.get(output_path)
+
+        # Путь к mkvmerge не входит в сравнение, чтобы обновление MKVToolNix не вызывало пересборку
+        if self.incremental and manifest and manifest.is_up_to_date(output_file, inputs, command[1:]):
+            self._emit_status(f"Up to date, skipped: {base_name}", EVENT_JOB_SKIPPED, base_name,
+                              output_file=output_file)
+            self.skipped.append(video_file)
+            self.metrics.record(video_file, STATUS_SKIPPED, match_seconds=match_seconds)
+            if journal:
+                journal.set_state(video_file, STATE_DONE)
+            self._advance_progress(output_file)
+            return True
+
+        if self.propedit and manifest and self._update_properties(task, command, inputs, manifest):
+            return True
+
+        # mkvmerge пишет во временный файл, который переименовывается только после успеха
+        part_file = partial_output_path(output_file)
+        run_command = list(command)
+        run_command[run_command.index('-o') + 1] = part_file
+
+        if journal:
+            journal.set_state(video_file, STATE_RUNNING)
+        success = False
+        error = None
+        returncode = None
+        timings: Dict[str, float] = {}
+        try:
+            returncode, output_tail = self._run_mkvmerge(run_command, output_file, base_name, timings)
+
+            if returncode != 0 and self._was_cancelled(output_file):
+                return self._cancel_task(task, part_file, match_seconds, timings)
+            # Код 1 — предупреждения: mkvmerge дописал результат до конца
+            if returncode not in (0, 1):
+                error = f"Failed to process {base_name}:\n" + "\n".join(output_tail)
             else:
-                self._emit_status(f"Audio track not found: {audio.get('path')}")
-
-        # Добавление субтитров
-        for subtitle in subtitle_data:
-            subtitle_file = self._find_track(
-                os.path.splitext(os.path.basename(video_file))[0],
-                subtitle.get('path'),
-                SUBTITLE_EXTENSIONS
+                if returncode == 1:
+                    logger.warning(f"mkvmerge finished with warnings for {base_name}:\n" + "\n".join(output_tail))
+                os.replace(part_file, output_file)
+                self._emit_status(f"Successfully processed: {base_name}{self._eta_suffix()}",
+                                  EVENT_JOB_FINISHED, base_name, output_file=output_file,
+                                  eta_seconds=self.eta_seconds())
+                if manifest:
+                    manifest.record(output_file, inputs, command[1:])
+                # Файл опций от прошлой неудачной попытки больше не нужен
+                self._remove_file(output_file + FAILED_OPTIONS_SUFFIX)
+                success = True
+
+        except (OSError, subprocess.SubprocessError) as e:
+            error = f"Error processing {base_name}: {str(e)}"
+
+        if not success:
+            self._emit_error(error, EVENT_JOB_FAILED, base_name, exit_code=returncode)
+            self._remove_file(part_file)
+            self._save_failed_options(command, output_file)
+            if manifest:
+                manifest.forget(output_file)
+
+        self.metrics.record(
+            video_file,
+            STATUS_OK if success else (STATUS_FAILED if returncode is not None else STATUS_ERROR),
+            exit_code=returncode,
+            match_seconds=match_seconds,
+            spawn_seconds=timings.get('spawn_seconds'),
+            wall_seconds=timings.get('wall_seconds'),
+            bytes_read=sum(file_size(path) for path in inputs),
+            bytes_written=file_size(output_file) if success else 0,
+        )
+
+        if journal:
+            journal.set_state(video_file, STATE_DONE if success else STATE_FAILED, error)
+        self._advance_progress(output_file)
+        return success
+
+    def _update_properties(self, task: MergeTask, command: List[str], inputs: List[str],
+                           manifest: MergeManifest) -> bool:
+        """Правка языка и названий дорожек готового результата без пересборки.
+
+        Возвращает False, если нужна полная сборка: результата нет, входные файлы
+        изменились, набор дорожек другой или mkvpropedit недоступен либо завершился ошибкой.
+        """
+        output_file = task.output_file
+        if not os.path.isfile(output_file) or not manifest.inputs_unchanged(output_file, inputs):
+            return False
+        identifier = self._get_identifier()
+        if identifier is None:
+            return False
+        if self.mkvpropedit_path is None:
+            self.mkvpropedit_path = find_mkvpropedit(identifier.mkvmerge_path) or ''
+            if not self.mkvpropedit_path:
+                logger.warning("mkvpropedit not found, track properties are fixed by a full remux")
+        if not self.mkvpropedit_path:
+            return False
+
+        base_name = os.path.splitext(os.path.basename(task.video_file))[0]
+        started = time.perf_counter()
+        infos = identifier.identify([task.video_file, output_file] + [track['path'] for track in task.tracks])
+        if output_file not in infos or task.video_file not in infos:
+            return False
+        edits = property_edits(infos[output_file], infos[task.video_file],
+                               [infos.get(track['path']) for track in task.tracks], task.tracks)
+        if edits is None:
+            logger.info(f"Track set changed, remuxing: {base_name}")
+            return False
+        if edits:
+            try:
+                result = subprocess.run(
+                    propedit_command(self.mkvpropedit_path, output_file, edits),
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    encoding='utf-8',
+                    errors='replace',
+                    creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+                )
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"mkvpropedit failed for {base_name}, remuxing: {e}")
+                return False
+            # Код 1 — предупреждения, изменения при этом записаны
+            if result.returncode > 1:
+                logger.warning(f"mkvpropedit failed for {base_name}, remuxing: {result.stdout.strip()[-500:]}")
+                return False
+        wall_seconds = time.perf_counter() - started
+
+        manifest.record(output_file, inputs, command[1:])
+        self._emit_status(f"Updated track properties: {base_name}{self._eta_suffix()}", EVENT_JOB_FINISHED,
+                          base_name, output_file=output_file, propedit=True, edits=len(edits),
+                          eta_seconds=self.eta_seconds())
+        self.metrics.record(task.video_file, STATUS_OK, exit_code=0, match_seconds=task.match_seconds,
+                            wall_seconds=wall_seconds)
+        journal = self._journals.get(task.output_path)
+        if journal:
+            journal.set_state(task.video_file, STATE_DONE)
+        self._advance_progress(output_file)
+        return True
+
+    def _was_cancelled(self, output_file: str) -> bool:
+        with self._processes_lock:
+            return output_file in self._cancelled_outputs
+
+    def _cancel_task(self, task: MergeTask, part_file: str, match_seconds: float,
+                     timings: Dict[str, float]) -> None:
+        """Учёт задачи, чей mkvmerge завершён остановкой: незавершённый результат удаляется,
+        эпизод в журнале снова ожидает обработки (его подхватит resume)."""
+        base_name = os.path.splitext(os.path.basename(task.video_file))[0]
+        self._remove_file(part_file)
+        self._emit_status(f"Cancelled: {base_name}", EVENT_JOB_CANCELLED, base_name,
+                          output_file=task.output_file)
+        self.metrics.record(task.video_file, STATUS_CANCELLED, match_seconds=match_seconds,
+                            spawn_seconds=timings.get('spawn_seconds'),
+                            wall_seconds=timings.get('wall_seconds'))
+        journal = self._journals.get(task.output_path)
+        if journal:
+            journal.set_state(task.video_file, STATE_PENDING)
+        return None
+
+    @staticmethod
+    def _remove_file(path: str):
+        """Удаление временного файла (незавершённого результата, файла опций)."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Unable to remove {path}: {e}")
+
+    def _run_mkvmerge(self, command: List[str], output_file: str, base_name: str,
+                      timings: Optional[Dict[str, float]] = None) -> Tuple[int, List[str]]:
+        """Запуск mkvmerge в --gui-mode с построчным чтением вывода.
+
+        Строки #GUI#progress переводятся в прогресс файла и всей очереди,
+        из остального вывода в памяти остаются последние output_tail_bytes байт
+        (полный вывод — в файле журнала, если задан output_log_dir). В timings
+        записываются время запуска процесса и общее время работы.
+        """
+        arguments = ['--gui-mode'] + command[1:]
+        options_path = None
+        if self._use_options_file(command):
+            options_path = self._write_options_file(arguments)
+            command = [command[0], f'@{options_path}']
+        else:
+            command = [command[0]] + arguments
+        output_tail = OutputTail(self.output_tail_bytes,
+                                 job_log_path(self.output_log_dir, output_file) if self.output_log_dir else None)
+        timings = timings if timings is not None else {}
+        try:
+            started = time.perf_counter()
+            process = subprocess.Popen(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding='utf-8',
+                errors='replace',
+                creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
             )
-            if subtitle_file:
-                command.extend([
-                    '--language', f'0:{subtitle.get("language", "")}',
-                    '--track-name', f'0:{subtitle.get("track_name", "")}',
-                    subtitle_file
-                ])
+            timings['spawn_seconds'] = time.perf_counter() - started
+            with self._processes_lock:
+                self._processes[output_file] = process
+            # Остановка могла прийти между проверкой в _process_video и запуском процесса
+            if self._stop_requested:
+                self.stop()
+            with process.stdout:
+                # Длинные строки читаются частями, память на задачу ограничена
+                for line in iter(lambda: process.stdout.readline(MAX_LINE_CHARS), ''):
+                    line = line.rstrip()
+                    match = GUI_PROGRESS_RE.match(line)
+                    if match:
+                        percent = min(int(match.group(1)), 100)
+                        self._emit_file_progress(base_name, percent)
+                        self._update_file_progress(output_file, percent)
+                    elif line:
+                        output_tail.append(line)
+            returncode = process.wait()
+            timings['wall_seconds'] = time.perf_counter() - started
+        finally:
+            with self._processes_lock:
+                self._processes.pop(output_file, None)
+            output_tail.close()
+            if options_path:
+                self._remove_file(options_path)
+        return returncode, output_tail.lines()
+
+    def _use_options_file(self, command: List[str]) -> bool:
+        """Передавать ли аргументы через @options.json (mkvmerge 8.0 и новее)."""
+        if self.options_file == OPTIONS_FILE_NEVER:
+            return False
+        if self.mkvmerge_version_info and not self.mkvmerge_supports(8, 0):
+            return False
+        if self.options_file == OPTIONS_FILE_ALWAYS:
+            return True
+        return len(subprocess.list2cmdline(command)) >= OPTIONS_FILE_MIN_LENGTH
+
+    @staticmethod
+    def _write_options_file(arguments: List[str], path: Optional[str] = None) -> str:
+        """Запись аргументов в формате JSON-файла опций mkvmerge (массив строк в UTF-8).
+
+        Без path создаётся временный файл, который удаляет вызывающий.
+        """
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix='mkvmerge-', suffix='.json')
+            f = os.fdopen(handle, 'w', encoding='utf-8')
+        else:
+            f = open(path, 'w', encoding='utf-8')
+        with f:
+            json.dump(arguments, f, ensure_ascii=False, indent=0)
+        return path
+
+    def _save_failed_options(self, command: List[str], output_file: str):
+        """Файл опций неудавшейся задачи рядом с результатом: `mkvmerge @<файл>` повторит её."""
+        if self.options_file == OPTIONS_FILE_NEVER:
+            return
+        path = output_file + FAILED_OPTIONS_SUFFIX
+        try:
+            self._write_options_file(command[1:], path)
+            logger.info(f"mkvmerge options saved to: {path}")
+        except OSError as e:
+            logger.warning(f"Unable to save mkvmerge options to {path}: {e}")
+
+    def _update_file_progress(self, output_file: str, percent: int):
+        """Обновление прогресса одного файла и общего прогресса; безопасно для нескольких потоков.
+
+        Прогресс учитывается по выходному файлу: один сериал может собираться в несколько папок.
+        """
+        with self._progress_lock:
+            previous = self._file_progress.get(output_file, 0)
+            if percent <= previous:
+                return
+            self._file_progress[output_file] = percent
+            self._progress_sum += (percent - previous) * self._weights.get(output_file, 1)
+            if not self._total_known:
+                # Процент от неизвестного итога не имеет смысла; см. _publish_progress
+                return
+            progress = self._progress_sum // self._total_weight if self._total_weight else 100
+            # Оценка итога уточняется по мере подготовки задач; индикатор назад не идёт
+            if progress <= self._last_progress:
+                return
+            self._last_progress = progress
+        self._emit_progress(progress)
+
+    def _advance_progress(self, output_file: str):
+        """Учёт завершённой (успешно или нет) задачи."""
+        with self._progress_lock:
+            self._completed += 1
+        self._update_file_progress(output_file, 100)
+        with self._progress_lock:
+            # Завершённый файл больше не влияет на прогресс, память на него не расходуется
+            self._file_progress.pop(output_file, None)
+            self._weights.pop(output_file, None)
+        if not self._total_known:
+            self._publish_progress()
+
+    def _publish_progress(self):
+        """Общий прогресс: проценты или, пока обход не закончен, value=None с числом
+        завершённых и найденных эпизодов (неопределённый индикатор)."""
+        with self._progress_lock:
+            if not self._total_known:
+                completed, found = self._completed, self._total
+                progress = None
             else:
-                self._emit_status(f"Subtitle track not found: {subtitle.get('path')}")
+                progress = self._progress_sum // self._total_weight if self._total_weight else 100
+                if progress <= self._last_progress:
+                    return
+                self._last_progress = progress
+        if progress is None:
+            self._emit_progress(None, completed=completed, found=found)
+        else:
+            self._emit_progress(progress)
 
-        return command
+    def _begin_run(self, refresh_indexes: bool = True):
+        """Сброс состояния перед запуском очереди эпизодов."""
+        with self._progress_lock:
+            self._total = 0
+            self._completed = 0
+            self._file_progress = {}
+            self._progress_sum = 0
+            self._last_progress = -1
+            self._weights = {}
+            self._total_weight = 0
+            self._expected = {}
+            self._run_started = time.monotonic()
+            self._queued = []
+            self._total_known = True
+            self._outstanding = {}
+        self.undone = []
+        self._unscanned = []
+        self.rejected = []
+        self.cancel_seconds = None
+        with self._processes_lock:
+            self._cancelled_outputs = set()
+        self.planned_read_bytes = 0
+        self.planned_write_bytes = 0
+        self.metrics.reset()
+        self.metrics_summary = None
+        self.results = {}
+        self.skipped = []
+        self._manifests = {}
+        self._journals = {}
+        # Папки дорожек, изменившиеся с прошлого запуска, индексируются заново
+        if refresh_indexes:
+            self._clear_indexes()
+        if self.output_log_dir:
+            try:
+                os.makedirs(self.output_log_dir, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Unable to create log folder {self.output_log_dir}: {e}")
 
-    def process_files(self, series_path: str, output_path: str,
-                audio_data: List[Dict], subtitle_data: List[Dict]):
-        """Основная функция обработки файлов."""
+    def _add_to_total(self, tasks: List[MergeTask]):
+        """Добавление задач в общий прогресс (в пакетном режиме — во время работы)."""
+        with self._progress_lock:
+            self._total += len(tasks)
+            self._queued.extend(task.video_file for task in tasks)
+            for task in tasks:
+                weight = max(1, task.read_bytes)
+                self._weights[task.output_file] = weight
+                # Оценка по размеру видео заменяется весом по всем входам задачи
+                self._total_weight += weight - self._expected.pop(task.output_file, 0)
+        self._publish_progress()
+
+    def _expect_total(self, video_files: List[str], sizes: Dict[str, int], output_path: str):
+        """Оценка итога потоковой обработки по размерам видео: процент и ETA известны
+        с начала, а не только после подготовки всей папки."""
+        with self._progress_lock:
+            for video_file in video_files:
+                weight = max(1, sizes[video_file])
+                self._expected[output_file_for(video_file, output_path)] = weight
+                self._total_weight += weight
+            self._total_known = True
+        self._publish_progress()
+
+    def _settle_expected(self, video_files: Optional[List[str]] = None, output_path: str = ''):
+        """Снятие оценок эпизодов, которые не стали задачами (отсеяны, отброшены, не дошли);
+        без video_files — всех оставшихся."""
+        with self._progress_lock:
+            if video_files is None:
+                self._total_weight -= sum(self._expected.values())
+                self._expected = {}
+                return
+            for video_file in video_files:
+                self._total_weight -= self._expected.pop(output_file_for(video_file, output_path), 0)
+
+    def eta_seconds(self) -> Optional[float]:
+        """Оценка оставшегося времени по доле обработанных байт; None, пока оценки нет."""
+        with self._progress_lock:
+            if not self._total_known or not self._total_weight or not self._progress_sum:
+                return None
+            fraction = self._progress_sum / (self._total_weight * 100)
+        elapsed = time.monotonic() - self._run_started
+        return elapsed * (1 - fraction) / fraction
+
+    def _eta_suffix(self) -> str:
+        eta = self.eta_seconds()
+        if eta is None or eta < 1:
+            return ""
+        minutes, seconds = divmod(int(eta), 60)
+        hours, minutes = divmod(minutes, 60)
+        return f" (ETA {hours}:{minutes:02d}:{seconds:02d})"
+
+    def _reserve_space(self, tasks: List[MergeTask], output_path: str,
+                       announce: bool = True) -> Optional[List[MergeTask]]:
+        """Проверка свободного места под задачи до запуска mkvmerge.
+
+        Возвращает задачи, которые можно запускать (при политике trim — только
+        помещающиеся на диск), в порядке self.order, или None, если места не хватает.
+        Принятые задачи считаются незавершёнными до _collect_done: резерв на устройстве
+        держат только они, а завершённые уже заняли своё место на диске.
+        """
+        # Размеры перечитываются: план мог быть построен заранее
+        for task in tasks:
+            estimate_task(task)
+        # Порядок задаётся до отбора по месту: при trim отбрасываются последние по порядку
+        tasks = order_tasks(tasks, self.order)
+        read_bytes = sum(task.read_bytes for task in tasks)
+        write_bytes = sum(task.write_bytes for task in tasks)
+
+        device_map = self.device_limiter.device_map
+        device = device_map.device_for(output_path)
+        with self._progress_lock:
+            outstanding = list(self._outstanding.values())
+        outstanding = [task for task in outstanding if device_map.device_for(task.output_path) == device]
+        # Незавершённые задачи держат только ещё не записанную часть результата: уже записанное
+        # в .part учтено в free_space, а запас на диске учитывается один раз — в need
+        reserved = sum(max(0, task.write_bytes - file_size(partial_output_path(task.output_file)))
+                       for task in outstanding)
+        try:
+            free = free_space(output_path) - reserved
+        except OSError as e:
+            logger.warning(f"Unable to check free space in {output_path}: {e}")
+            free = None
+        need = required_space(tasks, self.max_jobs)
+        if announce:
+            self._emit_status(f"Planned {len(tasks)} files: {format_size(read_bytes)} to read, "
+                              f"{format_size(write_bytes)} to write"
+                              + (f", {format_size(max(0, free))} free in output" if free is not None else ""))
+
+        if free is not None and need > free:
+            shortage = (f"Not enough free space in {output_path}: "
+                        f"need {format_size(need)}, available {format_size(max(0, free))}")
+            if self.space_policy == SPACE_POLICY_IGNORE:
+                logger.warning(shortage)
+            elif self.space_policy == SPACE_POLICY_TRIM:
+                tasks, dropped = trim_to_fit(tasks, free, self.max_jobs)
+                if not tasks:
+                    self._emit_error(shortage)
+                    return None
+                # Отброшенные эпизоды остаются в журнале незавершёнными и доступны для resume,
+                # а в итогах запуска числятся несделанными
+                self._unscanned.extend(task.video_file for task in dropped)
+                self._emit_status(f"{shortage}; processing {len(tasks)} files, "
+                                  f"{len(dropped)} left for later")
+                need = required_space(tasks, self.max_jobs)
+                read_bytes = sum(task.read_bytes for task in tasks)
+                write_bytes = sum(task.write_bytes for task in tasks)
+            else:
+                self._emit_error(shortage)
+                return None
+
+        with self._progress_lock:
+            for task in tasks:
+                self._outstanding[task.output_file] = task
+        self.planned_read_bytes += read_bytes
+        self.planned_write_bytes += write_bytes
+        return tasks
+
+    def _validate_paths(self, series_path: str, output_path: str) -> bool:
+        for path in [series_path, output_path]:
+            if not os.path.isdir(path):
+                self._emit_error(f"Directory not found: {path}")
+                return False
+        return True
+
+    @staticmethod
+    def _discover_videos(series_path: str) -> List[str]:
+        # План и потоковая обработка отбирают одни и те же файлы
+        try:
+            return list(MkvProcessor._iter_videos(series_path))
+        except OSError as e:
+            logger.warning(f"Unable to scan {series_path}: {e}")
+            return []
+
+    @staticmethod
+    def _iter_videos(series_path: str) -> Iterator[str]:
+        """Видео папки по мере чтения каталога, без построения полного списка.
+
+        Отбираются *.mkv, кроме скрытых; регистр расширения не учитывается (EP01.MKV),
+        как у прежнего glob на Windows, на всех системах.
+        """
+        with os.scandir(series_path) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith('.mkv') and not entry.name.startswith('.'):
+                    try:
+                        if entry.is_file():
+                            yield entry.path
+                    except OSError:
+                        continue
+
+    def _check_videos(self, video_files: List[str]) -> List[str]:
+        """Видео с корректным заголовком Matroska; об остальных сообщается как об ошибке."""
+        if not self.check_inputs:
+            return video_files
+        valid = []
+        for video_file in video_files:
+            problem = check_matroska(video_file)
+            if problem is None:
+                valid.append(video_file)
+                continue
+            base_name = os.path.splitext(os.path.basename(video_file))[0]
+            self.rejected.append(video_file)
+            self.results[video_file] = False
+            self._emit_error(f"Invalid MKV file {os.path.basename(video_file)}: {problem}",
+                             EVENT_JOB_FAILED, base_name, rejected=True)
+        return valid
+
+    def _prepare_series(self, series_path: str, output_path: str, audio_data: List[Dict],
+                        subtitle_data: List[Dict], resume: bool = False,
+                        video_files: Optional[List[str]] = None) -> Optional[List[str]]:
+        """Поиск эпизодов сериала и подготовка журнала и манифеста его выходной папки.
+
+        Возвращает список эпизодов к обработке или None, если обрабатывать нечего.
+        """
+        selected = video_files is not None
+        if not selected:
+            video_files = self._discover_videos(series_path)
+
+        if not video_files:
+            self._emit_error(f"No MKV files found in input directory. Path:{series_path}")
+            return None
+        video_files = self._check_videos(video_files)
+        if not video_files:
+            return None
+
+        journal = self._journals.get(output_path)
+        if journal is None and (resume or selected):
+            journal = JobJournal.load(output_path)
+            if journal and journal.params.get('series_path') != series_path:
+                journal = None
+        if journal and resume:
+            video_files = [v for v in video_files if journal.state(v) != STATE_DONE]
+            journal.reset(video_files)
+            self._emit_status(f"Resuming: {len(video_files)} files left")
+            if not video_files:
+                self._emit_status("All files processed successfully")
+                return None
+        elif journal:
+            journal.reset(video_files)
+        else:
+            journal = JobJournal(output_path)
+            journal.start(self._journal_params(series_path, audio_data, subtitle_data), video_files)
+        self._journals[output_path] = journal
+
+        # Быстрой правке свойств манифест нужен, чтобы убедиться, что входные файлы те же
+        if (self.incremental or self.propedit) and output_path not in self._manifests:
+            self._manifests[output_path] = MergeManifest(output_path, self.verify_hash)
+        return video_files
+
+    def _journal_params(self, series_path: str, audio_data: List[Dict], subtitle_data: List[Dict]) -> Dict:
+        """Параметры запуска для журнала: по ним resume повторяет сопоставление дорожек."""
+        return {
+            'series_path': series_path,
+            'audio_data': audio_data,
+            'subtitle_data': subtitle_data,
+            'match_mode': self.match_mode,
+            'episode_patterns': self.episode_pattern_sources,
+            'identify': self.identify,
+        }
+
+    def _stream_series(self, series_path: str, output_path: str, audio_data: List[Dict],
+                       subtitle_data: List[Dict], resume: bool = False,
+                       chunk_size: int = 1) -> Iterator[MergeTask]:
+        """Потоковая подготовка задач сериала: проверка заголовков, журнал,
+        сопоставление дорожек и резерв места частями по chunk_size эпизодов.
+
+        Список видео (имена и размеры) читается заранее, всё остальное — лениво:
+        следующая часть готовится, только когда исполнитель забрал предыдущую, поэтому
+        подготовленных задач в памяти не больше chunk_size, а первые эпизоды собираются,
+        пока остальные ещё не проверены и не сопоставлены.
+        """
+        journal = JobJournal.load(output_path) if resume else None
+        if journal and journal.params.get('series_path') != series_path:
+            journal = None
+        if journal is None:
+            journal = JobJournal(output_path)
+            journal.start(self._journal_params(series_path, audio_data, subtitle_data), [])
+        # Пока обход не закончен, в журнале есть не все эпизоды папки
+        journal.params['scan_complete'] = False
+        journal.save()
+        self._journals[output_path] = journal
+        if (self.incremental or self.propedit) and output_path not in self._manifests:
+            self._manifests[output_path] = MergeManifest(output_path, self.verify_hash)
+
+        with self._progress_lock:
+            self._total_known = False
+        found = 0
+        finished = 0
+        conflicts = None
+        videos: Iterator[str] = iter(())
         try:
+            # Папка сначала читается целиком, без чтения самих файлов (имена и stat): порядок
+            # self.order соблюдается для всей папки, а не только внутри очередной части,
+            # а итог прогресса известен с самого начала
+            listed = list(self._iter_videos(series_path))
+            sizes = {video_file: file_size(video_file) for video_file in listed}
+            names = order_files(listed, self.order, sizes)
+            todo = [v for v in names if not resume or journal.state(v) != STATE_DONE]
+            if self.match_mode != MATCH_NAME:
+                # Повторяющийся ключ отключает сопоставление по ключу у всех его видео, как в _make_tasks
+                conflicts = self._key_conflicts(todo, check_headers=True)
+            if not self._check_folder_space(todo, sizes, output_path):
+                return
+            self._expect_total(todo, sizes, output_path)
+            videos = iter(names)
+            for video_files in _chunks(videos, chunk_size):
+                found += len(video_files)
+                if resume:
+                    remaining = [v for v in video_files if journal.state(v) != STATE_DONE]
+                    finished += len(video_files) - len(remaining)
+                    video_files = remaining
+                listed_chunk = video_files
+                video_files = self._check_videos(video_files)
+                if not video_files:
+                    self._settle_expected(listed_chunk, output_path)
+                    continue
+                journal.reset(video_files)
+                tasks = self._make_tasks(video_files, series_path, output_path, audio_data, subtitle_data,
+                                         conflicts=conflicts)
+                tasks = self._reserve_space(tasks, output_path, announce=False)
+                if tasks is None:
+                    # Место кончилось посреди обхода: эпизоды этой части и ещё не прочитанные
+                    # (по именам, без проверки заголовков) остаются несделанными
+                    self._unscanned += video_files + [v for v in videos
+                                                      if not resume or journal.state(v) != STATE_DONE]
+                    return
+                self._add_to_total(tasks)
+                self._settle_expected(listed_chunk, output_path)
+                yield from tasks
+                if self._stop_requested:
+                    return
+        finally:
+            # Остановка посреди обхода (в том числе закрытием генератора): эпизоды, которые ещё
+            # не готовились, тоже остаются несделанными
             if self._stop_requested:
+                self._unscanned += [v for v in videos if not resume or journal.state(v) != STATE_DONE]
+            self._settle_expected()
+            with self._progress_lock:
+                self._total_known = True
+
+        journal.params['scan_complete'] = True
+        journal.save()
+        if not found:
+            self._emit_error(f"No MKV files found in input directory. Path:{series_path}")
+            return
+        self._emit_status(f"Found {found} files: {format_size(self.planned_read_bytes)} to read, "
+                          f"{format_size(self.planned_write_bytes)} to write"
+                          + (f", {finished} already done" if finished else ""))
+        if resume and finished == found:
+            self._emit_status("All files processed successfully")
+        self._publish_progress()
+
+    def _check_folder_space(self, video_files: List[str], sizes: Dict[str, int], output_path: str) -> bool:
+        """Проверка места под всю папку до первой задачи потоковой обработки (политика fail).
+
+        Дорожки ещё не найдены, поэтому объём оценивается по размерам видео; части папки
+        затем проверяются по полным размерам в _reserve_space.
+        """
+        if self.space_policy != SPACE_POLICY_FAIL or not video_files:
+            return True
+        need = space_for([(sizes[video_file], file_size(output_file_for(video_file, output_path)))
+                          for video_file in video_files], self.max_jobs)
+        try:
+            free = free_space(output_path)
+        except OSError as e:
+            logger.warning(f"Unable to check free space in {output_path}: {e}")
+            return True
+        if need > free:
+            self._emit_error(f"Not enough free space in {output_path}: "
+                             f"need {format_size(need)}, available {format_size(max(0, free))}")
+            return False
+        return True
+
+    def _make_tasks(self, video_files: List[str], series_path: str, output_path: str,
+                    audio_data: List[Dict], subtitle_data: List[Dict], job=None,
+                    conflicts: Optional[Set[str]] = None) -> List[MergeTask]:
+        """Задачи для эпизодов сериала с уже сопоставленными дорожками.
+
+        Устройства определяются один раз на сериал. conflicts — видео с повторяющимся
+        ключом эпизода, найденные заранее по всей папке (потоковая обработка); без него
+        повторы ищутся среди video_files.
+        """
+        reads, writes = self._series_devices(series_path, output_path, audio_data, subtitle_data)
+        tasks = [MergeTask(video_file, output_path, audio_data, subtitle_data, reads, writes, job)
+                 for video_file in video_files]
+        if conflicts is None:
+            conflicts = self._key_conflicts(video_files)
+        for task in tasks:
+            self._resolve_task(task, task.video_file in conflicts)
+        if self.identify:
+            self._identify_tasks(tasks)
+        return tasks
+
+    def _key_conflicts(self, video_files: List[str], check_headers: bool = False) -> Set[str]:
+        """Видео с одинаковым ключом эпизода: они получили бы одни и те же дорожки.
+
+        check_headers — заголовки видео ещё не проверены: файлы, которые _check_videos
+        отсеет, в повторах не участвуют.
+        """
+        conflicts = set()
+        if self.match_mode == MATCH_NAME:
+            return conflicts
+        for key, files in duplicate_keys(video_files, self.episode_patterns).items():
+            if check_headers and self.check_inputs:
+                files = [video_file for video_file in files if check_matroska(video_file) is None]
+                if len(files) < 2:
+                    continue
+            conflicts.update(files)
+            self._emit_status(f"Duplicate episode key {format_key(key)}: "
+                              + ", ".join(os.path.basename(path) for path in files))
+        return conflicts
+
+    def _series_devices(self, series_path: str, output_path: str, audio_data: List[Dict],
+                        subtitle_data: List[Dict]) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        read_paths = [series_path] + [data.get('path') for data in audio_data + subtitle_data]
+        return self.device_limiter.devices(read_paths, [output_path])
+
+    def _plan_tasks(self, plan: MergePlan, video_files: List[str], job=None) -> List[MergeTask]:
+        """Задачи из готового плана, без повторного сопоставления дорожек."""
+        reads, writes = self._series_devices(plan.series_path, plan.output_path,
+                                             plan.audio_data, plan.subtitle_data)
+        selected = set(video_files)
+        return [MergeTask.from_dict(episode, reads, writes, job)
+                for episode in plan.episodes if episode['video_file'] in selected]
+
+    def _submit_ready(self, executor: ThreadPoolExecutor, pending: TaskQueue,
+                      running: Dict[Future, MergeTask], mkvmerge_path: str):
+        """Запуск ожидающих задач, пока есть свободные места в пуле и слоты устройств."""
+        while len(running) < self.max_jobs and len(pending):
+            task = pending.pop_ready(self.device_limiter)
+            if task is None:
                 return
+            future = executor.submit(self._process_video, task, mkvmerge_path)
+            running[future] = task
 
-            # Валидация путей
-            for path in [series_path, output_path]:
-                if not os.path.isdir(path):
-                    self._emit_error(f"Directory not found: {path}")
-                    return
+    def _collect_done(self, done, running: Dict[Future, MergeTask]) -> List[Tuple[MergeTask, Optional[bool]]]:
+        """Освобождение слотов завершившихся задач и запись их результатов."""
+        finished = []
+        for future in done:
+            task = running.pop(future)
+            # Резерв места завершённой задачи освобождается
+            with self._progress_lock:
+                self._outstanding.pop(task.output_file, None)
+            self.device_limiter.release(task.reads, task.writes)
+            result = future.result()
+            self.results[task.video_file] = result
+            finished.append((task, result))
+        return finished
+
+    def _cancel_pending(self, pending: TaskQueue):
+        """Снятие не начатых задач после остановки с освобождением их резерва места."""
+        removed = pending.clear()
+        with self._progress_lock:
+            for task in removed:
+                self._outstanding.pop(task.output_file, None)
+
+    def _finish_run(self):
+        """Итоговое сообщение о результатах запуска."""
+        self.metrics_summary = self.metrics.finish()
+        if self.metrics_summary['episodes']:
+            self._emit_status(self.metrics.format_summary(self.metrics_summary))
+        failed = [f for f, ok in self.results.items() if ok is False and f not in self.rejected]
+        # Несделанные эпизоды: не начатые, прерванные остановкой и не дошедшие до очереди из-за места
+        self.undone = [video_file for video_file in self._queued if self.results.get(video_file) is None]
+        self.undone += self._unscanned
+        total = self._total + len(self._unscanned)
+        if self._stop_requested and self._stop_requested_at is not None:
+            self.cancel_seconds = time.monotonic() - self._stop_requested_at
+        if self._stop_requested:
+            message = f"Processing stopped by user: {len(self.undone)} of {total} files left undone"
+        elif self._unscanned:
+            message = f"Not enough free space: {len(self.undone)} of {total} files left undone"
+        elif failed:
+            message = f"Processed with errors: {len(failed)} of {total} failed"
+        else:
+            message = "All files processed successfully"
+        if self.undone:
+            logger.info("Left undone: " + ", ".join(os.path.basename(path) for path in self.undone))
+        if self.rejected:
+            message += f", {len(self.rejected)} invalid files skipped"
+        self._emit_status(message, EVENT_RUN_FINISHED, stopped=self._stop_requested,
+                          failed=len(failed), total=total, undone=self.undone,
+                          cancel_seconds=self.cancel_seconds, rejected=self.rejected)
+
+    def resume(self, output_path: str):
+        """Продолжение прерванной обработки по журналу в выходной папке."""
+        journal = JobJournal.load(output_path)
+        if not journal or not journal.params:
+            self._emit_error(f"No job journal found in: {output_path}")
+            return
+        if journal.is_finished() and journal.params.get('scan_complete', True):
+            self._emit_status("Nothing to resume: all files were processed")
+            return
+        params = journal.params
+        # Дорожки сопоставляются так же, как в прерванном запуске
+        self.match_mode = params.get('match_mode', self.match_mode)
+        self.identify = params.get('identify', self.identify)
+        if params.get('episode_patterns') is not None:
+            self.episode_pattern_sources = list(params['episode_patterns'])
+            self.episode_patterns = compile_patterns(self.episode_pattern_sources)
+            with self._index_lock:
+                self._episode_indexes.clear()
+        self.process_files(params['series_path'], output_path,
+                           params.get('audio_data', []), params.get('subtitle_data', []),
+                           resume=True)
 
+    def plan(self, series_path: str, output_path: str, audio_data: List[Dict],
+             subtitle_data: List[Dict], video_files: Optional[List[str]] = None) -> Optional[MergePlan]:
+        """План сборки без запуска mkvmerge: дорожки всех эпизодов сопоставляются один раз.
+
+        План можно показать (dry run), сохранить в JSON и передать в process_plan.
+        """
+        if not self._validate_paths(series_path, output_path):
+            return None
+        self._clear_indexes()
+        if video_files is None:
+            video_files = self._discover_videos(series_path)
+        if not video_files:
+            self._emit_error(f"No MKV files found in input directory. Path:{series_path}")
+            return None
+        self.rejected = []
+        video_files = self._check_videos(video_files)
+        if not video_files:
+            return None
+        tasks = self._make_tasks(video_files, series_path, output_path, audio_data, subtitle_data)
+        return MergePlan(series_path, output_path, audio_data, subtitle_data,
+                         [task.to_dict() for task in tasks])
+
+    def process_plan(self, plan: MergePlan, resume: bool = False):
+        """Выполнение готового плана (например, загруженного из JSON) без повторного сопоставления."""
+        self.errors = []
+        self.results = {}
+        try:
+            if self._stop_requested:
+                return
+            if not self._validate_paths(plan.series_path, plan.output_path):
+                return
             mkvmerge_path = self.find_mkvmerge()
             if not mkvmerge_path:
                 return
 
-            # Исправлено: экранирование пути к папке с файлами
-            escaped_series_path = glob.escape(series_path)
-            video_files = glob.glob(os.path.join(escaped_series_path, "*.mkv"))
-            
+            self._begin_run()
+            video_files = self._prepare_series(plan.series_path, plan.output_path, plan.audio_data,
+                                               plan.subtitle_data, resume,
+                                               [episode['video_file'] for episode in plan.episodes])
             if not video_files:
-                self._emit_error(f"No MKV files found in input directory. Path:{series_path}")
                 return
+            self._execute(self._plan_tasks(plan, video_files), plan.output_path, mkvmerge_path)
 
-            total = len(video_files)
-            for index, video_file in enumerate(video_files):
-                if self._stop_requested:
-                    self._emit_status("Processing stopped by user")
-                    return
+        except Exception as e:
+            self._emit_error(f"Critical error: {str(e)}")
+            raise
 
-                base_name = os.path.splitext(os.path.basename(video_file))[0]
-                output_file = os.path.join(output_path, f"{base_name}_merged.mkv")
+    def _execute(self, tasks: List[MergeTask], output_path: str, mkvmerge_path: str):
+        """Запуск задач одного сериала в пуле с учётом свободного места и устройств."""
+        tasks = self._reserve_space(tasks, output_path)
+        if not tasks:
+            return
+        self._add_to_total(tasks)
 
-                self._emit_status(f"Processing: {base_name}...")
+        self._run_queue(iter(tasks), mkvmerge_path, min(self.max_jobs, self._total), len(tasks))
+        self._finish_run()
 
-                command = self._build_mkvmerge_command(video_file, output_file, audio_data, subtitle_data)
-                command[0] = mkvmerge_path  # Заменяем первый аргумент на полный путь
+    def _execute_stream(self, tasks: Iterator[MergeTask], mkvmerge_path: str):
+        """Выполнение задач по мере их подготовки генератором _stream_series."""
+        self._run_queue(tasks, mkvmerge_path, self.max_jobs, self.max_jobs * STREAM_WINDOW_PER_JOB)
+        if self._queued or self._unscanned:
+            self._finish_run()
 
-                try:
-                    process = subprocess.Popen(
-                        command,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                        text=True,
-                        creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
-                    )
-                    stdout, stderr = process.communicate()
-
-                    if process.returncode != 0:
-                        self._emit_error(f"Failed to process {base_name}:\n{stderr}")
-                    else:
-                        self._emit_status(f"Successfully processed: {base_name}")
-
-                except subprocess.SubprocessError as e:
-                    self._emit_error(f"Error processing {base_name}: {str(e)}")
-
-                # Обновление прогресса
-                progress = int((index + 1) / total * 100)
-                self._emit_progress(progress)
+    def _run_queue(self, source: Iterator[MergeTask], mkvmerge_path: str, max_workers: int, window: int):
+        """Пул задач mkvmerge, пополняемый из source.
 
-            self._emit_status("All files processed successfully")
+        Новые задачи берутся из source, только пока в очереди меньше window ожидающих,
+        так что ленивый источник готовит эпизоды не быстрее, чем они выполняются.
+        """
+        pending = TaskQueue()
+        exhausted = False
+        # Задачи mkvmerge выполняются параллельно, завершаться они могут в любом порядке
+        running: Dict[Future, MergeTask] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+                while True:
+                    while not exhausted and len(pending) < window:
+                        task = next(source, None)
+                        if task is None:
+                            exhausted = True
+                        else:
+                            pending.push(task)
+                    self._submit_ready(executor, pending, running, mkvmerge_path)
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    self._collect_done(done, running)
+                    if self._stop_requested:
+                        # Ещё не начатые задачи не запускаются, запущенные прерывает stop()
+                        self._cancel_pending(pending)
+                        exhausted = True
+        finally:
+            close = getattr(source, 'close', None)
+            if close:
+                close()
+
+    def process_files(self, series_path: str, output_path: str,
+                audio_data: List[Dict], subtitle_data: List[Dict], resume: bool = False,
+                video_files: Optional[List[str]] = None, refresh_indexes: bool = True):
+        """Основная функция обработки файлов.
+
+        При resume=True обрабатываются только эпизоды, не завершённые по журналу.
+        video_files ограничивает обработку указанными эпизодами (они добавляются в журнал),
+        refresh_indexes=False сохраняет индексы папок дорожек с прошлого запуска.
+        Без video_files эпизоды папки готовятся потоково: сборка начинается с первой
+        подготовленной части, а общий прогресс до подготовки эпизода оценивается по размеру видео.
+        """
+        self.errors = []
+        self.results = {}
+        try:
+            if self._stop_requested:
+                return
+
+            # Валидация путей
+            if not self._validate_paths(series_path, output_path):
+                return
+
+            mkvmerge_path = self.find_mkvmerge()
+            if not mkvmerge_path:
+                return
+
+            self._begin_run(refresh_indexes)
+            if video_files is None:
+                self._execute_stream(
+                    self._stream_series(series_path, output_path, audio_data, subtitle_data, resume,
+                                        self.max_jobs * STREAM_WINDOW_PER_JOB),
+                    mkvmerge_path)
+                return
+            video_files = self._prepare_series(series_path, output_path, audio_data, subtitle_data,
+                                               resume, video_files)
+            if not video_files:
+                return
+            self._execute(self._make_tasks(video_files, series_path, output_path, audio_data, subtitle_data),
+                          output_path, mkvmerge_path)
 
         except Exception as e:
             self._emit_error(f"Critical error: {str(e)}")
@@ -236,6 +1689,8 @@ class MkvProcessor:
 # Адаптер для совместимости со старым кодом
 def process_data(series_path: str, output_path: str,
                audio_data: List[Dict], subtitle_data: List[Dict],
-               worker: Optional[object] = None):
-    processor = MkvProcessor(worker)
-    processor.process_files(series_path, output_path, audio_data, subtitle_data)
\ No newline at end of file
+               worker: Optional[object] = None, max_jobs: Optional[int] = None,
+               incremental: bool = False):
+    processor = MkvProcessor(worker, max_jobs, incremental)
+    processor.process_files(series_path, output_path, audio_data, subtitle_data)
+    return processor
\ No newline at end of file
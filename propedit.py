@@ -0,0 +1,79 @@
+"""Быстрое исправление свойств дорожек уже собранного файла через mkvpropedit.
+
+Если результат собран из тех же входных файлов и в нём те же дорожки, а отличаются
+только язык или название внешних дорожек, заголовок правится на месте за
+миллисекунды вместо полной пересборки многогигабайтного файла.
+"""
+import os
+import shutil
+import platform
+import logging
+from typing import Optional, List, Dict
+
+logger = logging.getLogger(__name__)
+
+
+def find_mkvpropedit(mkvmerge_path: Optional[str] = None) -> Optional[str]:
+    """mkvpropedit из той же папки, что и mkvmerge, или из PATH."""
+    name = 'mkvpropedit.exe' if platform.system() == 'Windows' else 'mkvpropedit'
+    if mkvmerge_path and os.path.dirname(mkvmerge_path):
+        sibling = os.path.join(os.path.dirname(mkvmerge_path), name)
+        if os.path.isfile(sibling):
+            return sibling
+    return shutil.which(name)
+
+
+def _layout(info: Dict) -> List[tuple]:
+    return [(track['type'], track['codec']) for track in info.get('tracks', [])]
+
+
+def _same_language(wanted: str, track: Dict) -> bool:
+    wanted = wanted.lower()
+    return wanted in (track.get('language', '').lower(), track.get('language_ietf', '').lower())
+
+
+def property_edits(output_info: Dict, video_info: Dict, track_infos: List[Optional[Dict]],
+                   tracks: List[Dict]) -> Optional[List[Dict]]:
+    """Правки свойств дорожек результата или None, если набор дорожек изменился.
+
+    Результат mkvmerge содержит дорожки видео, затем дорожки каждого внешнего файла
+    по порядку. Совпадать должны число, типы и кодеки всех дорожек; правятся язык и
+    название тех дорожек внешних файлов, которые задаются в команде.
+    """
+    expected = _layout(video_info)
+    offsets = []
+    for info in track_infos:
+        if info is None:
+            return None
+        offsets.append(len(expected))
+        expected.extend(_layout(info))
+    if _layout(output_info) != expected:
+        return None
+
+    output_tracks = output_info['tracks']
+    edits = []
+    for track, offset in zip(tracks, offsets):
+        position = offset + track.get('track_id', 0)
+        current = output_tracks[position]
+        changes = {}
+        language = track.get('language', '')
+        if language and not _same_language(language, current):
+            changes['language'] = language
+        if track.get('track_name', '') != current.get('name', ''):
+            changes['name'] = track.get('track_name', '')
+        if changes:
+            # mkvpropedit нумерует дорожки с единицы в порядке их следования в файле
+            edits.append({'track': position + 1, 'changes': changes})
+    return edits
+
+
+def propedit_command(mkvpropedit_path: str, output_file: str, edits: List[Dict]) -> List[str]:
+    command = [mkvpropedit_path, output_file]
+    for edit in edits:
+        command.extend(['--edit', f"track:{edit['track']}"])
+        for key, value in edit['changes'].items():
+            if value:
+                command.extend(['--set', f'{key}={value}'])
+            else:
+                command.extend(['--delete', key])
+    return command
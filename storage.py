@@ -0,0 +1,142 @@
+"""Определение физических устройств и ограничение параллельной работы с ними.
+
+Задачи, читающие с одного HDD или пишущие на него, выполняются по очереди, а SSD
+допускают много одновременных операций. Устройство определяется по st_dev пути
+(bind-mount указывает на то же устройство, loop-устройство — на своё), тип — по
+/sys/dev/block/<major>:<minor>/queue/rotational на Linux. Для тестов и сетевых
+ресурсов соответствие можно задать вручную.
+"""
+import os
+import sys
+import threading
+import logging
+from typing import Optional, Dict, Tuple, Iterable, FrozenSet
+
+logger = logging.getLogger(__name__)
+
+KIND_SSD = 'ssd'
+KIND_HDD = 'hdd'
+KIND_UNKNOWN = 'unknown'
+
+# Одновременных (чтений, записей) на одно устройство по его типу
+DEFAULT_DEVICE_LIMITS: Dict[str, Tuple[int, int]] = {
+    KIND_SSD: (8, 4),
+    KIND_HDD: (1, 1),
+    KIND_UNKNOWN: (4, 2),
+}
+
+
+def _rotational_from_sysfs(dev: int) -> Optional[bool]:
+    """Признак вращающегося диска для устройства (для раздела берётся родительский диск)."""
+    base = os.path.realpath(f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}")
+    for candidate in (base, os.path.dirname(base)):
+        try:
+            with open(os.path.join(candidate, 'queue', 'rotational'), 'r') as f:
+                return f.read().strip() == '1'
+        except OSError:
+            continue
+    return None
+
+
+class DeviceMap:
+    """Соответствие путь -> устройство -> тип устройства.
+
+    overrides: префикс пути -> имя устройства (побеждает самый длинный префикс),
+    kinds: имя устройства -> 'ssd' / 'hdd' / 'unknown'.
+    """
+
+    def __init__(self, overrides: Optional[Dict[str, str]] = None,
+                 kinds: Optional[Dict[str, str]] = None):
+        self.overrides = {os.path.normpath(os.path.abspath(path)): name
+                          for path, name in (overrides or {}).items()}
+        self.kinds = dict(kinds or {})
+        self._cache: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def device_for(self, path: str) -> str:
+        path = os.path.normpath(os.path.abspath(path))
+        with self._lock:
+            cached = self._cache.get(path)
+        if cached:
+            return cached
+        device = self._override_for(path)
+        if device is None:
+            try:
+                dev = os.stat(path).st_dev
+                device = f"dev:{os.major(dev)}:{os.minor(dev)}"
+                if device not in self.kinds:
+                    self.kinds[device] = self._detect_kind(dev)
+            except OSError:
+                device = f"path:{path}"
+        with self._lock:
+            self._cache[path] = device
+        return device
+
+    def _override_for(self, path: str) -> Optional[str]:
+        best = None
+        for prefix, name in self.overrides.items():
+            if path == prefix or path.startswith(prefix.rstrip(os.sep) + os.sep):
+                if best is None or len(prefix) > len(best[0]):
+                    best = (prefix, name)
+        return best[1] if best else None
+
+    @staticmethod
+    def _detect_kind(dev: int) -> str:
+        if sys.platform.startswith('linux'):
+            rotational = _rotational_from_sysfs(dev)
+            if rotational is not None:
+                return KIND_HDD if rotational else KIND_SSD
+        return KIND_UNKNOWN
+
+    def kind_for(self, device: str) -> str:
+        return self.kinds.get(device, KIND_UNKNOWN)
+
+
+class DeviceLimiter:
+    """Счётчики одновременных чтений и записей по устройствам.
+
+    Слоты для задачи занимаются атомарно (все или ни одного), поэтому взаимных
+    блокировок между задачами не бывает.
+    """
+
+    def __init__(self, device_map: Optional[DeviceMap] = None,
+                 limits: Optional[Dict[str, Tuple[int, int]]] = None):
+        self.device_map = device_map or DeviceMap()
+        # Ключ — тип устройства или имя конкретного устройства
+        self.limits = dict(DEFAULT_DEVICE_LIMITS)
+        self.limits.update(limits or {})
+        self._reads: Dict[str, int] = {}
+        self._writes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _limit(self, device: str) -> Tuple[int, int]:
+        limit = self.limits.get(device) or self.limits.get(self.device_map.kind_for(device))
+        reads, writes = limit or DEFAULT_DEVICE_LIMITS[KIND_UNKNOWN]
+        return max(1, reads), max(1, writes)
+
+    def devices(self, read_paths: Iterable[str], write_paths: Iterable[str]) -> Tuple[FrozenSet[str], FrozenSet[str]]:
+        """Наборы устройств для чтения и записи по путям задачи."""
+        reads = frozenset(self.device_map.device_for(path) for path in read_paths)
+        writes = frozenset(self.device_map.device_for(path) for path in write_paths)
+        return reads, writes
+
+    def try_acquire(self, reads: FrozenSet[str], writes: FrozenSet[str]) -> bool:
+        with self._lock:
+            for device in reads:
+                if self._reads.get(device, 0) >= self._limit(device)[0]:
+                    return False
+            for device in writes:
+                if self._writes.get(device, 0) >= self._limit(device)[1]:
+                    return False
+            for device in reads:
+                self._reads[device] = self._reads.get(device, 0) + 1
+            for device in writes:
+                self._writes[device] = self._writes.get(device, 0) + 1
+            return True
+
+    def release(self, reads: FrozenSet[str], writes: FrozenSet[str]):
+        with self._lock:
+            for device in reads:
+                self._reads[device] -= 1
+            for device in writes:
+                self._writes[device] -= 1
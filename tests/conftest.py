@@ -0,0 +1,28 @@
+"""Общие фикстуры: библиотека сериала и заглушка mkvmerge из benchmarks/ (без MKVToolNix)."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from generate_library import generate_library  # noqa: E402
+from run_benchmark import _install_fake_mkvmerge  # noqa: E402
+
+
+@pytest.fixture
+def fake_mkvmerge(tmp_path, monkeypatch):
+    """Заглушка mkvmerge первой в PATH и отдельный кэш найденных программ."""
+    monkeypatch.setenv('PATH', _install_fake_mkvmerge(str(tmp_path)) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('PY_MKVMERGE_AUTO_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setenv('FAKE_MKVMERGE_RUNTIME', '0')
+    monkeypatch.delenv('FAKE_MKVMERGE_EXIT_CODE', raising=False)
+    monkeypatch.delenv('FAKE_MKVMERGE_FAIL_EVERY', raising=False)
+
+
+@pytest.fixture
+def library(tmp_path, fake_mkvmerge):
+    """Сериал из шести эпизодов с одной папкой аудио и одной папкой субтитров."""
+    return generate_library(str(tmp_path / 'library'), 6)
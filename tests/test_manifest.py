@@ -0,0 +1,65 @@
+import json
+import os
+
+import manifest
+from manifest import MergeManifest
+
+
+def _make_episode(folder, name):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(name.encode() * 100)
+    return path
+
+
+def test_records_are_appended_and_replayed(tmp_path):
+    folder = str(tmp_path)
+    source = _make_episode(folder, 'source.mkv')
+    outputs = [_make_episode(folder, f'out{i}.mkv') for i in range(3)]
+    merged = MergeManifest(folder)
+    for output in outputs:
+        merged.record(output, [source], ['mkvmerge', output])
+    merged.forget(outputs[1])
+
+    with open(merged.path, encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    # Снимок с первым результатом и по строке на каждое следующее изменение
+    assert len(lines) == 4
+    assert list(json.loads(lines[0])['outputs']) == ['out0.mkv']
+
+    reloaded = MergeManifest(folder)
+    assert reloaded.is_up_to_date(outputs[0], [source], ['mkvmerge', outputs[0]])
+    assert not reloaded.is_up_to_date(outputs[1], [source], ['mkvmerge', outputs[1]])
+    assert reloaded.is_up_to_date(outputs[2], [source], ['mkvmerge', outputs[2]])
+
+
+def test_torn_record_and_compaction(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    source = _make_episode(folder, 'source.mkv')
+    output = _make_episode(folder, 'out.mkv')
+    merged = MergeManifest(folder)
+    merged.record(output, [source], ['mkvmerge'])
+    with open(merged.path, 'a', encoding='utf-8') as f:
+        f.write('{"output": "out.mkv", "ent')
+    assert MergeManifest(folder).is_up_to_date(output, [source], ['mkvmerge'])
+
+    monkeypatch.setattr(manifest, 'MANIFEST_COMPACT_MIN_RECORDS', 2)
+    merged = MergeManifest(folder)
+    # Недописанная строка и две новые записи — больше порога, файл сжимается до снимка
+    for _ in range(2):
+        merged.record(output, [source], ['mkvmerge'])
+    with open(merged.path, encoding='utf-8') as f:
+        assert len(f.read().splitlines()) == 1
+    assert MergeManifest(folder).is_up_to_date(output, [source], ['mkvmerge'])
+
+
+def test_reads_single_document_manifest(tmp_path):
+    folder = str(tmp_path)
+    source = _make_episode(folder, 'source.mkv')
+    output = _make_episode(folder, 'out.mkv')
+    merged = MergeManifest(folder)
+    merged.record(output, [source], ['mkvmerge'])
+    with open(merged.path, 'w', encoding='utf-8') as f:
+        json.dump({'version': manifest.MANIFEST_VERSION_SNAPSHOT, 'outputs': merged._entries},
+                  f, indent=1)
+    assert MergeManifest(folder).is_up_to_date(output, [source], ['mkvmerge'])
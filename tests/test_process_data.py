@@ -0,0 +1,116 @@
+import os
+
+import pytest
+
+import process_data
+from process_data import MkvProcessor
+from job_journal import partial_output_path
+from planner import SPACE_MARGIN_BYTES, SPACE_MARGIN_RATIO, SPACE_POLICY_TRIM, ORDER_NATURAL
+from events import EVENT_JOB_STARTED, EVENT_PROGRESS
+from cli import summarize, EXIT_FAILED
+from generate_library import generate_library
+
+
+def _run(library, **kwargs):
+    processor = MkvProcessor(max_jobs=2, **kwargs)
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'])
+    return processor
+
+
+def _outputs(library):
+    return sorted(name for name in os.listdir(library['output_path']) if name.endswith('.mkv'))
+
+
+def test_exit_code_1_keeps_output(library, monkeypatch):
+    # Код 1 у mkvmerge — предупреждения, результат записан полностью
+    monkeypatch.setenv('FAKE_MKVMERGE_EXIT_CODE', '1')
+    processor = _run(library)
+    assert len(processor.results) == 6
+    assert all(processor.results.values())
+    assert len(_outputs(library)) == 6
+    assert not any(os.path.exists(partial_output_path(os.path.join(library['output_path'], name)))
+                   for name in _outputs(library))
+
+
+def test_exit_code_2_is_failure(library, monkeypatch):
+    monkeypatch.setenv('FAKE_MKVMERGE_EXIT_CODE', '2')
+    processor = _run(library)
+    assert len(processor.results) == 6
+    assert not any(processor.results.values())
+    assert _outputs(library) == []
+
+
+def _episode_bytes(library):
+    """Объём входов одного эпизода: видео и по одной дорожке из каждой папки."""
+    video = sorted(os.listdir(library['series_path']))[0]
+    total = os.path.getsize(os.path.join(library['series_path'], video))
+    for data in library['audio_data'] + library['subtitle_data']:
+        track = sorted(name for name in os.listdir(data['path']) if name.startswith(os.path.splitext(video)[0]))[0]
+        total += os.path.getsize(os.path.join(data['path'], track))
+    return total
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_trimmed_episodes_are_undone(library, monkeypatch, streaming):
+    # Места хватает на четыре эпизода из шести
+    free = SPACE_MARGIN_BYTES + int(4.5 * _episode_bytes(library) * (1 + SPACE_MARGIN_RATIO))
+    monkeypatch.setattr(process_data, 'free_space', lambda path: free)
+    processor = MkvProcessor(max_jobs=2, space_policy=SPACE_POLICY_TRIM, order=ORDER_NATURAL)
+    video_files = None if streaming else [os.path.join(library['series_path'], name)
+                                          for name in os.listdir(library['series_path'])]
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'], video_files=video_files)
+    summary = summarize(processor)
+    assert len(_outputs(library)) == 4
+    assert len(summary['undone']) == 2
+    assert summary['status'] == 'failed'
+    assert summary['exit_code'] == EXIT_FAILED
+
+
+def test_stream_windows_share_one_space_margin(library, monkeypatch):
+    # Места хватает на все шесть эпизодов с одним запасом; окна по четыре эпизода
+    free = SPACE_MARGIN_BYTES + int(6.5 * _episode_bytes(library) * (1 + SPACE_MARGIN_RATIO))
+    monkeypatch.setattr(process_data, 'free_space', lambda path: free)
+    processor = MkvProcessor(max_jobs=1, order=ORDER_NATURAL)
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'])
+    assert summarize(processor)['status'] == 'ok'
+    assert len(_outputs(library)) == 6
+
+
+def test_stream_refuses_before_merging_when_folder_does_not_fit(library, monkeypatch):
+    # Места хватает на первое окно из четырёх эпизодов, но не на всю папку
+    free = SPACE_MARGIN_BYTES + int(4.5 * _episode_bytes(library) * (1 + SPACE_MARGIN_RATIO))
+    monkeypatch.setattr(process_data, 'free_space', lambda path: free)
+    processor = MkvProcessor(max_jobs=1, order=ORDER_NATURAL)
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'])
+    summary = summarize(processor)
+    assert _outputs(library) == []
+    assert summary['status'] == 'error'
+    assert any('Not enough free space' in error for error in summary['errors'])
+
+
+def test_stop_while_streaming_reports_every_episode(tmp_path, fake_mkvmerge):
+    library = generate_library(str(tmp_path / 'library'), 30)
+    processor = MkvProcessor(max_jobs=1)
+    processor.events.subscribe(lambda event: processor.stop() if event.kind == EVENT_JOB_STARTED else None)
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'])
+    summary = summarize(processor)
+    finished = [path for path, result in processor.results.items() if result is not None]
+    assert summary['status'] == 'interrupted'
+    assert len(summary['undone']) + len(finished) == 30
+
+
+def test_stream_progress_has_a_total_from_the_start(tmp_path, fake_mkvmerge):
+    library = generate_library(str(tmp_path / 'library'), 30, size_jitter=0.5)
+    processor = MkvProcessor(max_jobs=2)
+    values = []
+    processor.events.subscribe(lambda event: values.append(event.value) if event.kind == EVENT_PROGRESS else None)
+    processor.process_files(library['series_path'], library['output_path'],
+                            library['audio_data'], library['subtitle_data'])
+    assert values and None not in values
+    assert values == sorted(values)
+    assert values[-1] == 100
@@ -0,0 +1,43 @@
+import threading
+
+from watcher import FolderWatcher
+
+
+class FlakyProcessor:
+    """Первый пакет падает с исключением, следующие собираются."""
+
+    def __init__(self):
+        self.results = {}
+        self.batches = []
+        self.called = threading.Event()
+
+    def process_files(self, series_path, output_path, audio_data, subtitle_data,
+                      video_files=None, refresh_indexes=True):
+        self.batches.append(list(video_files))
+        self.called.set()
+        if len(self.batches) == 1:
+            self.results = {}
+            raise RuntimeError('boom')
+        self.results = {video_file: True for video_file in video_files}
+
+
+def test_merge_loop_survives_a_failing_batch(tmp_path):
+    processor = FlakyProcessor()
+    watcher = FolderWatcher(str(tmp_path), str(tmp_path), [], [],
+                            processor=processor, backend=object())
+    first, second = str(tmp_path / 'e01.mkv'), str(tmp_path / 'e02.mkv')
+    watcher._queued.update((first, second))
+    thread = threading.Thread(target=watcher._merge_loop, daemon=True)
+    thread.start()
+
+    watcher._queue.put(first)
+    assert processor.called.wait(5)
+    watcher._queue.put(second)
+    watcher._queue.put(None)
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert processor.batches == [[first], [second]]
+    # Эпизод упавшего пакета ждёт изменения файлов, следующий собран
+    assert first in watcher._failed and first not in watcher._queued
+    assert second not in watcher._failed
@@ -0,0 +1,228 @@
+"""Сведения о дорожках файлов (`mkvmerge -J`) с постоянным кэшем в SQLite.
+
+Запуск mkvmerge на каждый файл при каждой обработке слишком медленный для больших
+библиотек, поэтому результат сохраняется по ключу путь + размер + mtime и
+перечитывается только у изменившихся файлов. Недостающие файлы опознаются
+параллельно.
+"""
+import os
+import json
+import sqlite3
+import platform
+import threading
+import subprocess
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Tuple
+
+from mkvtoolnix import get_cache_dir
+from mkv_header import identify_info, MATROSKA_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+IDENTIFY_CACHE_FILE = 'identify.sqlite3'
+# Версия формата записи; при изменении разбора старые записи перечитываются
+IDENTIFY_FORMAT_VERSION = 2
+# Типы дорожек mkvmerge -J и соответствующие типы дорожек плана
+TRACK_TYPES = {'video': 'video', 'audio': 'audio', 'subtitles': 'subtitle'}
+
+
+def parse_identify(data: Dict) -> Dict:
+    """Нужная часть вывода `mkvmerge -J`: контейнер и дорожки с языком, кодеком и флагами."""
+    tracks = []
+    for track in data.get('tracks') or []:
+        properties = track.get('properties') or {}
+        tracks.append({
+            'id': track.get('id', 0),
+            'type': TRACK_TYPES.get(track.get('type'), track.get('type')),
+            'codec': track.get('codec', ''),
+            'language': properties.get('language', ''),
+            'language_ietf': properties.get('language_ietf', ''),
+            'name': properties.get('track_name', ''),
+            'default': bool(properties.get('default_track', False)),
+            'forced': bool(properties.get('forced_track', False)),
+        })
+    container = data.get('container') or {}
+    return {'container': container.get('type', ''), 'tracks': tracks}
+
+
+def run_identify(mkvmerge_path: str, path: str) -> Optional[Dict]:
+    """Разобранный вывод `mkvmerge -J path` или None, если файл не распознан."""
+    try:
+        result = subprocess.run(
+            [mkvmerge_path, '-J', path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            creationflags=subprocess.CREATE_NO_WINDOW if platform.system() == 'Windows' else 0
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        logger.warning(f"Unable to identify {path}: {e}")
+        return None
+    # Код 1 — предупреждения, вывод при этом полный
+    if result.returncode > 1:
+        logger.warning(f"mkvmerge could not identify {path}: {result.stdout.strip() or result.stderr.strip()}")
+        return None
+    try:
+        data = json.loads(result.stdout)
+    except ValueError:
+        logger.warning(f"Unexpected mkvmerge -J output for {path}")
+        return None
+    if not (data.get('container') or {}).get('recognized', True):
+        return None
+    return parse_identify(data)
+
+
+def _file_key(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class IdentifyCache:
+    """Кэш сведений о файлах в SQLite; одна строка на путь, устаревшие записи заменяются."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(get_cache_dir(), IDENTIFY_CACHE_FILE)
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # Соединение используется из потоков обработки, доступ сериализуется блокировкой
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                'path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, '
+                'version INTEGER NOT NULL, info TEXT NOT NULL)')
+
+    def get_many(self, keys: Dict[str, Tuple[int, int]]) -> Dict[str, Dict]:
+        """Записи для путей, у которых совпали размер и mtime."""
+        found = {}
+        paths = list(keys)
+        with self._lock:
+            # Ограничение SQLite на число параметров запроса
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT path, size, mtime_ns, version, info FROM files "
+                    f"WHERE path IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                for path, size, mtime_ns, version, info in rows:
+                    if (size, mtime_ns) == keys[path] and version == IDENTIFY_FORMAT_VERSION:
+                        found[path] = json.loads(info)
+        return found
+
+    def put_many(self, entries: List[Tuple[str, Tuple[int, int], Dict]]):
+        with self._lock, self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO files (path, size, mtime_ns, version, info) VALUES (?, ?, ?, ?, ?)',
+                [(path, key[0], key[1], IDENTIFY_FORMAT_VERSION, json.dumps(info, ensure_ascii=False))
+                 for path, key, info in entries])
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+class TrackIdentifier:
+    """Сведения о дорожках файлов: из памяти, из кэша на диске, из заголовка Matroska или через mkvmerge -J."""
+
+    def __init__(self, mkvmerge_path: str, cache: Optional[IdentifyCache] = None, max_workers: int = 4):
+        self.mkvmerge_path = mkvmerge_path
+        self.cache = cache
+        self.max_workers = max(1, max_workers)
+        self._known: Dict[str, Tuple[Tuple[int, int], Optional[Dict]]] = {}
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.identified = 0
+        self.native = 0
+
+    def identify(self, paths: List[str]) -> Dict[str, Dict]:
+        """Сведения о файлах paths; отсутствующие в кэше опознаются параллельно."""
+        keys = {}
+        for path in dict.fromkeys(paths):
+            key = _file_key(path)
+            if key is not None:
+                keys[path] = key
+        result: Dict[str, Dict] = {}
+        with self._lock:
+            for path, key in list(keys.items()):
+                known = self._known.get(path)
+                if known and known[0] == key:
+                    if known[1] is not None:
+                        result[path] = known[1]
+                    del keys[path]
+
+        cached = self.cache.get_many(keys) if self.cache and keys else {}
+        missing = [path for path in keys if path not in cached]
+        identified: Dict[str, Optional[Dict]] = {}
+        if missing:
+            logger.info(f"Identifying {len(missing)} files")
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(missing))) as executor:
+                for path, info in zip(missing, executor.map(self._identify_file, missing)):
+                    identified[path] = info
+            if self.cache:
+                self.cache.put_many([(path, keys[path], info) for path, info in identified.items()
+                                     if info is not None])
+
+        with self._lock:
+            self.cache_hits += len(cached)
+            self.identified += len(missing)
+            for path, info in list(cached.items()) + list(identified.items()):
+                self._known[path] = (keys[path], info)
+                if info is not None:
+                    result[path] = info
+        return result
+
+    def _identify_file(self, path: str) -> Optional[Dict]:
+        # Matroska-файлы разбираются без запуска mkvmerge, остальные — через mkvmerge -J
+        if os.path.splitext(path)[1].lower() in MATROSKA_EXTENSIONS:
+            info = identify_info(path)
+            if info is not None:
+                with self._lock:
+                    self.native += 1
+                return info
+        return run_identify(self.mkvmerge_path, path)
+
+    def get(self, path: str) -> Optional[Dict]:
+        """Уже известные сведения о файле (после identify) или None."""
+        with self._lock:
+            known = self._known.get(path)
+        return known[1] if known else None
+
+
+def first_track(info: Optional[Dict], track_type: str) -> Optional[Dict]:
+    """Первая дорожка нужного типа в файле."""
+    for track in (info or {}).get('tracks', []):
+        if track['type'] == track_type:
+            return track
+    return None
+
+
+def find_duplicate_tracks(video_info: Optional[Dict], tracks: List[Dict]) -> List[Dict]:
+    """Внешние дорожки эпизода, повторяющие дорожку видео или другую внешнюю дорожку.
+
+    Дорожки считаются повторами при совпадении типа, языка и кодека; неизвестный
+    язык (und) не сравнивается.
+    """
+    seen = {}
+    for track in (video_info or {}).get('tracks', []):
+        if track['language'] and track['language'] != 'und':
+            seen.setdefault((track['type'], track['language'], track['codec']), 'video')
+    duplicates = []
+    for track in tracks:
+        if not track.get('codec'):
+            continue
+        language = track.get('language', '')
+        key = (track['type'], language, track['codec'])
+        if not language or language == 'und':
+            continue
+        if key in seen:
+            duplicates.append({'type': track['type'], 'path': track['path'], 'language': language,
+                               'codec': track['codec'], 'duplicate_of': seen[key]})
+        else:
+            seen[key] = track['path']
+    return duplicates
@@ -0,0 +1,379 @@
+"""Наблюдение за папками и автоматическая сборка новых эпизодов.
+
+На Linux используется inotify (через ctypes, без сторонних зависимостей), на остальных
+системах — опрос: папка пересканируется только если изменился её mtime.
+"""
+import os
+import sys
+import time
+import queue
+import ctypes
+import ctypes.util
+import select
+import struct
+import threading
+import logging
+from typing import Optional, List, Dict, Tuple, Set
+
+from process_data import MkvProcessor, TrackIndex, AUDIO_EXTENSIONS, SUBTITLE_EXTENSIONS
+from episode_match import EpisodeKeyIndex, MATCH_NAME, MATCH_EPISODE
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд файлы эпизода не должны меняться, прежде чем эпизод пойдёт в работу
+DEFAULT_SETTLE_SECONDS = 30.0
+# Интервал опроса папок (и проверки готовности эпизодов)
+DEFAULT_POLL_INTERVAL = 2.0
+VIDEO_EXTENSION = '.mkv'
+MERGED_SUFFIX = '_merged.mkv'
+
+# Константы inotify из <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE)
+REMOVE_MASK = IN_MOVED_FROM | IN_DELETE
+INOTIFY_EVENT = struct.Struct('iIII')
+
+# Событие: (папка, имя файла или None при переполнении очереди, файл удалён)
+WatchEvent = Tuple[str, Optional[str], bool]
+
+
+class InotifyBackend:
+    """Получение событий файловой системы через inotify."""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self._dirs: Dict[int, str] = {}
+
+    @staticmethod
+    def available() -> bool:
+        return sys.platform.startswith('linux') and bool(ctypes.util.find_library('c'))
+
+    def add(self, directory: str, names: Optional[Set[str]] = None):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), directory)
+        self._dirs[wd] = directory
+
+    def read(self, timeout: float) -> List[WatchEvent]:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            raw_name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                events.extend((directory, None, False) for directory in self._dirs.values())
+                continue
+            directory = self._dirs.get(wd)
+            if directory is None or mask & IN_ISDIR or not raw_name:
+                continue
+            events.append((directory, os.fsdecode(raw_name), bool(mask & REMOVE_MASK)))
+        return events
+
+    def close(self):
+        os.close(self._fd)
+
+
+class PollingBackend:
+    """Опрос папок: содержимое пересканируется только при изменении mtime папки."""
+
+    def __init__(self):
+        self._dirs: Dict[str, Tuple[int, Set[str]]] = {}
+
+    def add(self, directory: str, names: Optional[Set[str]] = None):
+        if names is None:
+            names = self._list(directory)
+        self._dirs[directory] = (os.stat(directory).st_mtime_ns, set(names))
+
+    @staticmethod
+    def _list(directory: str) -> Set[str]:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+
+    def read(self, timeout: float) -> List[WatchEvent]:
+        time.sleep(timeout)
+        events = []
+        for directory, (mtime_ns, names) in list(self._dirs.items()):
+            try:
+                current_mtime = os.stat(directory).st_mtime_ns
+                if current_mtime == mtime_ns:
+                    continue
+                current = self._list(directory)
+            except OSError as e:
+                logger.warning(f"Unable to poll {directory}: {e}")
+                continue
+            events.extend((directory, name, False) for name in current - names)
+            events.extend((directory, name, True) for name in names - current)
+            self._dirs[directory] = (current_mtime, current)
+        return events
+
+    def close(self):
+        self._dirs.clear()
+
+
+def create_backend():
+    """inotify там, где он доступен, иначе опрос."""
+    if InotifyBackend.available():
+        try:
+            return InotifyBackend()
+        except OSError as e:
+            logger.warning(f"inotify unavailable, falling back to polling: {e}")
+    return PollingBackend()
+
+
+class FolderWatcher:
+    """Долгоживущий режим: сборка эпизода, как только все его дорожки на месте и не растут.
+
+    Папка сериала и папки дорожек сканируются один раз при запуске, дальше состояние
+    обновляется по событиям. Проверка готовности выполняется не чаще раза за интервал
+    опроса, так что серии событий от копирования большого файла схлопываются.
+    """
+
+    def __init__(self, series_path: str, output_path: str,
+                 audio_data: List[Dict], subtitle_data: List[Dict],
+                 processor: Optional[MkvProcessor] = None,
+                 settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 backend=None):
+        self.series_path = os.path.normpath(series_path)
+        self.output_path = output_path
+        self.audio_data = audio_data
+        self.subtitle_data = subtitle_data
+        self.processor = processor or MkvProcessor(incremental=True)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.backend = backend or create_backend()
+
+        # Папка дорожек -> индексы (одна папка может быть и аудио, и субтитрами); по имени
+        # и по ключу эпизода — в зависимости от match_mode процессора
+        self._indexes: Dict[str, List] = {}
+        self._videos: Set[str] = set()
+        # Последние увиденные (размер, mtime, время последнего изменения) файлов эпизодов
+        self._observed: Dict[str, Tuple[int, int, float]] = {}
+        self._queued: Set[str] = set()
+        self._failed: Dict[str, Tuple] = {}
+        self._lock = threading.Lock()
+        self._queue: 'queue.Queue[Optional[str]]' = queue.Queue()
+        self._stop = threading.Event()
+        self._merge_thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _is_video(name: str) -> bool:
+        lower = name.lower()
+        return lower.endswith(VIDEO_EXTENSION) and not lower.endswith(MERGED_SUFFIX)
+
+    def _initial_scan(self):
+        with os.scandir(self.series_path) as entries:
+            names = {entry.name for entry in entries}
+        self._videos = {os.path.join(self.series_path, name) for name in names if self._is_video(name)}
+        self.backend.add(self.series_path, names)
+
+        sources = [(data, AUDIO_EXTENSIONS) for data in self.audio_data]
+        sources += [(data, SUBTITLE_EXTENSIONS) for data in self.subtitle_data]
+        for data, extensions in sources:
+            track_dir = os.path.normpath(data.get('path'))
+            first = track_dir not in self._indexes
+            indexes = self._indexes.setdefault(track_dir, [])
+            if any(index.extensions == extensions for index in indexes):
+                continue
+            for index in self._new_indexes(track_dir, extensions):
+                indexes.append(index)
+                self.processor.use_track_index(index)
+            if first and track_dir != self.series_path:
+                with os.scandir(track_dir) as entries:
+                    self.backend.add(track_dir, {entry.name for entry in entries})
+        logger.info(f"Watching {len(self._indexes) + 1} directories, {len(self._videos)} videos found")
+
+    def _new_indexes(self, track_dir: str, extensions: List[str]) -> List:
+        """Индексы папки дорожек, нужные для сопоставления в режиме match_mode процессора."""
+        indexes = []
+        if self.processor.match_mode != MATCH_EPISODE:
+            indexes.append(TrackIndex(track_dir, extensions))
+        if self.processor.match_mode != MATCH_NAME:
+            indexes.append(EpisodeKeyIndex(track_dir, extensions, self.processor.episode_patterns))
+        return indexes
+
+    def _apply(self, events: List[WatchEvent]):
+        for directory, name, removed in events:
+            if name is None:
+                self._rescan(directory)
+                continue
+            path = os.path.join(directory, name)
+            # Папка сериала может одновременно быть и папкой дорожек
+            if directory == self.series_path and self._is_video(name):
+                if removed:
+                    self._videos.discard(path)
+                    self._observed.pop(path, None)
+                else:
+                    self._videos.add(path)
+            if directory in self._indexes:
+                exists = not removed and os.path.isfile(path)
+                for index in self._indexes[directory]:
+                    if exists:
+                        index.add(path)
+                    else:
+                        index.discard(path)
+                if not exists:
+                    self._observed.pop(path, None)
+
+    def _rescan(self, directory: str):
+        """Полное пересканирование одной папки (только после переполнения очереди inotify)."""
+        logger.warning(f"Event queue overflow, rescanning {directory}")
+        if directory == self.series_path:
+            with os.scandir(directory) as entries:
+                self._videos = {entry.path for entry in entries if self._is_video(entry.name)}
+        if directory in self._indexes:
+            extensions = []
+            for index in self._indexes[directory]:
+                if index.extensions not in extensions:
+                    extensions.append(index.extensions)
+            self._indexes[directory] = [index for exts in extensions
+                                        for index in self._new_indexes(directory, exts)]
+            for index in self._indexes[directory]:
+                self.processor.use_track_index(index)
+
+    def _episode_files(self, video_file: str) -> Optional[List[str]]:
+        """Видео и все ожидаемые дорожки эпизода или None, если чего-то не хватает."""
+        base_name = os.path.splitext(os.path.basename(video_file))[0]
+        files = [video_file]
+        sources = [(data, AUDIO_EXTENSIONS) for data in self.audio_data]
+        sources += [(data, SUBTITLE_EXTENSIONS) for data in self.subtitle_data]
+        for data, extensions in sources:
+            track = self._find_track(os.path.normpath(data.get('path')), extensions, base_name)
+            if not track:
+                return None
+            files.append(track)
+        return files
+
+    def _find_track(self, track_dir: str, extensions: List[str], base_name: str) -> Optional[str]:
+        """Дорожка эпизода так же, как её найдёт MkvProcessor._match_track: по имени,
+        по ключу эпизода (единственный кандидат) или сначала по имени, затем по ключу."""
+        for index in self._indexes[track_dir]:
+            if index.extensions != extensions:
+                continue
+            track = index.find(base_name)
+            if track:
+                return track
+        return None
+
+    def _is_settled(self, files: List[str], now: float) -> Optional[Tuple]:
+        """Подпись файлов эпизода, если ни один из них не менялся settle_seconds."""
+        signature = []
+        settled = True
+        for path in files:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            previous = self._observed.get(path)
+            if previous and previous[:2] == (stat.st_size, stat.st_mtime_ns):
+                changed_at = previous[2]
+            else:
+                # Для давно лежащих файлов отсчёт идёт от mtime, а не от запуска наблюдения
+                changed_at = now if previous else min(now, stat.st_mtime_ns / 1e9)
+                self._observed[path] = (stat.st_size, stat.st_mtime_ns, changed_at)
+            if now - changed_at < self.settle_seconds:
+                settled = False
+            signature.append((path, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature) if settled else None
+
+    def _check_pending(self):
+        now = time.time()
+        with self._lock:
+            candidates = sorted(self._videos - self._queued)
+        for video_file in candidates:
+            files = self._episode_files(video_file)
+            if not files:
+                continue
+            signature = self._is_settled(files, now)
+            if not signature:
+                continue
+            with self._lock:
+                if self._failed.get(video_file) == signature:
+                    continue
+                self._queued.add(video_file)
+            logger.info(f"Episode ready: {os.path.basename(video_file)}")
+            self._queue.put(video_file)
+
+    def _merge_loop(self):
+        while not self._stop.is_set():
+            video_file = self._queue.get()
+            if video_file is None:
+                break
+            # Все готовые к этому моменту эпизоды собираются одним пакетом
+            batch = [video_file]
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._stop.set()
+                    break
+                batch.append(item)
+            try:
+                self.processor.process_files(self.series_path, self.output_path,
+                                             self.audio_data, self.subtitle_data,
+                                             video_files=batch, refresh_indexes=False)
+            except Exception:
+                # Ошибка одного пакета не должна останавливать наблюдение:
+                # его эпизоды считаются неудачными и ждут изменения файлов
+                logger.exception(f"Merging {len(batch)} new episode(s) failed")
+            with self._lock:
+                for item in batch:
+                    if self.processor.results.get(item) is not True:
+                        # Повторная попытка только после изменения файлов эпизода
+                        self._queued.discard(item)
+                        files = self._episode_files(item) or []
+                        self._failed[item] = tuple(
+                            (path,) + self._observed.get(path, (None, None))[:2] for path in files)
+
+    def run(self):
+        """Блокирующий цикл наблюдения до вызова stop()."""
+        for path in [self.series_path, self.output_path] + [d.get('path') for d in self.audio_data + self.subtitle_data]:
+            if not os.path.isdir(path):
+                raise FileNotFoundError(f"Directory not found: {path}")
+        self._initial_scan()
+        self._merge_thread = threading.Thread(target=self._merge_loop, name='merge', daemon=True)
+        self._merge_thread.start()
+        next_check = 0.0
+        try:
+            while not self._stop.is_set():
+                # События применяются сразу, готовность проверяется не чаще раза за интервал
+                timeout = max(0.0, next_check - time.monotonic())
+                self._apply(self.backend.read(timeout))
+                if time.monotonic() >= next_check:
+                    self._check_pending()
+                    next_check = time.monotonic() + self.poll_interval
+        finally:
+            self._queue.put(None)
+            self._merge_thread.join()
+            self.backend.close()
+
+    def stop(self):
+        self._stop.set()
+        self.processor.stop()